@@ -0,0 +1,72 @@
+# Shared by include.python.script.function_call_run.py and include.python.script.function_call_evaluate.py; each pulls this file in with an
+# "@include.python.function_call_adapter.py" line, expanded when the CLI loads the script.
+
+import inspect
+
+def create_call_adapter(fn):
+    """Inspect fn's signature once and return (style, adapter).
+
+    The adapter maps a dataset row to the (args, kwargs) fn should be called with:
+    - "messages": fn takes messages (or **kwargs), and requires nothing but messages/stream/session_state/context;
+      it gets those
+    - "question": fn takes a single required positional parameter, or only *args; it gets the question
+    - "fields": anything else; each parameter is filled from the row field of the same name
+    """
+
+    try:
+        params = inspect.signature(fn).parameters
+    except (TypeError, ValueError):
+        params = None
+
+    chat_params = ("messages", "stream", "session_state", "context")
+    variadic_kinds = (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD)
+    has_var_keyword = params is None or any(p.kind == inspect.Parameter.VAR_KEYWORD for p in params.values())
+    has_var_positional = params is not None and any(p.kind == inspect.Parameter.VAR_POSITIONAL for p in params.values())
+    required_names = [] if params is None else [p.name for p in params.values() if p.default is inspect.Parameter.empty and p.kind not in variadic_kinds]
+
+    # **kwargs alone doesn't make a chat function: it must not require anything the chat parameters don't cover
+    if (has_var_keyword or "messages" in params) and all(name in chat_params for name in required_names):
+        accepted = chat_params if has_var_keyword else [name for name in chat_params if name in params]
+
+        def messages_adapter(messages_field, stream_field, session_field, context_field, question_field, kwargs):
+
+            # Copy the messages so the dataset row itself is never modified
+            messages = list(kwargs[messages_field]) if messages_field in kwargs else []
+            question = kwargs[question_field] if question_field in kwargs else None
+            if question is not None:
+                messages.append({"role": "user", "content": question})
+
+            stream = kwargs[stream_field] if stream_field in kwargs else False
+            session_state = kwargs[session_field] if session_field in kwargs else None
+            context = kwargs[context_field] if context_field in kwargs else {}
+
+            values = { "messages": messages, "stream": stream, "session_state": session_state, "context": context }
+            return (), { name: values[name] for name in accepted }
+
+        return "messages", messages_adapter
+
+    positional_kinds = (inspect.Parameter.POSITIONAL_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD)
+    required = [p for p in params.values() if p.default is inspect.Parameter.empty and p.kind in positional_kinds]
+    known_fields = ("question", "stream", "session_state", "context")
+
+    if (len(required) == 1 and required[0].name not in known_fields) or (not required_names and has_var_positional):
+
+        def question_adapter(messages_field, stream_field, session_field, context_field, question_field, kwargs):
+            return (kwargs[question_field] if question_field in kwargs else None,), {}
+
+        return "question", question_adapter
+
+    def fields_adapter(messages_field, stream_field, session_field, context_field, question_field, kwargs):
+        field_names = { "question": question_field, "stream": stream_field, "session_state": session_field, "context": context_field }
+        fn_kwargs = {}
+        for name, p in params.items():
+            if p.kind not in positional_kinds and p.kind != inspect.Parameter.KEYWORD_ONLY:
+                continue
+            field = field_names.get(name, name)
+            if field in kwargs:
+                fn_kwargs[name] = kwargs[field]
+            elif p.default is inspect.Parameter.empty:
+                raise Exception("Missing field for parameter '" + name + "': " + field)
+        return (), fn_kwargs
+
+    return "fields", fields_adapter
@@ -0,0 +1,24 @@
+# Shared by include.python.script.function_call.py and include.python.script.function_call_run.py; each pulls this file in with an
+# "@include.python.function_call_chunks.py" line, expanded when the CLI loads the script.
+
+def is_openai_stream(result):
+    return type(result).__name__ in ("Stream", "AsyncStream") and type(result).__module__.startswith("openai")
+
+def get_chunk_text(chunk):
+    """Return the text of one streamed item: a string as is, the delta of an openai chat chunk, or str() of anything else."""
+
+    if isinstance(chunk, str):
+        return chunk
+
+    choices = chunk.get("choices") if isinstance(chunk, dict) else getattr(chunk, "choices", None)
+    if choices:
+        choice = choices[0]
+        delta = choice.get("delta") if isinstance(choice, dict) else getattr(choice, "delta", None)
+        if delta is not None:
+            content = delta.get("content") if isinstance(delta, dict) else getattr(delta, "content", None)
+            return content or ""
+        text = choice.get("text") if isinstance(choice, dict) else getattr(choice, "text", None)
+        if text is not None:
+            return text
+
+    return str(chunk)
@@ -0,0 +1,212 @@
+# Shared by include.python.script.function_call_run.py and include.python.script.function_call_evaluate.py; each pulls this file in with an
+# "@include.python.function_call_datasets.py" line, expanded when the CLI loads the script.
+
+import gzip
+import hashlib
+import inspect
+import io
+import json
+import os
+import pathlib
+import random
+import time
+
+def get_dataset_format(path):
+    """Return (format, compression) from the file name, e.g. "data.jsonl.gz" is ("jsonl", "gzip")."""
+
+    name = str(path).lower()
+    compression = None
+    for suffix, codec in [(".gz", "gzip"), (".zst", "zstd"), (".zstd", "zstd")]:
+        if name.endswith(suffix):
+            name, compression = name[:-len(suffix)], codec
+            break
+
+    if name.endswith(".parquet"):
+        if compression is not None:
+            raise Exception("Compressed Parquet files are not supported: " + str(path))
+        return "parquet", None
+    if name.endswith(".csv"):
+        return "csv", compression
+    return "jsonl", compression
+
+def open_dataset_file(path, compression):
+    """Open a text dataset for reading, decompressing it on the fly."""
+
+    if compression == "gzip":
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception("Reading zstd-compressed datasets requires zstandard; install it with `pip install zstandard`")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True), encoding="utf-8", newline="")
+    return open(path, "r", newline="")
+
+def project_row(d, fields):
+    return d if fields is None else { key: value for key, value in d.items() if key in fields }
+
+def get_dataset_fields(fn, fields):
+    """Return the row fields a call to fn can read: the given field names plus fn's parameter names."""
+
+    try:
+        params = inspect.signature(fn).parameters
+    except (TypeError, ValueError):
+        params = {}
+    variadic = (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD)
+    return set(fields) | { name for name, p in params.items() if p.kind not in variadic }
+
+def iter_jsonl(path, fields = None):
+    _, compression = get_dataset_format(path)
+    with open_dataset_file(path, compression) as f:
+        for line in f:
+            if line.strip():
+                yield project_row(json.loads(line), fields)
+
+def iter_csv(path, fields = None, json_fields = ()):
+    """Yield CSV records as dicts; cells of `json_fields` (e.g. messages) hold JSON and are decoded."""
+
+    import csv
+    _, compression = get_dataset_format(path)
+    with open_dataset_file(path, compression) as f:
+        for record in csv.DictReader(f):
+            d = project_row(record, fields)
+            for field in json_fields:
+                if field in d:
+                    if d[field]:
+                        d[field] = json.loads(d[field])
+                    else:
+                        del d[field]
+            yield d
+
+def iter_parquet(path, fields = None, batch_size = 1024):
+    """Yield Parquet rows as dicts, reading only the columns in `fields`, one batch at a time."""
+
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception("Reading Parquet datasets requires pyarrow; install it with `pip install pyarrow`")
+
+    parquet = pq.ParquetFile(path)
+    columns = None if fields is None else [name for name in parquet.schema_arrow.names if name in fields]
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+        # Nulls are dropped, so a missing value looks the same as it does in JSONL
+        for d in batch.to_pylist():
+            yield { key: value for key, value in d.items() if value is not None }
+
+def load_jsonl(path):
+    return list(iter_jsonl(path))
+
+def iter_dataset(dataset_or_path, fields = None, json_fields = ()):
+    """Iterate the rows of a dataset list or file (JSONL, CSV or Parquet; JSONL and CSV may be .gz or .zst).
+
+    With `fields`, rows read from files only keep those fields, and Parquet files only read those columns.
+    """
+
+    if isinstance(dataset_or_path, str):
+        path = pathlib.Path.cwd() / dataset_or_path
+        format, _ = get_dataset_format(path)
+        if format == "parquet":
+            return iter_parquet(path, fields)
+        if format == "csv":
+            return iter_csv(path, fields, json_fields)
+        return iter_jsonl(path, fields)
+    return iter(dataset_or_path)
+
+def count_rows(dataset_or_path):
+    if isinstance(dataset_or_path, str):
+        path = pathlib.Path.cwd() / dataset_or_path
+        format, compression = get_dataset_format(path)
+        if format == "parquet":
+            import pyarrow.parquet as pq
+            return pq.ParquetFile(path).metadata.num_rows
+        if format == "csv":
+            import csv
+            with open_dataset_file(path, compression) as f:
+                return max(0, sum(1 for record in csv.reader(f) if record) - 1)
+        with open_dataset_file(path, compression) as f:
+            return sum(1 for line in f if line.strip())
+    return len(dataset_or_path)
+
+def parse_shard(shard):
+    """Parse "i/n" (zero-based shard i of n) into an (i, n) tuple."""
+
+    try:
+        i, n = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise Exception("Invalid shard: " + shard + " (expected i/n, e.g. 0/4)")
+    if n < 1 or i < 0 or i >= n:
+        raise Exception("Invalid shard: " + shard + " (expected 0 <= i < n)")
+    return i, n
+
+def select_rows(dataset_or_path, shard = None, sample = None, seed = 0, fields = None, json_fields = ()):
+    """Yield (index, row) pairs for the rows picked by sample and shard, in input order.
+
+    The sample is drawn first, from row indices only, so every shard sees the same sample; the
+    shard then takes its contiguous slice of it. Concatenating the outputs of shards 0..n-1
+    therefore gives the same rows, in the same order, as an unsharded run.
+    """
+
+    if shard is None and sample is None:
+        yield from enumerate(iter_dataset(dataset_or_path, fields, json_fields))
+        return
+
+    total = count_rows(dataset_or_path)
+    indices = range(total)
+    if sample is not None and sample < total:
+        indices = sorted(random.Random(seed).sample(indices, sample))
+    if shard is not None:
+        i, n = shard
+        indices = indices[len(indices) * i // n : len(indices) * (i + 1) // n]
+
+    if len(indices) == 0:
+        return
+
+    wanted = indices if isinstance(indices, range) else set(indices)
+    last = indices[-1]
+    for index, d in enumerate(iter_dataset(dataset_or_path, fields, json_fields)):
+        if index in wanted:
+            yield index, d
+        if index >= last:
+            break
+
+class Checkpoint:
+    """Records the answer of every completed row so an interrupted run can be resumed.
+
+    Each line of the checkpoint file is {"index": ..., "hash": ..., "answer": ...}. A row is only
+    considered done when both its index and the hash of its content match, so a checkpoint
+    written for a different dataset is never applied by accident.
+    """
+
+    def __init__(self, path, resume = False):
+        self.path = path
+        self.answers = {}
+        self.resumed = 0
+
+        if resume and os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last line may be cut short if the previous run was killed mid-write
+                        continue
+                    self.answers[(entry["index"], entry["hash"])] = entry["answer"]
+
+        self.file = open(path, "a" if resume else "w")
+
+    @staticmethod
+    def hash_row(d):
+        return hashlib.sha256(json.dumps(d, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, index, row_hash):
+        return self.answers.get((index, row_hash))
+
+    def record(self, index, row_hash, answer):
+        # Rows that produced no answer (e.g. a swallowed exception) are retried on resume
+        if answer is None:
+            return
+        self.file.write(json.dumps({ "index": index, "hash": row_hash, "answer": answer }) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
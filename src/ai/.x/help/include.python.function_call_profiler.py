@@ -0,0 +1,147 @@
+# Shared by include.python.script.function_call.py and include.python.script.function_call_run.py; each pulls this file in with an
+# "@include.python.function_call_profiler.py" line, expanded when the CLI loads the script.
+
+import contextlib
+import cProfile
+import importlib
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+class ImportTimer:
+    """Times every module imported while installed, in the format of `python -X importtime`."""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lines = []
+        self.original_import = None
+        self.original_import_module = None
+
+    def timed(self, name, load):
+        if name in sys.modules:
+            return load()
+
+        stack = self.local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return load()
+        finally:
+            cumulative = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += cumulative
+            self.lines.append((name, len(stack), int((cumulative - children) * 1e6), int(cumulative * 1e6)))
+
+    def install(self):
+        import builtins
+        self.original_import = builtins.__import__
+        self.original_import_module = importlib.import_module
+
+        def timed_import(name, globals = None, locals = None, fromlist = (), level = 0):
+            return self.timed(name, lambda: self.original_import(name, globals, locals, fromlist, level)) if level == 0 else self.original_import(name, globals, locals, fromlist, level)
+
+        def timed_import_module(name, package = None):
+            return self.timed(name, lambda: self.original_import_module(name, package))
+
+        builtins.__import__ = timed_import
+        importlib.import_module = timed_import_module
+
+    def uninstall(self):
+        import builtins
+        builtins.__import__ = self.original_import
+        importlib.import_module = self.original_import_module
+
+class Profiler:
+    """Profiles target calls for --profile, adding up what every thread that runs a call records.
+
+    - "cpu": cProfile, written as <base>.pstats
+    - "memory": tracemalloc, written as <base>.tracemalloc (a snapshot; load with tracemalloc.Snapshot.load)
+    - "imports": per-module import times, written as <base>.importtime.txt
+    """
+
+    SUFFIXES = { "cpu": ".pstats", "memory": ".tracemalloc", "imports": ".importtime.txt" }
+
+    def __init__(self, kinds, base_path, top = 20):
+        self.kinds = list(dict.fromkeys(kinds))
+        self.files = { kind: base_path + self.SUFFIXES[kind] for kind in self.kinds }
+        self.top = top
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.profiles = []
+        self.main_profile = None
+        self.memory_start = None
+        self.import_timer = None
+
+    def enable_thread_profile(self):
+        if getattr(self.local, "profile", None) is None:
+            self.local.profile = cProfile.Profile()
+            with self.lock:
+                self.profiles.append(self.local.profile)
+        try:
+            self.local.profile.enable()
+            return self.local.profile
+        except ValueError:
+            # Python 3.12+ allows one active profiler per process, and that one already sees every thread
+            return None
+
+    @contextlib.contextmanager
+    def thread_call(self):
+        """Profile a call made on a worker thread; calls on the main thread are covered by start()."""
+        profile = None
+        if "cpu" in self.kinds and threading.current_thread() is not threading.main_thread():
+            profile = self.enable_thread_profile()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+
+    def start(self):
+        if "memory" in self.kinds:
+            tracemalloc.start(25)
+            self.memory_start = tracemalloc.take_snapshot()
+        if "imports" in self.kinds:
+            self.import_timer = ImportTimer()
+            self.import_timer.install()
+        if "cpu" in self.kinds:
+            self.main_profile = self.enable_thread_profile()
+
+    def stop(self):
+        """Stop profiling, write the profile files and print the top entries of each."""
+
+        if self.main_profile is not None:
+            self.main_profile.disable()
+
+        # Memory goes first, so the snapshot doesn't include what the other profiles allocate below
+        if "memory" in self.kinds:
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            snapshot.dump(self.files["memory"])
+            ignored = [tracemalloc.Filter(False, module.__file__) for module in (tracemalloc, cProfile, pstats)] + [tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+            differences = snapshot.filter_traces(ignored).compare_to(self.memory_start.filter_traces(ignored), "lineno")
+            print(f"Memory profile: {self.files['memory']} (peak traced {peak / 1024 / 1024:.1f} MB; top {self.top} allocation sites by growth)")
+            for difference in differences[:self.top]:
+                print(f"  {difference}")
+
+        if "cpu" in self.kinds:
+            stats = pstats.Stats(*self.profiles)
+            stats.dump_stats(self.files["cpu"])
+            print(f"CPU profile: {self.files['cpu']} (top {self.top} by cumulative time)")
+            print(f"{'cumulative ms':>14} {'own ms':>10} {'calls':>8}  function")
+            for func, (_, calls, own, cumulative, _) in sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:self.top]:
+                print(f"{cumulative * 1000:>14.1f} {own * 1000:>10.1f} {calls:>8}  {pstats.func_std_string(func)}")
+
+        if "imports" in self.kinds:
+            self.import_timer.uninstall()
+            lines = self.import_timer.lines
+            with open(self.files["imports"], "w") as f:
+                f.write("import time: self [us] | cumulative | imported package\n")
+                for name, depth, own, cumulative in lines:
+                    f.write(f"import time: {own:>9} | {cumulative:>10} | {'  ' * depth}{name}\n")
+            print(f"Import profile: {self.files['imports']} ({len(lines)} modules; top {self.top} by cumulative time)")
+            for name, _, own, cumulative in sorted(lines, key=lambda line: line[3], reverse=True)[:self.top]:
+                print(f"{cumulative / 1000:>10.1f} ms {own / 1000:>10.1f} ms own  {name}")
@@ -1,10 +1,12 @@
 import asyncio
 import argparse
+import contextlib
 import importlib
 import inspect
 import json
 import os
 import sys
+import time
 from typing import Any, List, Dict, Generator
 
 async def ensure_and_strip_module_path(module_path) -> str:
@@ -37,15 +39,27 @@ async def ensure_and_strip_module_path(module_path) -> str:
 
     raise ModuleNotFoundError("Module not found: " + module_path)
 
-async def call_async_function(module_path: str, function_name: str, json_params: str):
-    try:
-        module_name = await ensure_and_strip_module_path(module_path)
+_function_cache = {}
+
+async def resolve_function(module_path: str, function_name: str):
+    key = module_path + ":" + function_name
+    if key in _function_cache:
+        return _function_cache[key]
+
+    module_name = await ensure_and_strip_module_path(module_path)
 
-        # Import the module
-        target_module = importlib.import_module(module_name)
+    # Import the module
+    target_module = importlib.import_module(module_name)
 
-        # Use inspect to find the function by name
-        target_function = getattr(target_module, function_name)
+    # Use inspect to find the function by name
+    target_function = getattr(target_module, function_name)
+
+    _function_cache[key] = target_function
+    return target_function
+
+async def call_async_function(module_path: str, function_name: str, json_params: str):
+    try:
+        target_function = await resolve_function(module_path, function_name)
 
         # Check if the target_function is a coroutine function
         if asyncio.iscoroutinefunction(target_function):
@@ -88,16 +102,198 @@ async def call_async_function(module_path: str, function_name: str, json_params:
         print("Invalid JSON parameter: " + json_params)
         raise
 
-def ensure_args() -> list:
+# Results that arrive piece by piece, and what goes between pieces: generator items are lines,
+# while openai stream chunks are fragments of one message
+STREAM_SEPARATORS = {
+    "it's a generator": "\n",
+    "it's an async generator": "\n",
+    "it's a stream": ""
+}
+
+@include.python.function_call_chunks.py
+
+def format_result(result):
+    """Return a (kind, lines) tuple describing how to print the result."""
+
+    if isinstance(result, str):
+        return "it's a string", [result]
+
+    elif isinstance(result, list) and all(isinstance(item, str) for item in result):
+        return "it's a list", result
+
+    # if it's an openai 1.x Stream or AsyncStream
+    elif is_openai_stream(result):
+        return "it's a stream", result
+
+    # if it's a generator
+    elif issubclass(type(result), Generator) :
+        return "it's a generator", result
+
+    # if it's an async generator
+    elif inspect.isasyncgen(result):
+        return "it's an async generator", result
+
+    # if the "openai.openai_object.OpenAIObject"
+    elif (type(result).__name__ == "OpenAIObject"):
+        return "it's an OpenAIObject", [result.choices[0].message.content]
+
+    # if it's a dictionary that has a "choices" key
+    elif (isinstance(result, dict) and "choices" in result):
+        return "it's a dictionary with a 'choices' key", [result["choices"][0]["message"]["content"]]
+
+    else:
+        return "it's something else", [type(result), result]
+
+async def iter_chunks(lines):
+    """Yield the text of each streamed item as soon as it arrives, from sync or async iterables."""
+
+    if hasattr(lines, "__aiter__"):
+        async for chunk in lines:
+            yield get_chunk_text(chunk)
+    else:
+        for chunk in lines:
+            yield get_chunk_text(chunk)
+
+async def emit_chunks(lines, separator, start, write):
+    """Pass each chunk's text to `write` as it arrives; return (all text, time to first chunk in ms)."""
+
+    texts = []
+    time_to_first_chunk_ms = None
+    async for text in iter_chunks(lines):
+        if time_to_first_chunk_ms is None:
+            time_to_first_chunk_ms = round((time.perf_counter() - start) * 1000, 3)
+        texts.append(text)
+        write(text)
+    return separator.join(texts), time_to_first_chunk_ms
+
+async def worker_call(request: dict, out = None) -> dict:
+    if not isinstance(request, dict):
+        return { "id": None, "ok": False, "error": "Invalid request, expected a JSON object: " + json.dumps(request), "exception": "TypeError" }
+
+    response = { "id": request.get("id") }
+    try:
+        module_function_parts = request["function"].rsplit(":", 1)
+        if len(module_function_parts) != 2:
+            raise ValueError("Invalid argument format. Please use MODULE:FUNCTION.")
+
+        # Anything the target function prints goes to stderr, so stdout only carries responses
+        with contextlib.redirect_stdout(sys.stderr):
+            params = request.get("parameters", {})
+            json_params = params if isinstance(params, str) else json.dumps(params)
+            start = time.perf_counter()
+            result = await call_async_function(module_function_parts[0], module_function_parts[1], json_params)
+
+            if result is not None:
+                kind, lines = format_result(result)
+                response["kind"] = kind
+                if kind in STREAM_SEPARATORS:
+
+                    # With "stream": true, each chunk is also sent on its own line ahead of the response
+                    def write_chunk(text):
+                        if request.get("stream") and out is not None:
+                            out.write(json.dumps({ "id": request.get("id"), "chunk": text }) + "\n")
+                            out.flush()
+
+                    response["result"], response["time_to_first_chunk_ms"] = await emit_chunks(lines, STREAM_SEPARATORS[kind], start, write_chunk)
+                else:
+                    response["result"] = "\n".join(str(line) for line in lines)
+            else:
+                response["result"] = None
+
+        response["ok"] = True
+
+    except Exception as e:
+        response["ok"] = False
+        response["error"] = str(e)
+        response["exception"] = type(e).__name__
+
+    return response
+
+async def run_worker():
+    """Serve newline-delimited JSON requests on stdin until EOF.
+
+    Each request looks like {"id": 1, "function": "MODULE:FUNCTION", "parameters": {...}}
+    and gets exactly one JSON response line on stdout. Requests with "stream": true whose
+    function streams its result also get a {"id": 1, "chunk": "..."} line per chunk first.
+    Imported modules and resolved functions are cached, and every call runs on this same
+    event loop.
+    """
+
+    loop = asyncio.get_running_loop()
+    out = sys.stdout
+
+    while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            break
+
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError:
+            response = { "id": None, "ok": False, "error": "Invalid JSON request: " + line, "exception": "JSONDecodeError" }
+        else:
+            response = await worker_call(request, out)
+
+        out.write(json.dumps(response) + "\n")
+        out.flush()
+
+@include.python.function_call_profiler.py
+
+def ensure_args():
     parser = argparse.ArgumentParser(description="Call a function (async or not) in a module with specified parameters.")
-    parser.add_argument("--function", required=True, help="Module and function name in the format MODULE:FUNCTION.")
+    parser.add_argument("--function", required=False, help="Module and function name in the format MODULE:FUNCTION.")
     parser.add_argument("--parameters", default="{}", help="JSON string containing parameters.")
+    parser.add_argument("--timing", action="store_true", help="After the result, print the time to the first streamed chunk and the total time to stderr.")
+    parser.add_argument("--profile", nargs="+", choices=list(Profiler.SUFFIXES), required=False, help="Profile the call: cpu (cProfile), memory (tracemalloc) and/or imports (import times).")
+    parser.add_argument("--profile-output", default="function_call_profile", help="Base path of the profile files; each kind adds its own extension.")
+    parser.add_argument("--worker", action="store_true", help="Stay alive and serve newline-delimited JSON requests from stdin.")
     args = parser.parse_args()
 
-    return args.function, args.parameters
+    if not args.worker and args.function is None:
+        parser.error("the following arguments are required: --function")
+    if args.worker and args.profile is not None:
+        parser.error("--profile cannot be combined with --worker")
+
+    return args
+
+async def call_and_print(module_name, function_name, json_params, timing):
+    start = time.perf_counter()
+    result = await call_async_function(module_name, function_name, json_params)
+
+    time_to_first_chunk_ms = None
+    if result is not None:
+        kind, lines = format_result(result)
+        print("---" + kind + "---", flush=True)
+        if kind in STREAM_SEPARATORS:
+            separator = STREAM_SEPARATORS[kind]
+
+            # Each chunk is flushed as soon as it arrives, so callers can show it right away
+            def write_chunk(text):
+                sys.stdout.write(text + separator if separator else text)
+                sys.stdout.flush()
+
+            _, time_to_first_chunk_ms = await emit_chunks(lines, separator, start, write_chunk)
+            if not separator:
+                print(flush=True)
+        else:
+            for line in lines:
+                print(line)
+
+    if timing:
+        total_ms = round((time.perf_counter() - start) * 1000, 3)
+        print(f"time_to_first_chunk_ms={time_to_first_chunk_ms} total_ms={total_ms}", file=sys.stderr)
 
 async def main():
-    function, json_params = ensure_args()
+    args = ensure_args()
+    if args.worker:
+        await run_worker()
+        return
+
+    function, json_params = args.function, args.parameters
     module_function_parts = function.rsplit(":", 1)
 
     if len(module_function_parts) != 2:
@@ -107,38 +303,17 @@ async def main():
     module_name = module_function_parts[0]
     function_name = module_function_parts[1]
 
-    result = await call_async_function(module_name, function_name, json_params)
+    # Results are drained inside the profile too, since generators do their work as they're drained
+    profiler = Profiler(args.profile, args.profile_output) if args.profile is not None else None
+    if profiler is not None:
+        profiler.start()
 
-    if result is not None:
-        if isinstance(result, str):
-            print("---it's a string---")
-            print(result)
-            
-        elif isinstance(result, list) and all(isinstance(item, str) for item in result):
-            print("---it's a list---")
-            for item in result:
-                print(item)
-
-        # if it's a generator
-        elif issubclass(type(result), Generator) :
-            print("---it's a generator---")
-            for item in result:
-                print(item)
-
-        # if the "openai.openai_object.OpenAIObject"
-        elif (type(result).__name__ == "OpenAIObject"):
-            print("---it's an OpenAIObject---")
-            print(result.choices[0].message.content)
-
-        # if it's a dictionary that has a "choices" key
-        elif (isinstance(result, dict) and "choices" in result):
-            print("---it's a dictionary with a 'choices' key---")
-            print(result["choices"][0]["message"]["content"])
-
-        else:
-            print("---it's something else---")
-            print(type(result))
-            print(result)
+    try:
+        await call_and_print(module_name, function_name, json_params, args.timing)
+    finally:
+        if profiler is not None:
+            with contextlib.redirect_stdout(sys.stderr):
+                profiler.stop()
 
 if __name__ == "__main__":
     asyncio.run(main())  # Use asyncio.run() to run the asynchronous main function
@@ -1,10 +1,19 @@
 import asyncio
+import collections
+import hashlib
 import importlib
 import json
+import math
 import os
-import pathlib
+import random
+import re
+import sqlite3
+import statistics
 import sys
-from typing import Any, List, Dict, Generator
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, List, Dict, Generator
 
 class AutoFlushingStream:
     def __init__(self, stream):
@@ -61,83 +70,35 @@ def get_function(module_path, function_name):
     except AttributeError:
         raise Exception("Function not found: " + function_name)
 
-def create_wrapper(module_path, function_name):
-
-    fn = get_function(module_path, function_name)
-
-    async def async_wrapper(messages_field, stream_field, session_field, context_field, question_field, kwargs):
-
-        messages = kwargs[messages_field] if messages_field in kwargs else []
-        question = kwargs[question_field] if question_field in kwargs else None
-        if question is not None:
-            messages.append({"role": "user", "content": question})
-
-        stream = kwargs[stream_field] if stream_field in kwargs else False
-        session_state = kwargs[session_field] if session_field in kwargs else None
-        context = kwargs[context_field] if context_field in kwargs else {}
-
-        try:
-            return await fn(messages = messages, stream = stream, session_state = session_state, context = context)
-
-        except TypeError:
-            ex1 = sys.exc_info()[1]
-
-            try:
-                return await fn(question)
-
-            except TypeError:
-                ex2 = sys.exc_info()[1]
-                raise Exception("Invalid parameters: " + str(ex1) + " and " + str(ex2))
-
-            except Exception:
-                return None
-
-        except Exception:
-            return None
-
-    def sync_wrapper(messages_field, stream_field, session_field, context_field, question_field, kwargs):
-
-        messages = kwargs[messages_field] if messages_field in kwargs else []
-        question = kwargs[question_field] if question_field in kwargs else None
-        if question is not None:
-            messages.append({"role": "user", "content": question})
-
-        stream = kwargs[stream_field] if stream_field in kwargs else False
-        session_state = kwargs[session_field] if session_field in kwargs else None
-        context = kwargs[context_field] if context_field in kwargs else {}
+@include.python.function_call_adapter.py
 
-        try:
-            return fn(messages = messages, stream = stream, session_state = session_state, context = context)
-
-        except TypeError:
-            ex1 = sys.exc_info()[1]
+def create_wrapper(module_path, function_name):
+    return wrap_function(get_function(module_path, function_name), function_name)
 
-            try:
-                return fn(question)
+def wrap_function(fn, function_name):
 
-            except TypeError:
-                ex2 = sys.exc_info()[1]
-                raise Exception("Invalid parameters: " + str(ex1) + " and " + str(ex2))
+    style, adapter = create_call_adapter(fn)
+    print(f"Calling {function_name} with {style} parameters")
 
-            except Exception:
-                return None
+    async def async_wrapper(*args):
+        fn_args, fn_kwargs = adapter(*args)
+        return await fn(*fn_args, **fn_kwargs)
 
-        except Exception:
-            return None
+    def sync_wrapper(*args):
+        fn_args, fn_kwargs = adapter(*args)
+        return fn(*fn_args, **fn_kwargs)
 
     if asyncio.iscoroutinefunction(fn):
-        return lambda messages_field, stream_field, session_field, context_field, question_field, kwargs: asyncio.run(async_wrapper(messages_field, stream_field, session_field, context_field, question_field, kwargs))
+        return lambda *args: asyncio.run(async_wrapper(*args))
     elif callable(fn):
         return sync_wrapper
     else:
         raise Exception("Function not found, not an asynchronous function, or not callable.")
 
-def load_jsonl(path):
-    with open(path, "r") as f:
-        return [json.loads(line) for line in f.readlines()]
+@include.python.function_call_datasets.py
 
-def bulk_run_part(
-    module_and_function: str,
+def iter_bulk_run_part(
+    module_and_function: [str, Callable],
     dataset_or_path: [str, list],
     messages_field: str = "messages",
     stream_field: str  = "stream",
@@ -146,22 +107,44 @@ def bulk_run_part(
     question_field: str  = "question",
     truth_field: str  = "truth",
     answer_field: str  = "answer",
-    correct_field: str  = "correct"):
+    correct_field: str  = "correct",
+    checkpoint: Checkpoint = None,
+    row_indices: list = None):
+
+    # Callers running several parts pass the wrapper they already created instead of MODULE:FUNCTION
+    fn = None
+    if isinstance(module_and_function, str):
+        module_path, function_name = module_and_function.rsplit(":", 1)
+        fn = get_function(module_path, function_name)
+        wrapper = wrap_function(fn, function_name)
+    else:
+        wrapper = module_and_function
 
-    module_path, function_name = module_and_function.rsplit(":", 1)
-    wrapper = create_wrapper(module_path, function_name)
+    # Rows are read as they're run, keeping only the fields the function can use
+    fields = get_dataset_fields(fn, [messages_field, stream_field, session_state_field, context_field, question_field, truth_field]) if fn is not None else None
+    dataset = iter_dataset(dataset_or_path, fields if isinstance(dataset_or_path, str) else None, (messages_field,))
 
-    if isinstance(dataset_or_path, str):
-        path = pathlib.Path.cwd() / dataset_or_path
-        dataset = load_jsonl(path)
-    elif isinstance(dataset_or_path, list):
-        dataset = dataset_or_path
+    # Checkpoint entries are keyed on each row's index in the whole dataset, not its position in a shard or sample
+    dataset_pairs = zip(row_indices, dataset) if row_indices is not None else enumerate(dataset)
+    for _, result in iter_bulk_run_rows(wrapper, dataset_pairs, messages_field, stream_field, session_state_field, context_field, question_field, truth_field, checkpoint):
+        yield result
 
-    run_results = []
-    for d in dataset:
-        result = wrapper(messages_field, stream_field, session_state_field, context_field, question_field, d)
+def iter_bulk_run_rows(wrapper, dataset_pairs, messages_field, stream_field, session_state_field, context_field, question_field, truth_field, checkpoint = None):
+    """Run the wrapped function on `(index, row)` pairs, yielding `(index, result)` for every row that produced an answer."""
+
+    for index, d in dataset_pairs:
+        row_hash = Checkpoint.hash_row(d) if checkpoint is not None else None
+        answer = checkpoint.get(index, row_hash) if checkpoint is not None else None
+        if answer is not None:
+            checkpoint.resumed += 1
+            result = None
+        else:
+            try:
+                result = wrapper(messages_field, stream_field, session_state_field, context_field, question_field, d)
+            except Exception as e:
+                print(f"Row {index} failed: {type(e).__name__}: {e}")
+                result = None
 
-        answer = None
         if result is not None:
             if isinstance(result, str):
                 print("===it's a string===")
@@ -197,12 +180,16 @@ def bulk_run_part(
                 print(result)
                 answer = str(result)
 
+            if checkpoint is not None:
+                checkpoint.record(index, row_hash, answer)
+
         if answer is not None:
             result = { "question": d[question_field], "truth": d[truth_field], "answer": answer, "context": "" }
             print(result)
-            run_results.append(result)
+            yield index, result
 
-    return run_results
+def bulk_run_part(module_and_function: [str, Callable], dataset_or_path: [str, list], **kwargs):
+    return list(iter_bulk_run_part(module_and_function, dataset_or_path, **kwargs))
 
 def run_evaluate_part(subscription_id, resource_group_name, project_name, run_results, name):
     from azure.identity import DefaultAzureCredential
@@ -241,42 +228,703 @@ def run_evaluate_part(subscription_id, resource_group_name, project_name, run_re
 
     return eval_results
 
-def run_and_or_evaluate(subscription_id, resource_group_name, project_name, module_and_function, dataset, name):
+LOCAL_METRICS = ["exact_match", "f1_score", "rouge_l", "bleu", "embedding_similarity"]
+
+class LocalEvaluationResult:
+    def __init__(self, metrics_summary, artifacts):
+        self.metrics_summary = metrics_summary
+        self.artifacts = artifacts
+
+    def __str__(self):
+        return json.dumps({ "metrics_summary": self.metrics_summary }, indent=2)
+
+def normalize_answer(text) -> str:
+    """Lower-case, drop punctuation and articles, and collapse whitespace (SQuAD-style)."""
+    text = str(text if text is not None else "").lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    text = re.sub(r"\b(a|an|the)\b", " ", text)
+    return " ".join(text.split())
+
+def token_f1(answer: List[str], truth: List[str]) -> float:
+    if not answer or not truth:
+        return float(answer == truth)
+    overlap = sum((collections.Counter(answer) & collections.Counter(truth)).values())
+    if overlap == 0:
+        return 0.0
+    precision = overlap / len(answer)
+    recall = overlap / len(truth)
+    return 2 * precision * recall / (precision + recall)
+
+def lcs_length(a: List[str], b: List[str]) -> int:
+    """Longest common subsequence length, bit-parallel over `b` (Hyyrö), so each token of `a` is one step."""
+    masks = {}
+    for i, token in enumerate(b):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    full = (1 << len(b)) - 1
+    v = full
+    for token in a:
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & full
+    return len(b) - bin(v).count("1")
+
+def rouge_l(answer: List[str], truth: List[str]) -> float:
+    if not answer or not truth:
+        return float(answer == truth)
+    lcs = lcs_length(answer, truth)
+    if lcs == 0:
+        return 0.0
+    precision = lcs / len(answer)
+    recall = lcs / len(truth)
+    return 2 * precision * recall / (precision + recall)
+
+def bleu(answer: List[str], truth: List[str], max_n: int = 4) -> float:
+    """Sentence BLEU with add-one smoothing above unigrams, so short answers don't always score zero."""
+    if not answer or not truth:
+        return float(answer == truth)
+    log_precision = 0.0
+    for n in range(1, max_n + 1):
+        answer_ngrams = collections.Counter(zip(*[answer[i:] for i in range(n)]))
+        truth_ngrams = collections.Counter(zip(*[truth[i:] for i in range(n)]))
+        matches = sum((answer_ngrams & truth_ngrams).values())
+        total = sum(answer_ngrams.values())
+        if n > 1:
+            matches, total = matches + 1, total + 1
+        if matches == 0:
+            return 0.0
+        log_precision += math.log(matches / total) / max_n
+    brevity_penalty = min(0.0, 1 - len(truth) / len(answer))
+    return math.exp(brevity_penalty + log_precision)
+
+def score_text_chunk(pairs):
+    """Token F1, ROUGE-L and BLEU for a chunk of normalized (answer, truth) pairs; runs in pool workers."""
+    scores = []
+    for answer, truth in pairs:
+        answer, truth = answer.split(), truth.split()
+        scores.append((token_f1(answer, truth), rouge_l(answer, truth), bleu(answer, truth)))
+    return scores
+
+def score_text_pairs(pairs, chunk_size = 2000):
+    chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+    if len(chunks) < 2 or (os.cpu_count() or 1) < 2:
+        return [score for chunk in chunks for score in score_text_chunk(chunk)]
+    with ProcessPoolExecutor() as executor:
+        return [score for scores in executor.map(score_text_chunk, chunks) for score in scores]
+
+def hashed_embeddings(texts, dimensions = 256):
+    """Embed texts as bags of hashed unigrams and bigrams; needs no model or network."""
+    import numpy as np
+    rows, columns = [], []
+    for i, text in enumerate(texts):
+        tokens = text.split()
+        for feature in tokens + [a + " " + b for a, b in zip(tokens, tokens[1:])]:
+            rows.append(i)
+            columns.append(zlib.crc32(feature.encode("utf-8")) % dimensions)
+    matrix = np.zeros((len(texts), dimensions), dtype=np.float32)
+    np.add.at(matrix, (np.asarray(rows, dtype=np.intp), np.asarray(columns, dtype=np.intp)), 1.0)
+    return matrix
+
+def embedding_similarity(answers, truths, chunk_size = 8192):
+    import numpy as np
+    similarity = np.empty(len(answers), dtype=np.float64)
+    for start in range(0, len(answers), chunk_size):
+        a = hashed_embeddings(answers[start:start + chunk_size])
+        t = hashed_embeddings(truths[start:start + chunk_size])
+        dot = np.einsum("ij,ij->i", a, t)
+        norms = np.linalg.norm(a, axis=1) * np.linalg.norm(t, axis=1)
+        both_empty = ~(a.any(axis=1) | t.any(axis=1))
+        similarity[start:start + len(a)] = np.divide(dot, norms, out=both_empty.astype(np.float64), where=norms > 0)
+    return similarity
+
+def run_local_evaluate_part(run_results, name):
+    """Score answers against truth locally, with no service calls, in the same shape as `run_evaluate_part`."""
+    import numpy as np
+
+    print(f"Evaluating {name} locally ({len(run_results)} rows)...")
+    answers = [normalize_answer(row.get("answer")) for row in run_results]
+    truths = [normalize_answer(row.get("truth")) for row in run_results]
+
+    scores = {}
+    scores["exact_match"] = (np.array(answers, dtype=object) == np.array(truths, dtype=object)).astype(np.float64)
+    text_scores = np.array(score_text_pairs(list(zip(answers, truths))), dtype=np.float64).reshape(-1, 3)
+    scores["f1_score"], scores["rouge_l"], scores["bleu"] = text_scores[:, 0], text_scores[:, 1], text_scores[:, 2]
+    scores["embedding_similarity"] = embedding_similarity(answers, truths)
+
+    return LocalEvaluationResult(
+        { metric: float(scores[metric].mean()) if len(run_results) else None for metric in LOCAL_METRICS },
+        { metric: scores[metric].round(6).tolist() for metric in LOCAL_METRICS })
+
+class EvaluationCache:
+    """On-disk SQLite cache of per-row scores, keyed on the row's question, context, answer and truth
+    together with the evaluator configuration, so re-evaluations only score new or changed rows.
+    """
+
+    def __init__(self, path, config):
+        self.path = path
+        self.prefix = json.dumps(config, sort_keys=True, separators=(",", ":")) + ":"
+        self.hits = 0
+        self.misses = 0
+
+        # Pipelined runs evaluate on a background thread; only one thread uses the cache at a time
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, scores TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS configs (config TEXT PRIMARY KEY, per_row INTEGER)")
+
+    def key(self, row):
+        inputs = [row.get(field) for field in ["question", "context", "answer", "truth"]]
+        normalized = json.dumps(inputs, separators=(",", ":"), default=str)
+        return hashlib.sha256((self.prefix + normalized).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        row = self.db.execute("SELECT scores FROM scores WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def has_per_row_scores(self):
+        """Whether this configuration's evaluator returned per-row scores before: True, False, or None if it hasn't run."""
+        row = self.db.execute("SELECT per_row FROM configs WHERE config = ?", (self.prefix,)).fetchone()
+        return None if row is None else bool(row[0])
+
+    def set_per_row_scores(self, per_row):
+        self.db.execute("INSERT OR REPLACE INTO configs VALUES (?, ?)", (self.prefix, int(per_row)))
+        self.db.commit()
+
+    def put_many(self, items):
+        self.db.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?)", [(key, json.dumps(scores)) for key, scores in items])
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def summary(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total > 0 else 0.0
+        return { "hits": self.hits, "misses": self.misses, "hit_rate": hit_rate }
+
+def get_evaluation_config(evaluator):
+    if evaluator == "local":
+        return { "evaluator": "local", "metrics": LOCAL_METRICS, "version": 1 }
+    return { "evaluator": "azure", "task_type": "qa", "deployment_id": os.getenv("AZURE_OPENAI_EVALUATION_DEPLOYMENT") }
+
+def get_per_row_scores(artifacts, rows):
+    """Split `{metric: [value per row]}` artifacts into one `{metric: value}` dict per row, or None if they aren't per-row."""
+    if not isinstance(artifacts, dict) or not artifacts:
+        return None
+    if not all(isinstance(values, list) and len(values) == rows for values in artifacts.values()):
+        return None
+    return [{ metric: values[i] for metric, values in artifacts.items() } for i in range(rows)]
+
+def summarize_scores(per_row):
+    metrics = list(dict.fromkeys(metric for scores in per_row for metric in scores))
+    artifacts = { metric: [scores.get(metric) for scores in per_row] for metric in metrics }
+    metrics_summary = {}
+    for metric, values in artifacts.items():
+        numeric = [value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+        metrics_summary[metric] = sum(numeric) / len(numeric) if numeric else None
+    return LocalEvaluationResult(metrics_summary, artifacts)
+
+def evaluate_part(evaluator, subscription_id, resource_group_name, project_name, run_results, name, cache = None):
+
+    def evaluate(rows):
+        if evaluator == "local":
+            return run_local_evaluate_part(rows, name)
+        return run_evaluate_part(subscription_id, resource_group_name, project_name, rows, name)
+
+    # Decide before evaluating anything whether cached scores can be used, so no row is scored twice
+    per_row_scores = cache.has_per_row_scores() if cache is not None else False
+    if per_row_scores is False:
+        return evaluate(run_results)
+
+    keys = [cache.key(row) for row in run_results]
+    per_row = [cache.get(key) for key in keys]
+    missing = [i for i, scores in enumerate(per_row) if scores is None]
+    if not missing:
+        return summarize_scores(per_row)
+
+    eval_results = evaluate([run_results[i] for i in missing])
+    scored = get_per_row_scores(eval_results.artifacts, len(missing))
+    if scored is None:
+        # Later parts skip the cache up front; this part's results are used as they are rather than paid for twice
+        cache.set_per_row_scores(False)
+        print("Evaluation results have no per-row scores; not caching them.")
+        if len(missing) < len(run_results):
+            print(f"WARNING: Metrics for {name} only cover the {len(missing)} of {len(run_results)} rows that weren't cached.")
+        return eval_results
+
+    cache.set_per_row_scores(True)
+    cache.put_many([(keys[i], scores) for i, scores in zip(missing, scored)])
+    for i, scores in zip(missing, scored):
+        per_row[i] = scores
+    return summarize_scores(per_row)
+
+class JsonlResultWriter:
+    """Writes results as JSON Lines, one compact row per line."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
 
-    if isinstance(dataset, str):
-        path = pathlib.Path.cwd() / dataset
-        dataset = load_jsonl(path)
-    elif isinstance(dataset, list):
-        dataset = dataset
+    def write(self, result):
+        self.stream.write(json.dumps(result) + "\n")
+        self.stream.flush()
+        self.count += 1
 
+    def close(self):
+        self.stream.flush()
+
+class ArrowResultWriter:
+    """Writes results as Parquet or Arrow IPC, one row group per `row_group_size` rows as they arrive.
+
+    Each metric gets its own "metrics_<name>" column, so readers can load just the columns they
+    need. `column_types` (e.g. {"metrics_latency_ms": "float64"}) names the columns every file has;
+    any other columns, and their types, are taken from the first row group.
+    """
+
+    def __init__(self, stream, output_format, row_group_size = 1000, column_types = None):
+        try:
+            import pyarrow
+        except ImportError:
+            raise Exception(f"--output-format {output_format} requires pyarrow; install it with `pip install pyarrow`")
+
+        self.stream = stream
+        self.output_format = output_format
+        self.row_group_size = row_group_size
+        self.column_types = column_types or {}
+        self.rows = []
+        self.schema = None
+        self.writer = None
+        self.count = 0
+
+    @staticmethod
+    def flatten(result):
+        row = {}
+        for key, value in result.items():
+            if key == "metrics" and isinstance(value, dict):
+                for metric, metric_value in value.items():
+                    row["metrics_" + metric] = json.dumps(metric_value) if isinstance(metric_value, (dict, list)) else metric_value
+            else:
+                row[key] = json.dumps(value) if isinstance(value, (dict, list)) else value
+        return row
+
+    def write(self, result):
+        self.rows.append(self.flatten(result))
+        self.count += 1
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def open(self, schema):
+        import pyarrow as pa
+        self.schema = schema
+        if self.output_format == "parquet":
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(self.stream, schema)
+        else:
+            self.writer = pa.ipc.new_file(self.stream, schema)
+
+    def flush(self):
+        if not self.rows:
+            return
+
+        import pyarrow as pa
+        if self.schema is None:
+            fields = [pa.field(name, pa.type_for_alias(alias)) for name, alias in self.column_types.items()]
+            for field in pa.Table.from_pylist(self.rows).schema:
+                if field.name in self.column_types:
+                    continue
+                field_type = field.type
+                if pa.types.is_null(field_type):
+                    field_type = pa.string()
+                elif field.name.startswith("metrics_") and pa.types.is_integer(field_type):
+                    # Scores that happen to be whole numbers in the first row group may not be later on
+                    field_type = pa.float64()
+                fields.append(pa.field(field.name, field_type))
+            self.open(pa.schema(fields))
+
+        self.writer.write_table(pa.Table.from_pylist(self.rows, schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.writer is None:
+            import pyarrow as pa
+            self.open(pa.schema([pa.field(name, pa.type_for_alias(alias)) for name, alias in self.column_types.items()]))
+        self.writer.close()
+
+RESULT_COLUMN_TYPES = {
+    "question": "string",
+    "truth": "string",
+    "answer": "string",
+    "context": "string"
+}
+
+BINARY_OUTPUT_FORMATS = ["parquet", "arrow"]
+
+def create_result_writer(output_format, stream):
+    if output_format == "jsonl":
+        return JsonlResultWriter(stream)
+    elif output_format in BINARY_OUTPUT_FORMATS:
+        return ArrowResultWriter(stream, output_format, column_types=RESULT_COLUMN_TYPES)
+    raise Exception("Unsupported output format: " + output_format)
+
+def write_scored_rows(writer, rows, eval_results):
+    """Write each evaluated row with its scores under "metrics", when the evaluator returned per-row scores."""
+    if writer is None:
+        return
+    per_row = get_per_row_scores(eval_results.artifacts, len(rows)) or [{}] * len(rows)
+    for row, scores in zip(rows, per_row):
+        writer.write({ **row, "metrics": scores })
+
+def run_and_evaluate_pipelined(subscription_id, resource_group_name, project_name, wrapper, rows, name, batch_size, checkpoint = None, evaluator = "azure", cache = None, writer = None):
+    """Run the function over `(index, row)` pairs and evaluate completed rows in micro-batches while later rows are still running.
+
+    Batches are evaluated one at a time on a background thread, and their results are combined
+    the same way shard results are, so the final metrics cover every row.
+    """
+
+    parts = []
+    written = 0
+    batch = []
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+
+        def write_done(wait):
+            nonlocal written
+            while written < len(parts) and (wait or parts[written][0].done()):
+                future, rows = parts[written]
+                write_scored_rows(writer, rows, future.result())
+                written += 1
+
+        def submit(batch):
+            part_name = f"{name}-{len(parts) + 1}"
+            print(f"Evaluating batch {len(parts) + 1} ({len(batch)} rows)...")
+            parts.append((executor.submit(evaluate_part, evaluator, subscription_id, resource_group_name, project_name, batch, part_name, cache), batch))
+            write_done(False)
+
+        for _, result in iter_bulk_run_rows(wrapper, rows, "messages", "stream", "session_state", "context", "question", "truth", checkpoint):
+            batch.append(result)
+            if len(batch) >= batch_size:
+                submit(batch)
+                batch = []
+
+        if batch:
+            submit(batch)
+        print("Running... Done!")
+
+        write_done(True)
+        eval_results = [(future.result(), len(rows)) for future, rows in parts]
+
+    return merge_evaluation_results([{
+        "metrics_summary": eval_result.metrics_summary,
+        "artifacts": eval_result.artifacts,
+        "rows": rows
+    } for eval_result, rows in eval_results])
+
+def order_for_sampling(dataset, seed = 0, stratify = None):
+    """Return row indices in random order, so every prefix is a random sample of the dataset.
+
+    With `stratify`, rows of each stratum are spread evenly through the order, so every prefix
+    holds each stratum in close to its share of the dataset.
+    """
+
+    rng = random.Random(seed)
+    indices = list(range(len(dataset)))
+    rng.shuffle(indices)
+    if stratify is None:
+        return indices
+
+    strata = collections.defaultdict(list)
+    for i in indices:
+        strata[str(dataset[i].get(stratify))].append(i)
+
+    positions = [((k + rng.random()) / len(members), i) for members in strata.values() for k, i in enumerate(members)]
+    return [i for _, i in sorted(positions)]
+
+def estimate_confidence_intervals(per_row, strata, population, z):
+    """Per-metric (stratified) mean with a normal-approximation confidence interval.
+
+    `per_row` and `strata` are aligned lists of scores and stratum names for the sampled rows, and
+    `population` maps each stratum to its size in the dataset being sampled. Sampling is without
+    replacement, so each stratum's variance carries the finite population correction, and a fully
+    sampled stratum contributes none.
+    """
+
+    intervals = {}
+    for metric in dict.fromkeys(metric for scores in per_row for metric in scores):
+        by_stratum = collections.defaultdict(list)
+        for scores, stratum in zip(per_row, strata):
+            value = scores.get(metric)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                by_stratum[stratum].append(float(value))
+        if not by_stratum:
+            continue
+
+        # Strata not sampled yet are left out, and the others re-weighted to cover the dataset
+        total = sum(population[stratum] for stratum in by_stratum)
+        mean, variance = 0.0, 0.0
+        for stratum, values in by_stratum.items():
+            weight = population[stratum] / total
+            mean += weight * statistics.fmean(values)
+            correction = 1 - len(values) / population[stratum]
+            if correction <= 0:
+                continue
+            if len(values) < 2:
+                variance = math.inf
+            else:
+                variance += weight * weight * statistics.variance(values) / len(values) * correction
+
+        half_width = z * math.sqrt(variance)
+        intervals[metric] = {
+            "mean": mean,
+            "low": mean - half_width,
+            "high": mean + half_width,
+            "width": 2 * half_width,
+            "rows": sum(len(values) for values in by_stratum.values())
+        }
+    return intervals
+
+def run_sampled_evaluation(subscription_id, resource_group_name, project_name, wrapper, dataset, name, ci_width, confidence = 0.95, stratify = None, batch_size = 100, max_rows = None, time_budget = None, seed = 0, min_rows = 30, checkpoint = None, evaluator = "azure", cache = None, writer = None, row_indices = None):
+    """Evaluate a growing random (or stratified) sample of the dataset, stopping once every metric's
+    confidence interval is narrower than `ci_width`, or when the row or time budget runs out.
+
+    `row_indices` gives each row's index in the whole dataset, which checkpoint entries are keyed on.
+    """
+
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    order = order_for_sampling(dataset, seed, stratify)
+    limit = min(len(order), max_rows) if max_rows is not None else len(order)
+    stratum_of = lambda d: str(d.get(stratify)) if stratify is not None else ""
+    row_indices = row_indices if row_indices is not None else range(len(dataset))
+    position_of = { index: i for i, index in enumerate(row_indices) }
+    population = collections.Counter(stratum_of(d) for d in dataset)
+
+    start = time.time()
+    sampled = 0
+    per_row, strata = [], []
+    intervals = {}
+    stopped = None
+
+    while stopped is None:
+        batch = order[sampled:min(sampled + batch_size, limit)]
+        sampled += len(batch)
+
+        if wrapper is not None:
+            pairs = list(iter_bulk_run_rows(wrapper, ((row_indices[i], dataset[i]) for i in batch), "messages", "stream", "session_state", "context", "question", "truth", checkpoint))
+        else:
+            pairs = [(row_indices[i], dataset[i]) for i in batch]
+
+        if pairs:
+            eval_results = evaluate_part(evaluator, subscription_id, resource_group_name, project_name, [result for _, result in pairs], f"{name}-{len(strata) + 1}", cache)
+            write_scored_rows(writer, [result for _, result in pairs], eval_results)
+            scores = get_per_row_scores(eval_results.artifacts, len(pairs))
+            if scores is None:
+                raise Exception("Sampled evaluation needs per-row scores, but the evaluator returned none.")
+            per_row.extend(scores)
+            strata.extend(stratum_of(dataset[position_of[index]]) for index, _ in pairs)
+
+        intervals = estimate_confidence_intervals(per_row, strata, population, z)
+        print(f"Sampled {sampled} of {len(dataset)} rows: " + ", ".join(f"{metric} {ci['mean']:.4f} \u00b1{ci['width'] / 2:.4f}" for metric, ci in intervals.items()))
+
+        if intervals and len(per_row) >= min_rows and all(ci["width"] <= ci_width for ci in intervals.values()):
+            stopped = "confidence"
+        elif sampled >= len(order):
+            stopped = "exhausted"
+        elif sampled >= limit:
+            stopped = "max_rows"
+        elif time_budget is not None and time.time() - start >= time_budget:
+            stopped = "time_budget"
+
+    print(f"Stopped sampling ({stopped}) after {sampled} rows in {time.time() - start:.1f}s")
+    summary = summarize_scores(per_row)
+    return {
+        "metrics_summary": { metric: ci["mean"] for metric, ci in intervals.items() },
+        "confidence_intervals": intervals,
+        "confidence": confidence,
+        "artifacts": summary.artifacts,
+        "rows": len(per_row),
+        "sampled_rows": sampled,
+        "population_rows": len(dataset),
+        "stopped": stopped
+    }
+
+def run_and_or_evaluate(subscription_id, resource_group_name, project_name, module_and_function, dataset, name, checkpoint_path = None, resume = False, shard = None, sample = None, seed = 0, pipeline_batch_size = None, evaluator = "azure", cache_path = None, sampling = None, writer = None):
+
+    fields = ["messages", "stream", "session_state", "context", "question", "truth", "answer"]
+    if sampling is not None and sampling.get("stratify") is not None:
+        fields.append(sampling["stratify"])
+    # Resolve and wrap the function once; every path below, and every batch or round of them, reuses it
+    wrapper = None
     if module_and_function is not None:
+        module_path, function_name = module_and_function.rsplit(":", 1)
+        fn = get_function(module_path, function_name)
+        fields = get_dataset_fields(fn, fields)
+        wrapper = wrap_function(fn, function_name)
+    selected = select_rows(dataset, shard, sample, seed, set(fields), ("messages",))
+
+    cache = EvaluationCache(cache_path, get_evaluation_config(evaluator)) if cache_path is not None else None
+    try:
+        if sampling is not None:
+            # Sampling draws from every selected row at random, so only it holds them all in memory
+            selected = list(selected)
+            row_indices = [index for index, _ in selected]
+            dataset = [d for _, d in selected]
+            checkpoint = Checkpoint(checkpoint_path, resume) if checkpoint_path is not None else None
+            try:
+                result = run_sampled_evaluation(subscription_id, resource_group_name, project_name, wrapper, dataset, name, seed=seed, checkpoint=checkpoint, evaluator=evaluator, cache=cache, writer=writer, row_indices=row_indices, **sampling)
+            finally:
+                if checkpoint is not None:
+                    checkpoint.close()
+        else:
+            result = run_and_or_evaluate_rows(subscription_id, resource_group_name, project_name, wrapper, selected, name, checkpoint_path, resume, pipeline_batch_size, evaluator, cache, writer)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    if cache is not None:
+        cache_summary = cache.summary()
+        print(f"Evaluation cache: {cache_summary['hits']} hits, {cache_summary['misses']} misses ({cache_summary['hit_rate']:.1%} hit rate)")
+        result["evaluation_cache"] = cache_summary
+
+    return result
+
+def run_and_or_evaluate_rows(subscription_id, resource_group_name, project_name, wrapper, rows, name, checkpoint_path, resume, pipeline_batch_size, evaluator, cache, writer):
+    """Run and/or evaluate `(index, row)` pairs, reading them as they're needed; the index is the row's index in the whole dataset."""
+
+    if wrapper is not None and pipeline_batch_size:
+        print("Running and evaluating...")
+        checkpoint = Checkpoint(checkpoint_path, resume) if checkpoint_path is not None else None
+        try:
+            result = run_and_evaluate_pipelined(subscription_id, resource_group_name, project_name, wrapper, rows, name, pipeline_batch_size, checkpoint, evaluator, cache, writer)
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+        print("Evaluating... Done!")
+        return result
+
+    if wrapper is not None:
         print("Running...")
-        dataset = bulk_run_part(module_and_function, dataset)
+        checkpoint = Checkpoint(checkpoint_path, resume) if checkpoint_path is not None else None
+        try:
+            dataset = [result for _, result in iter_bulk_run_rows(wrapper, rows, "messages", "stream", "session_state", "context", "question", "truth", checkpoint)]
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+        if checkpoint is not None and checkpoint.resumed > 0:
+            print(f"Resumed {checkpoint.resumed} rows from checkpoint: {checkpoint_path}")
         print("Running... Done!")
         print(dataset)
-    
+    else:
+        dataset = [d for _, d in rows]
+
     print("Evaluating...")
-    eval_results = run_evaluate_part(subscription_id, resource_group_name, project_name, dataset, name)
+    eval_results = evaluate_part(evaluator, subscription_id, resource_group_name, project_name, dataset, name, cache)
+    write_scored_rows(writer, dataset, eval_results)
     print("Evaluating... Done!")
     print(eval_results)
 
     return {
         "metrics_summary": eval_results.metrics_summary,
-        "artifacts": eval_results.artifacts
+        "artifacts": eval_results.artifacts,
+        "rows": len(dataset)
+    }
+
+def merge_evaluations(paths):
+    shards = []
+    for path in paths:
+        with open(path, "r") as f:
+            shards.append(json.load(f))
+    return merge_evaluation_results(shards)
+
+def merge_evaluation_results(shards):
+    """Combine per-shard (or per-batch) evaluation results, given in order, into one result.
+
+    Numeric metrics are averaged weighted by each shard's row count, and per-row artifact lists
+    are concatenated in shard order.
+    """
+
+    total_rows = sum(shard.get("rows", 0) for shard in shards)
+
+    metrics_summary = {}
+    for key in dict.fromkeys(key for shard in shards for key in (shard.get("metrics_summary") or {})):
+        values = [(shard["metrics_summary"][key], shard.get("rows", 0)) for shard in shards if key in (shard.get("metrics_summary") or {})]
+        numeric = [(value, rows) for value, rows in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+        weight = sum(rows for _, rows in numeric)
+        if numeric and len(numeric) == len(values) and weight > 0:
+            metrics_summary[key] = sum(value * rows for value, rows in numeric) / weight
+        else:
+            metrics_summary[key] = values[0][0]
+
+    def merge_artifact(values):
+        if all(isinstance(value, list) for value in values):
+            return [item for value in values for item in value]
+        if all(isinstance(value, dict) for value in values):
+            keys = dict.fromkeys(key for value in values for key in value)
+            return { key: merge_artifact([value[key] for value in values if key in value]) for key in keys }
+        return values[0]
+
+    artifacts = [shard.get("artifacts") for shard in shards if shard.get("artifacts") is not None]
+
+    return {
+        "metrics_summary": metrics_summary,
+        "artifacts": merge_artifact(artifacts) if artifacts else None,
+        "rows": total_rows
     }
 
 def main():
 
     import argparse
     parser = argparse.ArgumentParser(description="Evaluate a function call")
-    parser.add_argument("--subscription", required=True, help="Azure subscription ID")
+    parser.add_argument("--subscription", required=False, help="Azure subscription ID")
     parser.add_argument("--group", required=False, help="Azure resource group name")
-    parser.add_argument("--project-name", required=True, help="Azure AI project project name.")
+    parser.add_argument("--project-name", required=False, help="Azure AI project project name.")
     parser.add_argument("--function", required=False, help="Module and function name in the format MODULE:FUNCTION.")
-    parser.add_argument("--data", required=True, help="Path to the dataset file")
-    parser.add_argument("--name", required=True, help="Name of the data evaluation")
+    parser.add_argument("--data", required=False, help="Path to the dataset file")
+    parser.add_argument("--name", required=False, help="Name of the data evaluation")
+    parser.add_argument("--shard", required=False, help="Evaluate only shard i of n (zero-based), in the format i/n.")
+    parser.add_argument("--sample", type=int, required=False, help="Evaluate only a random sample of N rows.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for --sample.")
+    parser.add_argument("--merge", nargs="+", required=False, help="Merge per-shard evaluation results, given in shard order, instead of evaluating.")
+    parser.add_argument("--pipeline-batch-size", type=int, required=False, help="Evaluate completed rows in batches of N while later rows are still running.")
+    parser.add_argument("--evaluator", choices=["azure", "local"], default="azure", help="Evaluate with Azure AI (default) or with local metrics that need no service.")
+    parser.add_argument("--ci-width", type=float, required=False, help="Evaluate a growing random sample until every metric's confidence interval is narrower than this.")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level for --ci-width.")
+    parser.add_argument("--stratify", required=False, help="With --ci-width, sample evenly across the values of this dataset field.")
+    parser.add_argument("--sample-batch-size", type=int, default=100, help="With --ci-width, rows added to the sample per round.")
+    parser.add_argument("--max-rows", type=int, required=False, help="With --ci-width, stop after sampling this many rows.")
+    parser.add_argument("--time-budget", type=float, required=False, help="With --ci-width, stop sampling after this many seconds.")
+    parser.add_argument("--min-rows", type=int, default=30, help="With --ci-width, sample at least this many rows before trusting the confidence intervals.")
+    parser.add_argument("--output", required=False, help="Path to write each evaluated row, with its per-row scores, to.")
+    parser.add_argument("--output-format", default="jsonl", choices=["jsonl"] + BINARY_OUTPUT_FORMATS, help="Format of --output.")
+    parser.add_argument("--eval-cache", required=False, help="Path to a SQLite file caching per-row scores, so re-evaluations only score new or changed rows.")
+    parser.add_argument("--checkpoint", required=False, help="Path to a file recording each completed row.")
+    parser.add_argument("--resume", action="store_true", help="Skip rows already completed in the checkpoint file.")
     args = parser.parse_args()
 
+    if args.resume and args.checkpoint is None:
+        parser.error("--resume requires --checkpoint")
+
+    sampling_options = [args.stratify, args.max_rows, args.time_budget]
+    if args.ci_width is None and any(option is not None for option in sampling_options):
+        parser.error("--stratify, --max-rows and --time-budget require --ci-width")
+    if args.ci_width is not None and args.pipeline_batch_size is not None:
+        parser.error("--ci-width cannot be combined with --pipeline-batch-size")
+
+    if args.merge is not None:
+        formatted = json.dumps(merge_evaluations(args.merge), indent=2)
+        print("---")
+        print(formatted)
+        return
+
+    required = [("--data", args.data), ("--name", args.name)]
+    if args.evaluator == "azure":
+        required = [("--subscription", args.subscription), ("--project-name", args.project_name)] + required
+    missing = [option for option, value in required if value is None]
+    if missing:
+        parser.error("the following arguments are required: " + ", ".join(missing))
+
     subscription_id = args.subscription
     resource_group_name = args.group
     project_name = args.project_name
@@ -284,7 +932,22 @@ def main():
     dataset = args.data
     name = args.name
 
-    result = run_and_or_evaluate(subscription_id, resource_group_name, project_name, module_and_function, dataset, name)
+    shard = parse_shard(args.shard) if args.shard is not None else None
+    sampling = None
+    if args.ci_width is not None:
+        sampling = { "ci_width": args.ci_width, "confidence": args.confidence, "stratify": args.stratify, "batch_size": args.sample_batch_size, "max_rows": args.max_rows, "time_budget": args.time_budget, "min_rows": args.min_rows }
+    if args.output is not None:
+        with open(args.output, "wb" if args.output_format in BINARY_OUTPUT_FORMATS else "w") as f:
+            writer = create_result_writer(args.output_format, f)
+            result = run_and_or_evaluate(subscription_id, resource_group_name, project_name, module_and_function, dataset, name, args.checkpoint, args.resume, shard, args.sample, args.seed, args.pipeline_batch_size, args.evaluator, args.eval_cache, sampling, writer)
+            writer.close()
+
+        # Per-row scores are in the output file, so they aren't repeated in the payload
+        result.pop("artifacts", None)
+        result["output"] = args.output
+        result["output_rows"] = writer.count
+    else:
+        result = run_and_or_evaluate(subscription_id, resource_group_name, project_name, module_and_function, dataset, name, args.checkpoint, args.resume, shard, args.sample, args.seed, args.pipeline_batch_size, args.evaluator, args.eval_cache, sampling)
     formatted = json.dumps(result, indent=2)
 
     print("---")
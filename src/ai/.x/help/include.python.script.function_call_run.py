@@ -1,9 +1,20 @@
 import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import hashlib
 import importlib
+import inspect
+import itertools
 import json
 import os
-import pathlib
+import random
+import sqlite3
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, List, Dict, Generator
 
 class AutoFlushingStream:
@@ -61,82 +72,785 @@ def get_function(module_path, function_name):
     except AttributeError:
         raise Exception("Function not found: " + function_name)
 
-def create_wrapper(module_path, function_name):
+@include.python.function_call_adapter.py
 
-    fn = get_function(module_path, function_name)
+def create_wrapper(fn, function_name, executor = None):
 
-    async def async_wrapper(messages_field, stream_field, session_field, context_field, question_field, kwargs):
+    style, adapter = create_call_adapter(fn)
+    print(f"Calling {function_name} with {style} parameters")
 
-        messages = kwargs[messages_field] if messages_field in kwargs else []
-        question = kwargs[question_field] if question_field in kwargs else None
-        if question is not None:
-            messages.append({"role": "user", "content": question})
+    async def async_wrapper(*args):
+        fn_args, fn_kwargs = adapter(*args)
+        return await fn(*fn_args, **fn_kwargs)
 
-        stream = kwargs[stream_field] if stream_field in kwargs else False
-        session_state = kwargs[session_field] if session_field in kwargs else None
-        context = kwargs[context_field] if context_field in kwargs else {}
+    def sync_wrapper(*args):
+        fn_args, fn_kwargs = adapter(*args)
+        return fn(*fn_args, **fn_kwargs)
 
-        try:
-            return await fn(messages = messages, stream = stream, session_state = session_state, context = context)
+    if asyncio.iscoroutinefunction(fn):
+        wrapper = async_wrapper
+    elif callable(fn):
+        # Run sync functions on the executor so they don't block the shared event loop
+        async def executor_wrapper(*args):
+            if executor is None:
+                return sync_wrapper(*args)
+            return await asyncio.get_running_loop().run_in_executor(executor, sync_wrapper, *args)
+        wrapper = executor_wrapper
+    else:
+        raise Exception("Function not found, not an asynchronous function, or not callable.")
+
+    # Exposed so the response cache can key on exactly what fn is called with
+    wrapper.adapter = adapter
+    return wrapper
+
+@include.python.function_call_datasets.py
+
+class ResponseCache:
+    """On-disk SQLite cache of answers, keyed on the target function's source and the arguments it is called with.
+
+    Entries older than `max_age_hours` are treated as misses, and once the cache grows past
+    `max_size_mb` the least recently used entries are evicted when the cache is closed.
+    """
+
+    def __init__(self, path, module_path, function_name, max_size_mb = 1024, max_age_hours = 168):
+        self.path = path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.max_age = max_age_hours * 3600 if max_age_hours is not None else None
+        self.hits = 0
+        self.misses = 0
+        self.pending = 0
+
+        self.prefix = self.get_prefix(module_path, function_name)
+
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, answer TEXT, size INTEGER, created REAL, accessed REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    @staticmethod
+    def get_prefix(module_path, function_name):
+        # Any edit to the target module invalidates every entry written for the old source
+        with open(os.path.join(os.getcwd(), module_path + ".py"), "rb") as f:
+            source_hash = hashlib.sha256(f.read()).hexdigest()
+        return source_hash + ":" + function_name + ":"
+
+    def for_function(self, module_path, function_name):
+        """Return a view of this cache for another function, sharing its database connection; only close the original."""
+        view = copy.copy(self)
+        view.prefix = self.get_prefix(module_path, function_name)
+        view.hits = 0
+        view.misses = 0
+        return view
+
+    def key(self, args, kwargs):
+        normalized = json.dumps([args, kwargs], sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256((self.prefix + normalized).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        row = self.db.execute("SELECT answer, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or (self.max_age is not None and row[1] < now - self.max_age):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key, answer):
+        if answer is None:
+            return
+
+        now = time.time()
+        value = json.dumps(answer)
+        self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, value, len(value), now, now))
+
+        self.pending += 1
+        if self.pending >= 100:
+            self.db.commit()
+            self.pending = 0
+
+    def evict(self):
+        if self.max_age is not None:
+            self.db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,))
+
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_size:
+            for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                if total <= self.max_size:
+                    break
+
+    def close(self):
+        self.evict()
+        self.db.commit()
+        self.db.close()
+
+    def summary(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total > 0 else 0.0
+        return { "hits": self.hits, "misses": self.misses, "hit_rate": hit_rate }
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+class RunStats:
+    """Collects per-row metrics during a bulk run and summarizes them at the end."""
+
+    def __init__(self):
+        self.rows = 0
+        self.answered = 0
+        self.from_checkpoint = 0
+        self.from_cache = 0
+        self.errors = 0
+        self.latencies = []
+        self.times_to_first_item = []
+        self.total_tokens = None
+        self.start = time.perf_counter()
+        self.elapsed = None
+        self.concurrency = 1
+        self.cache = None
+        self.controller = None
+        self.merged_from = None
+        self.variants = None
+        self.same_answer_as_first = None
+        self.row_timeout = None
+        self.hedge = False
+        self.timeouts = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.profile = None
+
+    def add(self, answer, metrics):
+        self.rows += 1
+        if answer is not None:
+            self.answered += 1
+
+        source = metrics.get("source")
+        if source == "checkpoint":
+            self.from_checkpoint += 1
+        elif source == "cache":
+            self.from_cache += 1
+        else:
+            if "error" in metrics:
+                self.errors += 1
+            self.latencies.append(metrics["latency_ms"])
+            if "time_to_first_item_ms" in metrics:
+                self.times_to_first_item.append(metrics["time_to_first_item_ms"])
+
+        if metrics.get("total_tokens") is not None:
+            self.total_tokens = (self.total_tokens or 0) + metrics["total_tokens"]
+        if metrics.get("timed_out"):
+            self.timeouts += 1
+        if metrics.get("hedged"):
+            self.hedged += 1
+        if metrics.get("hedge_won"):
+            self.hedge_wins += 1
+
+    def add_variants(self, outcomes):
+        """Record one row of a multi-function run: an (answer, metrics) pair per function, in the order of `variants`."""
+        self.rows += 1
+        if all(answer is not None for answer, _ in outcomes):
+            self.answered += 1
+        if any("error" in metrics for _, metrics in outcomes):
+            self.errors += 1
+
+        self.same_answer_as_first = self.same_answer_as_first or [0] * len(outcomes)
+        first = outcomes[0][0]
+        for k, (variant_stats, (answer, metrics)) in enumerate(zip(self.variants.values(), outcomes)):
+            variant_stats.add(answer, metrics)
+            if answer is not None and answer == first:
+                self.same_answer_as_first[k] += 1
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.start
+
+    def summary(self):
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.start
+        latencies = sorted(self.latencies)
+        times_to_first_item = sorted(self.times_to_first_item)
+
+        summary = {
+            "rows": self.rows,
+            "answered": self.answered,
+            "errors": self.errors,
+            "elapsed_sec": round(elapsed, 3),
+            "rows_per_sec": round(self.rows / elapsed, 3) if elapsed > 0 else 0.0,
+            "concurrency": self.concurrency,
+            "latency_ms": { "p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "p99": percentile(latencies, 99) },
+            "total_tokens": self.total_tokens,
+        }
+        if times_to_first_item:
+            summary["time_to_first_item_ms"] = { "p50": percentile(times_to_first_item, 50), "p95": percentile(times_to_first_item, 95), "p99": percentile(times_to_first_item, 99) }
+        if self.from_checkpoint > 0:
+            summary["from_checkpoint"] = self.from_checkpoint
+        if self.row_timeout is not None:
+            summary["row_timeout_sec"] = self.row_timeout
+            summary["timeouts"] = self.timeouts
+        if self.hedge:
+            summary["hedged"] = self.hedged
+            summary["hedge_wins"] = self.hedge_wins
+        if self.profile is not None:
+            summary["profile"] = self.profile
+        if self.cache is not None:
+            summary["cache"] = self.cache.summary()
+        if self.controller is not None:
+            summary["adaptive_concurrency"] = self.controller.summary()
+        if self.variants is not None:
+            summary["variants"] = { target: variant_stats.summary() for target, variant_stats in self.variants.items() }
+            summary["comparison"] = { target: {
+                "answered": variant["answered"],
+                "errors": variant["errors"],
+                "latency_ms": variant["latency_ms"],
+                "total_tokens": variant["total_tokens"],
+                "same_answer_as_first": self.same_answer_as_first[k] / self.rows if self.rows > 0 and self.same_answer_as_first else 0.0
+            } for k, (target, variant) in enumerate(summary["variants"].items()) }
+            for key in ("latency_ms", "total_tokens", "cache", "adaptive_concurrency"):
+                summary.pop(key, None)
+        if self.merged_from is not None:
+            # Wall time and concurrency belong to the individual shards, not to the merge
+            summary.update({ "elapsed_sec": None, "rows_per_sec": None, "concurrency": None, "merged_from": self.merged_from })
+
+        return summary
+
+def get_usage_tokens(result):
+    usage = result.get("usage") if isinstance(result, dict) else getattr(result, "usage", None)
+    if usage is None:
+        return None
+    total_tokens = usage.get("total_tokens") if isinstance(usage, dict) else getattr(usage, "total_tokens", None)
+    return total_tokens if isinstance(total_tokens, int) else None
+
+@include.python.function_call_chunks.py
+
+def join_items(items, stream):
+    """Join the items of a generator with newlines, or the text of openai stream chunks as is."""
+    return "".join(get_chunk_text(item) for item in items) if stream else "\n".join(items)
+
+def record_first_item(items, metrics, start):
+    if metrics is not None and not items:
+        metrics["time_to_first_item_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+def record_answer(answer, usage, metrics, start):
+    if metrics is not None:
+        metrics["latency_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        metrics["output_chars"] = len(answer) if answer is not None else 0
+        metrics["total_tokens"] = get_usage_tokens(usage) if usage is not None else None
+    return answer
+
+def is_async_answer(result):
+    return inspect.isasyncgen(result) or (is_openai_stream(result) and hasattr(result, "__aiter__"))
+
+async def get_async_answer(result, metrics = None, start = None):
+    """get_answer for async generators and openai AsyncStreams, which are drained on the event loop."""
+
+    stream = is_openai_stream(result)
+    print("===it's a stream===" if stream else "===it's an async generator===")
+    print(result)
+    items = []
+    async for item in result:
+        record_first_item(items, metrics, start)
+        items.append(item)
+
+    # With stream_options={"include_usage": True}, the last chunk of a stream carries the usage
+    return record_answer(join_items(items, stream), items[-1] if stream and items else None, metrics, start)
+
+def get_answer(result, metrics = None, start = None):
+
+    answer = None
+    usage = result
+    if result is not None:
+        if isinstance(result, str):
+            print("===it's a string===")
+            print(result)
+            answer = result
+            
+        elif isinstance(result, list) and all(isinstance(item, str) for item in result):
+            print("===it's a list===")
+            print(result)
+            answer = "\n".join(result)
+
+        # if it's a generator, or an openai 1.x Stream
+        elif issubclass(type(result), Generator) or is_openai_stream(result):
+            stream = is_openai_stream(result)
+            print("===it's a stream===" if stream else "===it's a generator===")
+            print(result)
+            items = []
+            for item in result:
+                record_first_item(items, metrics, start)
+                items.append(item)
+            answer = join_items(items, stream)
+            if stream:
+                usage = items[-1] if items else None
+
+        # if the "openai.openai_object.OpenAIObject"
+        elif (type(result).__name__ == "OpenAIObject"):
+            print("===it's an OpenAIObject===")
+            print(result.choices[0].message.content)
+            answer = result.choices[0].message.content
 
-        except TypeError:
-            ex1 = sys.exc_info()[1]
+        # if it's a dictionary that has a "choices" key
+        elif (isinstance(result, dict) and "choices" in result):
+            print("===it's a dictionary with a 'choices' key===")
+            print(result["choices"][0]["message"]["content"])
+            answer = result["choices"][0]["message"]["content"]
 
+        else:
+            print("===it's something else===")
+            print(type(result))
+            print(result)
+            answer = str(result)
+
+    return record_answer(answer, usage, metrics, start)
+
+def get_throttling_retry_after(e):
+    """Return the Retry-After delay in seconds (0 if none was given) if e is a throttling error, otherwise None."""
+
+    response = getattr(e, "response", None)
+    status = getattr(e, "status_code", None) or getattr(e, "code", None) or getattr(response, "status_code", None)
+    if status != 429 and type(e).__name__ != "RateLimitError":
+        return None
+
+    headers = getattr(e, "headers", None) or getattr(response, "headers", None) or {}
+    retry_after = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return max(0.0, float(retry_after))
+    except (TypeError, ValueError):
+        return 0.0
+
+class AdaptiveConcurrency:
+    """AIMD concurrency limit for bulk runs against throttled endpoints.
+
+    Used like a semaphore. The limit grows by one for every `limit` healthy completions and is
+    halved when a call is throttled; a throttled call also pauses new calls until its Retry-After
+    (or an exponential backoff) has passed. Latency more than twice the best observed average
+    stops the limit from growing.
+    """
+
+    def __init__(self, max_limit, initial_limit = 1, max_retries = 5, sample_interval = 1.0):
+        self.max_limit = max_limit
+        self.limit = float(min(initial_limit, max_limit))
+        self.max_retries = max_retries
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+        self.paused_until = 0.0
+        self.latency_average = None
+        self.latency_baseline = None
+        self.throttled = 0
+        self.retries = 0
+        self.completed = 0
+        self.sample_interval = sample_interval
+        self.start = time.perf_counter()
+        self.last_sample = (self.start, 0)
+        self.timeline = []
+
+    async def __aenter__(self):
+        async with self.condition:
+            while self.in_flight >= int(self.limit):
+                await self.condition.wait()
+            self.in_flight += 1
+
+        delay = self.paused_until - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def __aexit__(self, *exc_info):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self, latency):
+        self.completed += 1
+        self.latency_average = latency if self.latency_average is None else 0.8 * self.latency_average + 0.2 * latency
+        self.latency_baseline = self.latency_average if self.latency_baseline is None else min(self.latency_baseline, self.latency_average)
+
+        if self.latency_average <= 2 * self.latency_baseline:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self.sample()
+
+    def on_throttled(self, retry_after, attempt):
+        self.throttled += 1
+
+        # Calls already in flight when the first 429 arrived shouldn't each halve the limit again
+        now = time.perf_counter()
+        if now >= self.paused_until:
+            self.limit = max(1.0, self.limit / 2)
+
+        delay = retry_after if retry_after > 0 else min(60.0, 0.5 * 2 ** attempt)
+        self.paused_until = max(self.paused_until, now + delay)
+        self.sample()
+
+    def sample(self):
+        now = time.perf_counter()
+        last_time, last_completed = self.last_sample
+        if now - last_time >= self.sample_interval:
+            rows_per_sec = (self.completed - last_completed) / (now - last_time)
+            self.timeline.append({ "elapsed_sec": round(now - self.start, 3), "limit": int(self.limit), "rows_per_sec": round(rows_per_sec, 3) })
+            self.last_sample = (now, self.completed)
+
+    def summary(self):
+        return {
+            "max_concurrency": self.max_limit,
+            "final_concurrency": int(self.limit),
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "timeline": self.timeline
+        }
+
+class AbandonableExecutor:
+    """Runs each call on its own daemon thread, so a call abandoned after its row's deadline (or a
+    losing hedge) holds up neither the rest of the run nor the exit of the process.
+    """
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
             try:
-                return await fn(question)
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
 
-            except TypeError:
-                ex2 = sys.exc_info()[1]
-                raise Exception("Invalid parameters: " + str(ex1) + " and " + str(ex2))
+        threading.Thread(target=run, daemon=True).start()
+        return future
 
-            except Exception:
-                return None
+    def shutdown(self, wait = True):
+        pass
+
+@include.python.function_call_profiler.py
+
+class ProfiledExecutor:
+    """Wraps an executor so every call it runs is profiled on the thread that runs it."""
+
+    def __init__(self, executor, profiler):
+        self.executor = executor
+        self.profiler = profiler
 
-        except Exception:
+    def submit(self, fn, *args):
+        def call(*args):
+            with self.profiler.thread_call():
+                return fn(*args)
+        return self.executor.submit(call, *args)
+
+    def shutdown(self, wait = True):
+        self.executor.shutdown(wait)
+
+async def run_rows(wrapper, dataset, concurrency, fields, checkpoint = None, cache = None, executor = None, controller = None, semaphore = None, row_timeout = None, hedge = False):
+    """Run the wrapper over (index, row) pairs on the current event loop, yielding batches of (row, answer, metrics) in input order.
+
+    At most `concurrency` calls are in flight at once, and only a bounded window of rows is
+    scheduled ahead of the oldest unfinished row, so a slow row never pulls in the whole dataset.
+    Rows already answered in the checkpoint or the response cache are returned from there without
+    calling the wrapper. With an AdaptiveConcurrency controller, the limit follows the controller
+    and throttled rows are retried. Runs given the same `semaphore` share its concurrency limit.
+
+    A row still running after `row_timeout` seconds fails with a timeout; async calls are
+    cancelled and calls on the executor are abandoned. With `hedge`, a row running longer than the
+    p95 latency seen so far is issued a second time, and whichever attempt finishes first wins. Hedges
+    don't take concurrency slots, which stragglers may all hold; instead at most a tenth of `concurrency`
+    (at least one) run at a time, and a row finding that budget spent isn't hedged.
+    """
+
+    if controller is not None:
+        semaphore = controller
+    elif semaphore is None:
+        semaphore = asyncio.Semaphore(concurrency)
+    window = collections.deque()
+    window_size = concurrency * 4
+    latencies = collections.deque(maxlen=1000)
+    hedge_budget = max(1, concurrency // 10)
+    hedges_running = 0
+
+    def get_hedge_delay():
+        # Too few completions make for a noisy p95, and hedging on it would double the load
+        if not hedge or len(latencies) < 20:
             return None
+        return percentile(sorted(latencies), 95)
 
-    def sync_wrapper(messages_field, stream_field, session_field, context_field, question_field, kwargs):
+    async def call_attempt(d, start):
+        attempt_metrics = {}
+        result = await wrapper(*fields, d)
+        if is_async_answer(result):
+            answer = await get_async_answer(result, attempt_metrics, start)
+        elif executor is not None and (issubclass(type(result), Generator) or is_openai_stream(result)):
+            # Sync generators do their work while being drained, so drain them off the event loop
+            answer = await asyncio.get_running_loop().run_in_executor(executor, get_answer, result, attempt_metrics, start)
+        else:
+            answer = get_answer(result, attempt_metrics, start)
+        return answer, attempt_metrics
 
-        messages = kwargs[messages_field] if messages_field in kwargs else []
-        question = kwargs[question_field] if question_field in kwargs else None
-        if question is not None:
-            messages.append({"role": "user", "content": question})
+    async def call_hedge(d, start, metrics):
+        # Only counted once the call actually starts; a hedge cancelled before then never ran
+        metrics["hedged"] = True
+        return await call_attempt(d, start)
 
-        stream = kwargs[stream_field] if stream_field in kwargs else False
-        session_state = kwargs[session_field] if session_field in kwargs else None
-        context = kwargs[context_field] if context_field in kwargs else {}
+    def release_hedge(task):
+        nonlocal hedges_running
+        hedges_running -= 1
 
+    async def call_hedged(d, start, metrics):
+        nonlocal hedges_running
+        tasks = [asyncio.ensure_future(call_attempt(d, start))]
         try:
-            return fn(messages = messages, stream = stream, session_state = session_state, context = context)
+            delay = get_hedge_delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and hedges_running < hedge_budget:
+                    hedges_running += 1
+                    tasks.append(asyncio.ensure_future(call_hedge(d, start, metrics)))
+                    tasks[-1].add_done_callback(release_hedge)
 
-        except TypeError:
-            ex1 = sys.exc_info()[1]
+            hedge_task = tasks[1] if len(tasks) > 1 else None
+            while True:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                task = next(task for task in tasks if task in done)
+                tasks.remove(task)
 
-            try:
-                return fn(question)
+                # A failed attempt only counts once there is no other attempt left to win
+                if task.exception() is None or not tasks:
+                    if task is hedge_task and task.exception() is None:
+                        metrics["hedge_won"] = True
+                    return task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def call_row(index, d, metrics):
+        attempt = 0
+        while True:
+            async with semaphore:
+                start = time.perf_counter()
+                # Without a deadline or hedging there is nothing to race the call against, so it's awaited directly
+                task = asyncio.ensure_future(call_hedged(d, start, metrics)) if row_timeout is not None or hedge else None
+                try:
+                    if task is None:
+                        answer, attempt_metrics = await call_attempt(d, start)
+                    else:
+                        done, _ = await asyncio.wait([task], timeout=row_timeout)
+                        if not done:
+                            print(f"Row {index} timed out after {row_timeout}s")
+                            metrics["latency_ms"] = round((time.perf_counter() - start) * 1000, 3)
+                            metrics["error"] = f"TimeoutError: row did not finish within {row_timeout}s"
+                            metrics["timed_out"] = True
+                            return None
+                        answer, attempt_metrics = task.result()
+
+                    metrics.update(attempt_metrics)
+                    latencies.append(time.perf_counter() - start)
+
+                    if controller is not None:
+                        controller.on_success(time.perf_counter() - start)
+                    return answer
+
+                except Exception as e:
+                    retry_after = get_throttling_retry_after(e) if controller is not None else None
+                    if retry_after is not None and attempt < controller.max_retries:
+                        print(f"Row {index} throttled, retrying: {type(e).__name__}: {e}")
+                        controller.on_throttled(retry_after, attempt)
+                        controller.retries += 1
+                        attempt += 1
+                        continue
+
+                    print(f"Row {index} failed: {type(e).__name__}: {e}")
+                    metrics["latency_ms"] = round((time.perf_counter() - start) * 1000, 3)
+                    metrics["error"] = f"{type(e).__name__}: {e}"
+                    if attempt > 0:
+                        metrics["retries"] = attempt
+                    return None
+
+                finally:
+                    if task is not None:
+                        task.cancel()
 
-            except TypeError:
-                ex2 = sys.exc_info()[1]
-                raise Exception("Invalid parameters: " + str(ex1) + " and " + str(ex2))
+    async def run_row(index, d):
+        row_hash = Checkpoint.hash_row(d) if checkpoint is not None else None
+        if checkpoint is not None:
+            answer = checkpoint.get(index, row_hash)
+            if answer is not None:
+                checkpoint.resumed += 1
+                return answer, { "source": "checkpoint" }
 
+        cache_key = None
+        if cache is not None:
+            try:
+                cache_key = cache.key(*wrapper.adapter(*fields, d))
             except Exception:
-                return None
+                # The call itself fails the same way, and reports it
+                pass
+        answer = cache.get(cache_key) if cache_key is not None else None
+        metrics = { "source": "cache" }
 
-        except Exception:
-            return None
+        if answer is None:
+            metrics = {}
+            answer = await call_row(index, d, metrics)
 
-    if asyncio.iscoroutinefunction(fn):
-        return lambda messages_field, stream_field, session_field, context_field, question_field, kwargs: asyncio.run(async_wrapper(messages_field, stream_field, session_field, context_field, question_field, kwargs))
-    elif callable(fn):
-        return sync_wrapper
+            if cache_key is not None:
+                cache.put(cache_key, answer)
+
+        if checkpoint is not None:
+            checkpoint.record(index, row_hash, answer)
+        return answer, metrics
+
+    rows = iter(dataset)
+    try:
+        while True:
+            while len(window) < window_size:
+                index, d = next(rows, (None, None))
+                if d is None:
+                    break
+                window.append((d, asyncio.ensure_future(run_row(index, d))))
+
+            if not window:
+                break
+
+            # Hand back the oldest row plus any rows right behind it that are already done
+            d, task = window.popleft()
+            batch = [(d, *await task)]
+            while window and window[0][1].done():
+                d, task = window.popleft()
+                batch.append((d, *task.result()))
+            yield batch
+
+    finally:
+        for _, task in window:
+            task.cancel()
+
+def iter_run_targets(
+    targets: list,
+    dataset_or_path: [str, list],
+    messages_field: str,
+    stream_field: str,
+    session_state_field: str,
+    context_field: str,
+    question_field: str,
+    truth_field: str,
+    concurrency: int,
+    checkpoint_path: str,
+    resume: bool,
+    cache_path: str,
+    cache_max_size_mb: float,
+    cache_max_age_hours: float,
+    adaptive: bool,
+    max_retries: int,
+    shard: tuple,
+    sample: int,
+    seed: int,
+    stats: list,
+    row_timeout: float = None,
+    hedge: bool = False,
+    profiler: Profiler = None):
+    """Run every (module_path, function_name) target over one pass of the dataset, yielding
+    (row, [(answer, metrics) per target]) in input order.
+
+    All targets share one concurrency limit (and adaptive controller) and one executor. With more
+    than one target, each gets its own checkpoint file, "<checkpoint_path>.<k>".
+    """
+
+    fields = (messages_field, stream_field, session_state_field, context_field, question_field)
+    # Resolve each target once; get_function prints its progress on every call
+    functions = [get_function(module_path, function_name) for module_path, function_name in targets]
+    dataset_fields = set()
+    for fn in functions:
+        dataset_fields |= get_dataset_fields(fn, fields + (truth_field,))
+    dataset = select_rows(dataset_or_path, shard, sample, seed, dataset_fields, (messages_field,))
+    datasets = itertools.tee(dataset, len(targets)) if len(targets) > 1 else [dataset]
+    concurrency = max(1, concurrency)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # Deadlines and hedges need sync calls off the event loop even at concurrency 1, on threads
+    # that can be abandoned
+    if row_timeout is not None or hedge:
+        executor = AbandonableExecutor()
     else:
-        raise Exception("Function not found, not an asynchronous function, or not callable.")
+        executor = ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else None
+    if executor is not None and profiler is not None:
+        executor = ProfiledExecutor(executor, profiler)
 
-def load_jsonl(path):
-    with open(path, "r") as f:
-        return [json.loads(line) for line in f.readlines()]
+    checkpoints = []
+    if checkpoint_path is not None:
+        for k in range(len(targets)):
+            checkpoints.append(Checkpoint(checkpoint_path if len(targets) == 1 else f"{checkpoint_path}.{k}", resume))
+    else:
+        checkpoints = [None] * len(targets)
+
+    caches = [None] * len(targets)
+    if cache_path is not None:
+        caches[0] = ResponseCache(cache_path, targets[0][0], targets[0][1], cache_max_size_mb, cache_max_age_hours)
+        for k in range(1, len(targets)):
+            caches[k] = caches[0].for_function(*targets[k])
+
+    controller = AdaptiveConcurrency(concurrency, max_retries=max_retries) if adaptive else None
+    semaphore = asyncio.Semaphore(concurrency) if controller is None else None
+
+    for target_stats, cache in zip(stats, caches):
+        target_stats.concurrency = concurrency
+        target_stats.cache = cache
+        target_stats.controller = controller
+        target_stats.row_timeout = row_timeout
+        target_stats.hedge = hedge
+
+    runs = []
+    try:
+        for (module_path, function_name), fn, target_dataset, checkpoint, cache in zip(targets, functions, datasets, checkpoints, caches):
+            wrapper = create_wrapper(fn, function_name, executor)
+            runs.append(run_rows(wrapper, target_dataset, concurrency, fields, checkpoint, cache, executor, controller, semaphore, row_timeout, hedge))
+
+        # Every run yields every row, in order, so rows line up by position
+        pending = [collections.deque() for _ in runs]
+
+        async def next_batches():
+            empty = [k for k, queue in enumerate(pending) if not queue]
+            batches = await asyncio.gather(*(runs[k].__anext__() for k in empty), return_exceptions=True)
+            for k, batch in zip(empty, batches):
+                if isinstance(batch, StopAsyncIteration):
+                    return False
+                if isinstance(batch, BaseException):
+                    raise batch
+                pending[k].extend(batch)
+            return True
 
-def bulk_run(
+        while loop.run_until_complete(next_batches()):
+            while all(pending):
+                outcomes = [queue.popleft() for queue in pending]
+                yield outcomes[0][0], [(answer, metrics) for _, answer, metrics in outcomes]
+
+    finally:
+        for run in runs:
+            loop.run_until_complete(run.aclose())
+        if executor is not None:
+            executor.shutdown(wait=True)
+        for checkpoint in checkpoints:
+            if checkpoint is not None:
+                checkpoint.close()
+        if caches[0] is not None:
+            caches[0].close()
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        asyncio.set_event_loop(None)
+        loop.close()
+
+    for target_stats in stats:
+        target_stats.finish()
+
+def create_result(d, answer, metrics, question_field, truth_field, include_metrics = False):
+    result = {
+        "question": d.get(question_field),
+        "truth": d.get(truth_field),
+        "answer": answer,
+        "context": ""
+    }
+    if include_metrics:
+        result["metrics"] = { key: value for key, value in metrics.items() if key != "error" }
+        if "error" in metrics:
+            result["error"] = metrics["error"]
+    return result
+
+def iter_bulk_run(
     module_path: str,
     function_name: str,
     dataset_or_path: [str, list],
@@ -147,83 +861,483 @@ def bulk_run(
     question_field: str  = "question",
     truth_field: str  = "truth",
     answer_field: str  = "answer",
-    correct_field: str  = "correct"):
-
-    wrapper = create_wrapper(module_path, function_name)
-
-    if isinstance(dataset_or_path, str):
-        path = pathlib.Path.cwd() / dataset_or_path
-        dataset = load_jsonl(path)
-    elif isinstance(dataset_or_path, list):
-        dataset = dataset_or_path
-
-    results = []
-    for d in dataset:
-        result = wrapper(messages_field, stream_field, session_state_field, context_field, question_field, d)
-
-        answer = None
-        if result is not None:
-            if isinstance(result, str):
-                print("===it's a string===")
-                print(result)
-                answer = result
-                
-            elif isinstance(result, list) and all(isinstance(item, str) for item in result):
-                print("===it's a list===")
-                print(result)
-                answer = "\n".join(result)
-
-            # if it's a generator
-            elif issubclass(type(result), Generator) :
-                print("===it's a generator===")
-                print(result)
-                answer = "\n".join(result)
-
-            # if the "openai.openai_object.OpenAIObject"
-            elif (type(result).__name__ == "OpenAIObject"):
-                print("===it's an OpenAIObject===")
-                print(result.choices[0].message.content)
-                answer = result.choices[0].message.content
-
-            # if it's a dictionary that has a "choices" key
-            elif (isinstance(result, dict) and "choices" in result):
-                print("===it's a dictionary with a 'choices' key===")
-                print(result["choices"][0]["message"]["content"])
-                answer = result["choices"][0]["message"]["content"]
+    correct_field: str  = "correct",
+    concurrency: int = 1,
+    checkpoint_path: str = None,
+    resume: bool = False,
+    cache_path: str = None,
+    cache_max_size_mb: float = 1024,
+    cache_max_age_hours: float = 168,
+    adaptive: bool = False,
+    max_retries: int = 5,
+    shard: tuple = None,
+    sample: int = None,
+    seed: int = 0,
+    stats: RunStats = None,
+    row_timeout: float = None,
+    hedge: bool = False,
+    profiler: Profiler = None,
+    include_metrics: bool = False):
+    """Yield one result per answered row, in input order, as soon as it is available.
+
+    Run-wide metrics are collected in `stats`. With `include_metrics`, each result also carries its
+    row's metrics, and rows that failed are yielded too, with their error and no answer.
+    """
+
+    stats = stats if stats is not None else RunStats()
+    rows = iter_run_targets([(module_path, function_name)], dataset_or_path,
+        messages_field, stream_field, session_state_field, context_field, question_field, truth_field,
+        concurrency, checkpoint_path, resume, cache_path, cache_max_size_mb, cache_max_age_hours,
+        adaptive, max_retries, shard, sample, seed, [stats], row_timeout, hedge, profiler)
+
+    for d, [(answer, metrics)] in rows:
+        stats.add(answer, metrics)
+        if answer is not None or (include_metrics and "error" in metrics):
+            yield create_result(d, answer, metrics, question_field, truth_field, include_metrics)
+
+    summary = stats.summary()
+    print(f"Ran {summary['rows']} rows in {summary['elapsed_sec']:.2f}s ({summary['rows_per_sec']:.2f} rows/sec, concurrency={stats.concurrency})")
+    print(f"Latency (ms): p50={summary['latency_ms']['p50']} p95={summary['latency_ms']['p95']} p99={summary['latency_ms']['p99']}")
+    if stats.from_checkpoint > 0:
+        print(f"Resumed {stats.from_checkpoint} rows from checkpoint: {checkpoint_path}")
+    if stats.cache is not None:
+        cache_summary = stats.cache.summary()
+        print(f"Cache: {cache_summary['hits']} hits, {cache_summary['misses']} misses ({cache_summary['hit_rate']:.1%} hit rate)")
+    if stats.row_timeout is not None or stats.hedge:
+        print(f"Timeouts: {stats.timeouts}, hedged: {stats.hedged} ({stats.hedge_wins} won by the hedge)")
+    if stats.controller is not None:
+        controller = stats.controller
+        print(f"Adaptive concurrency: final={int(controller.limit)} max={stats.concurrency} throttled={controller.throttled} retries={controller.retries}")
+
+def bulk_run(module_path: str, function_name: str, dataset_or_path: [str, list], **kwargs):
+    return list(iter_bulk_run(module_path, function_name, dataset_or_path, **kwargs))
+
+def iter_bulk_run_variants(
+    targets: list,
+    dataset_or_path: [str, list],
+    messages_field: str = "messages",
+    stream_field: str  = "stream",
+    session_state_field: str  = "session_state",
+    context_field: str  = "context",
+    question_field: str  = "question",
+    truth_field: str  = "truth",
+    answer_field: str  = "answer",
+    correct_field: str  = "correct",
+    concurrency: int = 1,
+    checkpoint_path: str = None,
+    resume: bool = False,
+    cache_path: str = None,
+    cache_max_size_mb: float = 1024,
+    cache_max_age_hours: float = 168,
+    adaptive: bool = False,
+    max_retries: int = 5,
+    shard: tuple = None,
+    sample: int = None,
+    seed: int = 0,
+    stats: RunStats = None,
+    row_timeout: float = None,
+    hedge: bool = False,
+    profiler: Profiler = None,
+    include_metrics: bool = False):
+    """Run several "MODULE:FUNCTION" targets over one pass of the dataset, yielding one aligned
+    result per row with each target's answer (and with `include_metrics`, its metrics) under
+    "variants", in target order.
+    """
+
+    stats = stats if stats is not None else RunStats()
+    stats.concurrency = max(1, concurrency)
+    stats.variants = { target: RunStats() for target in targets }
+    rows = iter_run_targets([tuple(target.rsplit(":", 1)) for target in targets], dataset_or_path,
+        messages_field, stream_field, session_state_field, context_field, question_field, truth_field,
+        concurrency, checkpoint_path, resume, cache_path, cache_max_size_mb, cache_max_age_hours,
+        adaptive, max_retries, shard, sample, seed, list(stats.variants.values()), row_timeout, hedge, profiler)
+
+    for d, outcomes in rows:
+        stats.add_variants(outcomes)
+        variants = []
+        for target, (answer, metrics) in zip(targets, outcomes):
+            variant = create_result(d, answer, metrics, question_field, truth_field, include_metrics)
+            variants.append({ "function": target, **{ key: value for key, value in variant.items() if key not in ("question", "truth", "context") } })
+        yield { "question": d.get(question_field), "truth": d.get(truth_field), "context": "", "variants": variants }
+
+    stats.finish()
+    summary = stats.summary()
+    print(f"Ran {summary['rows']} rows x {len(targets)} functions in {summary['elapsed_sec']:.2f}s (concurrency={stats.concurrency})")
+    width = max(len(target) for target in targets)
+    print(f"{'Function'.ljust(width)}  answered  errors  p50 ms  p95 ms  p99 ms  tokens  same answer as first")
+    for target, comparison in summary["comparison"].items():
+        latency = comparison["latency_ms"]
+        print(f"{target.ljust(width)}  {comparison['answered']:>8}  {comparison['errors']:>6}  {str(latency['p50']):>6}  {str(latency['p95']):>6}  {str(latency['p99']):>6}  {str(comparison['total_tokens']):>6}  {comparison['same_answer_as_first']:.1%}")
+
+class JsonResultWriter:
+    """Writes results as a JSON array, formatted like json.dumps(results, indent=2), one row at a time."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def write(self, result):
+        formatted = json.dumps(result, indent=2).replace("\n", "\n  ")
+        self.stream.write(("[\n  " if self.count == 0 else ",\n  ") + formatted)
+        self.stream.flush()
+        self.count += 1
+
+    def close(self):
+        self.stream.write("[]\n" if self.count == 0 else "\n]\n")
+        self.stream.flush()
+
+class JsonlResultWriter:
+    """Writes results as JSON Lines, one compact row per line."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def write(self, result):
+        self.stream.write(json.dumps(result) + "\n")
+        self.stream.flush()
+        self.count += 1
+
+    def close(self):
+        self.stream.flush()
 
+class ArrowResultWriter:
+    """Writes results as Parquet or Arrow IPC, one row group per `row_group_size` rows as they arrive.
+
+    Each metric gets its own "metrics_<name>" column, so readers can load just the columns they
+    need. `column_types` (e.g. {"metrics_latency_ms": "float64"}) names the columns every file has;
+    any other columns, and their types, are taken from the first row group.
+    """
+
+    def __init__(self, stream, output_format, row_group_size = 1000, column_types = None):
+        try:
+            import pyarrow
+        except ImportError:
+            raise Exception(f"--output-format {output_format} requires pyarrow; install it with `pip install pyarrow`")
+
+        self.stream = stream
+        self.output_format = output_format
+        self.row_group_size = row_group_size
+        self.column_types = column_types or {}
+        self.rows = []
+        self.schema = None
+        self.writer = None
+        self.count = 0
+
+    @staticmethod
+    def flatten(result):
+        row = {}
+        for key, value in result.items():
+            if key == "variants" and isinstance(value, list):
+                # Multi-function runs get one set of columns per function, named "<function>/<column>"
+                for variant in value:
+                    columns = ArrowResultWriter.flatten({ name: column for name, column in variant.items() if name != "function" })
+                    row.update({ f"{variant.get('function')}/{name}": column for name, column in columns.items() })
+            elif key == "metrics" and isinstance(value, dict):
+                for metric, metric_value in value.items():
+                    row["metrics_" + metric] = json.dumps(metric_value) if isinstance(metric_value, (dict, list)) else metric_value
             else:
-                print("===it's something else===")
-                print(type(result))
-                print(result)
-                answer = str(result)
+                row[key] = json.dumps(value) if isinstance(value, (dict, list)) else value
+        return row
 
-        if answer is not None:
-            results.append({
-                "question": d[question_field],
-                "truth": d[truth_field],
-                "answer": answer,
-                "context": ""
-            })
-    return results
+    def write(self, result):
+        self.rows.append(self.flatten(result))
+        self.count += 1
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def open(self, schema):
+        import pyarrow as pa
+        self.schema = schema
+        if self.output_format == "parquet":
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(self.stream, schema)
+        else:
+            self.writer = pa.ipc.new_file(self.stream, schema)
+
+    def flush(self):
+        if not self.rows:
+            return
+
+        import pyarrow as pa
+        if self.schema is None:
+            fields = [pa.field(name, pa.type_for_alias(alias)) for name, alias in self.column_types.items()]
+            for field in pa.Table.from_pylist(self.rows).schema:
+                if field.name in self.column_types:
+                    continue
+                field_type = field.type
+                if pa.types.is_null(field_type):
+                    field_type = pa.string()
+                elif field.name.startswith("metrics_") and pa.types.is_integer(field_type):
+                    # Scores that happen to be whole numbers in the first row group may not be later on
+                    field_type = pa.float64()
+                fields.append(pa.field(field.name, field_type))
+            self.open(pa.schema(fields))
+
+        self.writer.write_table(pa.Table.from_pylist(self.rows, schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.writer is None:
+            import pyarrow as pa
+            self.open(pa.schema([pa.field(name, pa.type_for_alias(alias)) for name, alias in self.column_types.items()]))
+        self.writer.close()
+
+class FramedEventWriter:
+    """Writes length-prefixed JSON events, one frame per line: "\\x1e<length> <json>".
+
+    Events are {"type": "log" | "progress" | "row" | "payload", ...}. While installed as
+    sys.stdout, printed text is buffered and sent as "log" events ahead of the next frame,
+    and the underlying stream is flushed once per frame instead of once per print.
+    """
+
+    MARKER = "\x1e"
+
+    def __init__(self, stream, progress_interval = 1.0):
+        self.stream = stream
+        self.log_buffer = []
+        self.log_size = 0
+        self.progress_interval = progress_interval
+        self.last_progress = time.perf_counter()
+
+    def write(self, data):
+        self.log_buffer.append(data)
+        self.log_size += len(data)
+        if self.log_size >= 65536:
+            self.flush_log()
+
+    def flush(self):
+        pass
+
+    def flush_log(self):
+        if self.log_buffer:
+            text = "".join(self.log_buffer)
+            self.log_buffer = []
+            self.log_size = 0
+            self.write_frame({ "type": "log", "text": text })
+
+    def event(self, event):
+        self.flush_log()
+        self.write_frame(event)
+
+    def progress(self, stats, force = False):
+        now = time.perf_counter()
+        if force or now - self.last_progress >= self.progress_interval:
+            self.last_progress = now
+            elapsed = now - stats.start
+            self.event({ "type": "progress", "rows": stats.rows, "answered": stats.answered, "errors": stats.errors,
+                "elapsed_sec": round(elapsed, 3), "rows_per_sec": round(stats.rows / elapsed, 3) if elapsed > 0 else 0.0 })
+
+    def write_frame(self, event):
+        # json.dumps escapes non-ASCII, so the character count is also the UTF-8 byte count
+        data = json.dumps(event)
+        self.stream.write(self.MARKER + str(len(data)) + " " + data + "\n")
+        self.stream.flush()
+
+RESULT_COLUMN_TYPES = {
+    "question": "string",
+    "truth": "string",
+    "answer": "string",
+    "context": "string",
+    "error": "string",
+    "metrics_source": "string",
+    "metrics_latency_ms": "float64",
+    "metrics_time_to_first_item_ms": "float64",
+    "metrics_output_chars": "int64",
+    "metrics_total_tokens": "int64",
+    "metrics_retries": "int64",
+    "metrics_error": "string"
+}
+
+BINARY_OUTPUT_FORMATS = ["parquet", "arrow"]
+
+def get_result_column_types(functions = None):
+    if functions is None:
+        return RESULT_COLUMN_TYPES
+    shared = ("question", "truth", "context")
+    column_types = { name: RESULT_COLUMN_TYPES[name] for name in shared }
+    for function in functions:
+        column_types.update({ f"{function}/{name}": alias for name, alias in RESULT_COLUMN_TYPES.items() if name not in shared })
+    return column_types
+
+def create_result_writer(output_format, stream, functions = None):
+    if output_format == "json":
+        return JsonResultWriter(stream)
+    elif output_format == "jsonl":
+        return JsonlResultWriter(stream)
+    elif output_format in BINARY_OUTPUT_FORMATS:
+        return ArrowResultWriter(stream, output_format, column_types=get_result_column_types(functions))
+    raise Exception("Unsupported output format: " + output_format)
+
+def iter_result_file(path):
+    with open(path, "r") as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == "[":
+            yield from json.load(f)
+        else:
+            yield from (json.loads(line) for line in f if line.strip())
+
+def iter_merged_results(paths, stats):
+    """Concatenate per-shard result files, given in shard order, recomputing run metrics from the rows."""
+
+    stats.merged_from = len(paths)
+    for path in paths:
+        for result in iter_result_file(path):
+            if "variants" in result:
+                raise Exception("Merging results of multi-function runs is not supported: " + path)
+            metrics = dict(result.get("metrics", {}))
+            if "error" in result:
+                metrics["error"] = result["error"]
+            stats.add(result.get("answer"), metrics)
+            yield result
+
+def iter_events(results, events, stats, rows = False):
+    # Every row is also in the payload, so "row" frames are only sent to consumers that stream them
+    for result in results:
+        if rows:
+            events.event({ "type": "row", "result": result })
+        events.progress(stats)
+        yield result
+
+def run_from_args(args, stats, profiler = None):
+    options = dict(
+        stats=stats,
+        profiler=profiler,
+        shard=parse_shard(args.shard) if args.shard is not None else None,
+        sample=args.sample,
+        seed=args.seed,
+        concurrency=args.concurrency,
+        adaptive=args.adaptive_concurrency,
+        max_retries=args.max_retries,
+        checkpoint_path=args.checkpoint,
+        resume=args.resume,
+        cache_path=args.cache,
+        cache_max_size_mb=args.cache_max_size,
+        cache_max_age_hours=args.cache_max_age,
+        row_timeout=args.row_timeout,
+        hedge=args.hedge,
+        include_metrics=args.metrics)
+
+    if len(args.function) > 1:
+        return iter_bulk_run_variants(args.function, args.data, **options)
+
+    module, function = args.function[0].rsplit(":", 1)
+    return iter_bulk_run(module, function, args.data, **options)
 
 def main():
 
     import argparse
     parser = argparse.ArgumentParser(description="Bulk Run a python function call")
-    parser.add_argument("--function", required=True, help="Module and function name in the format MODULE:FUNCTION.")
-    parser.add_argument("--data", required=True, help="Path to the dataset file")
+    parser.add_argument("--function", nargs="+", required=False, help="Module and function name in the format MODULE:FUNCTION; several run side by side over one pass of the data.")
+    parser.add_argument("--data", required=False, help="Path to the dataset file")
+    parser.add_argument("--shard", required=False, help="Run only shard i of n (zero-based), in the format i/n.")
+    parser.add_argument("--sample", type=int, required=False, help="Run only a random sample of N rows.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for --sample.")
+    parser.add_argument("--merge", nargs="+", required=False, help="Merge per-shard result files, given in shard order, instead of running.")
+    parser.add_argument("--concurrency", type=int, default=1, help="Maximum number of rows to run at the same time.")
+    parser.add_argument("--adaptive-concurrency", action="store_true", help="Adjust concurrency up to --concurrency based on latency and throttling, retrying throttled rows.")
+    parser.add_argument("--max-retries", type=int, default=5, help="Maximum retries for a throttled row with --adaptive-concurrency.")
+    parser.add_argument("--row-timeout", type=float, required=False, help="Fail any row still running after this many seconds.")
+    parser.add_argument("--hedge", action="store_true", help="Re-issue a row that runs longer than the p95 latency so far, keeping whichever attempt finishes first.")
+    parser.add_argument("--output", required=False, help="Path to write results to as each row finishes.")
+    parser.add_argument("--output-format", default="json", choices=["json", "jsonl"] + BINARY_OUTPUT_FORMATS, help="Format of the results; parquet and arrow require --output.")
+    parser.add_argument("--checkpoint", required=False, help="Path to a file recording each completed row.")
+    parser.add_argument("--resume", action="store_true", help="Skip rows already completed in the checkpoint file.")
+    parser.add_argument("--cache", required=False, help="Path to a SQLite file caching answers across runs.")
+    parser.add_argument("--cache-max-size", type=float, default=1024, help="Maximum size of the cache in MB.")
+    parser.add_argument("--cache-max-age", type=float, default=168, help="Maximum age of cache entries in hours.")
+    parser.add_argument("--profile", nargs="+", choices=list(Profiler.SUFFIXES), required=False, help="Profile the function across all rows: cpu (cProfile), memory (tracemalloc) and/or imports (import times).")
+    parser.add_argument("--profile-output", required=False, help="Base path of the profile files (default: next to --output); each kind adds its own extension.")
+    parser.add_argument("--metrics", action="store_true", help="Add each row's metrics to its result, and include rows that failed, with their error; --merge needs them to recompute the run summary.")
+    parser.add_argument("--summary", required=False, help="Path to write the run summary (latency percentiles, rows/sec, tokens) to as JSON.")
+    parser.add_argument("--framed-events", action="store_true", help="Write length-prefixed JSON events to stdout instead of free-form text.")
+    parser.add_argument("--row-events", action="store_true", help="With --framed-events, also send each result as a \"row\" event as it finishes.")
     args = parser.parse_args()
 
-    moduleAndFunction = args.function
-    data = args.data
+    if args.resume and args.checkpoint is None:
+        parser.error("--resume requires --checkpoint")
+    if args.merge is None and (args.function is None or args.data is None):
+        parser.error("--function and --data are required unless --merge is used")
+    if args.function is not None and len(set(args.function)) < len(args.function):
+        parser.error("each --function target may only be given once")
+    if args.output_format in BINARY_OUTPUT_FORMATS and args.output is None:
+        parser.error(f"--output-format {args.output_format} requires --output")
+    if args.row_events and not args.framed_events:
+        parser.error("--row-events requires --framed-events")
+
+    profiler = None
+    if args.profile is not None:
+        profile_output = args.profile_output
+        if profile_output is None:
+            profile_output = os.path.splitext(args.output)[0] + ".profile" if args.output is not None else "function_call_run.profile"
+        profiler = Profiler(args.profile, profile_output)
+
+    stats = RunStats()
+    stats.profile = profiler.files if profiler is not None else None
+    if args.merge is not None:
+        results = iter_merged_results(args.merge, stats)
+    else:
+        results = run_from_args(args, stats, profiler)
+
+    events = None
+    if args.framed_events:
+        events = FramedEventWriter(sys.__stdout__)
+        sys.stdout = events
+        results = iter_events(results, events, stats, args.row_events)
+
+    try:
+        if profiler is not None:
+            profiler.start()
+
+        payload = None
+        if args.output is not None:
+            with open(args.output, "wb" if args.output_format in BINARY_OUTPUT_FORMATS else "w") as f:
+                writer = create_result_writer(args.output_format, f, args.function if args.function is not None and len(args.function) > 1 else None)
+                for result in results:
+                    writer.write(result)
+                writer.close()
+
+            payload = json.dumps({ "output": args.output, "rows": writer.count, "summary": stats.summary() }, indent=2)
+
+        elif args.output_format == "jsonl" and events is None:
+            # Rows stream to stdout after the marker, so everything else the run prints goes to stderr
+            stdout = sys.stdout
+            print("---")
+            writer = create_result_writer(args.output_format, stdout)
+            with contextlib.redirect_stdout(sys.stderr):
+                for result in results:
+                    writer.write(result)
+            writer.close()
+
+        elif args.output_format == "jsonl":
+            payload = "\n".join(json.dumps(result) for result in results)
+
+        else:
+            result = list(results)
+            payload = json.dumps(result, indent=2)
 
-    module, function = moduleAndFunction.rsplit(":", 1)
+        if profiler is not None:
+            with contextlib.redirect_stdout(sys.stderr):
+                profiler.stop()
 
-    result = bulk_run(module, function, data)
-    formatted = json.dumps(result, indent=2)
+        if payload is not None and events is not None:
+            events.progress(stats, force=True)
+            events.event({ "type": "payload", "text": payload })
+        elif payload is not None:
+            print("---")
+            print(payload)
+    finally:
+        # Text printed before a failure (e.g. "function not found") still goes out as a log event
+        if events is not None:
+            events.flush_log()
 
-    print("---")
-    print(formatted)
+    if args.summary is not None:
+        with open(args.summary, "w") as f:
+            json.dump(stats.summary(), f, indent=2)
 
 if __name__ == "__main__":
     try:
@@ -1,7 +1,17 @@
 import argparse
+import collections
+import functools
+import glob
+import hashlib
+import io
+import itertools
 import json
 import os
+import pathlib
 import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 class AutoFlushingStream:
     def __init__(self, stream):
@@ -31,38 +41,13 @@ class IndexEncoder(json.JSONEncoder):
             }
         return super().default(obj)
 
-def search_index_update(
-    subscription_id : str,
-    resource_group_name : str,
-    project_name : str,
-    index_name : str,
-    embedding_model_deployment : str,
-    embedding_model_name : str, 
-    data_files : str, 
-    external_source_url : str):
-
-    from azure.identity import DefaultAzureCredential
-    from azure.ai.resources.client import AIClient
-
-    client = AIClient(
-        credential=DefaultAzureCredential(),
-        subscription_id=subscription_id,
-        resource_group_name=resource_group_name,
-        project_name=project_name,
-        user_agent="ai-cli 0.0.1"
-    )
-
-    openaiConnection = client.get_default_aoai_connection()
-    # openaiConnection.set_current_environment()
+# Version 2 stopped indexing binary files as text; older manifests rebuild from scratch
+MANIFEST_VERSION = 2
 
-    # This is a workaround for build_index(), as it has nested logic depending on openai 0.x environment variables.
-    # This sets environment variables in openai 0.x fashion.
-    openaiConnection._set_current_environment_old()
-    # This sets environment variables in openai 1.x fashion.
-    openaiConnection._set_current_environment_new()
-    searchConnection = client.connections.get("AzureAISearch")
-    searchConnection.set_current_environment()
+# The types build_index read, except the legacy binary .doc/.ppt/.xls, which need converting to their Open XML formats
+SUPPORTED_EXTENSIONS = (".txt", ".md", ".py", ".csv", ".json", ".html", ".htm", ".pdf", ".docx", ".pptx", ".xlsx")
 
+def split_data_files(data_files: str):
     # data_files is a string that specifies one of the following three things:
     # 1. A path to a directory containing data files (no glob, e.g. "path/to/data")
     # 2. A glob pattern that matches data files (no directory path, e.g. "*.json")
@@ -74,6 +59,8 @@ def search_index_update(
     # if there is a glob pattern, the glob will start with "**/"
     # if there is a path and a glob pattern, the path will end with a slash
     data_files_path, data_files_glob_pattern = os.path.split(data_files)
+    if os.path.isdir(data_files):
+        data_files_path, data_files_glob_pattern = data_files, ""
     if data_files_path == "":
         data_files_path = "."
     if data_files_glob_pattern == "":
@@ -82,39 +69,1291 @@ def search_index_update(
         data_files_glob_pattern = "**/" + data_files_glob_pattern
     if not data_files_path.endswith("/"):
         data_files_path = data_files_path + "/"
+    return data_files_path, data_files_glob_pattern
+
+def iter_data_files(data_files_path: str, data_files_glob_pattern: str, exclude_dirs = ()):
+    """Yield the relative (posix) paths of the data files matching the glob, in a stable order; files of
+    unsupported types are skipped."""
+    root = os.path.realpath(data_files_path)
+    excluded = []
+    for exclude_dir in exclude_dirs:
+        relative_dir = os.path.relpath(os.path.realpath(exclude_dir), root)
+        if not relative_dir.startswith(".."):
+            excluded.append(pathlib.PurePath(relative_dir).as_posix() + "/")
+
+    paths = []
+    for path in glob.iglob(data_files_glob_pattern, root_dir=root, recursive=True):
+        path = pathlib.PurePath(path).as_posix()
+        if any(path.startswith(d) for d in excluded) or not os.path.isfile(os.path.join(root, path)):
+            continue
+        if os.path.splitext(path)[1].lower() not in SUPPORTED_EXTENSIONS:
+            print(f"Skipping unsupported file: {path}")
+            continue
+        paths.append(path)
+    yield from sorted(paths)
+
+def hash_file(path: str):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+@functools.lru_cache(maxsize=None)
+def get_token_counter():
+    """Return a function counting the tokens in a text; uses tiktoken when installed, otherwise ~4 characters per token."""
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        # Not installed, or its encoding can't be downloaded (e.g. offline)
+        return lambda text: (len(text) + 3) // 4
+
+def html_to_text(html: str):
+    from html.parser import HTMLParser
+
+    class TextExtractor(HTMLParser):
+        SKIP = { "script", "style", "head" }
+        BLOCKS = { "p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "pre", "table" }
+
+        def __init__(self):
+            super().__init__()
+            self.parts = []
+            self.skipping = 0
+
+        def handle_starttag(self, tag, attrs):
+            if tag in self.SKIP:
+                self.skipping += 1
+            elif tag in self.BLOCKS:
+                self.parts.append("\n\n")
+
+        def handle_endtag(self, tag):
+            if tag in self.SKIP and self.skipping > 0:
+                self.skipping -= 1
+            elif tag in self.BLOCKS:
+                self.parts.append("\n\n")
+
+        def handle_data(self, data):
+            if self.skipping == 0:
+                self.parts.append(data)
+
+    extractor = TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return "".join(extractor.parts)
+
+def get_xml_parts(archive, parts_prefix: str):
+    """Return the names of an Office Open XML archive's XML parts starting with parts_prefix, in numeric order."""
+    import re
+    parts = [name for name in archive.namelist() if name.startswith(parts_prefix) and name.endswith(".xml")]
+    # slide10.xml comes after slide9.xml
+    return sorted(parts, key=lambda name: [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)])
+
+def read_office_xml(data: bytes, parts_prefix: str, namespace: str):
+    """Read the paragraphs of an Office Open XML (docx/pptx) file from its XML parts, in part order."""
+    import zipfile
+    from xml.etree import ElementTree
+
+    paragraphs = []
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for name in get_xml_parts(archive, parts_prefix):
+            root = ElementTree.fromstring(archive.read(name))
+            for paragraph in root.iter(f"{{{namespace}}}p"):
+                text = "".join(node.text or "" for node in paragraph.iter(f"{{{namespace}}}t"))
+                if text.strip():
+                    paragraphs.append(text)
+    return "\n\n".join(paragraphs)
+
+def read_xlsx(data: bytes):
+    """Read an xlsx workbook as text: a line of tab-separated cell values per row, and a paragraph per sheet."""
+    import zipfile
+    from xml.etree import ElementTree
+
+    ns = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+    sheets = []
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        shared_strings = []
+        if "xl/sharedStrings.xml" in archive.namelist():
+            for item in ElementTree.fromstring(archive.read("xl/sharedStrings.xml")).iter(f"{ns}si"):
+                shared_strings.append("".join(node.text or "" for node in item.iter(f"{ns}t")))
+
+        for name in get_xml_parts(archive, "xl/worksheets/sheet"):
+            lines = []
+            for row in ElementTree.fromstring(archive.read(name)).iter(f"{ns}row"):
+                values = []
+                for cell in row.iter(f"{ns}c"):
+                    value = cell.find(f"{ns}v")
+                    if cell.get("t") == "s" and value is not None:
+                        values.append(shared_strings[int(value.text)])
+                    elif cell.get("t") == "inlineStr":
+                        values.append("".join(node.text or "" for node in cell.iter(f"{ns}t")))
+                    else:
+                        values.append(value.text or "" if value is not None else "")
+                if any(values):
+                    lines.append("\t".join(values))
+            if lines:
+                sheets.append("\n".join(lines))
+    return "\n\n".join(sheets)
+
+def read_document(path: str, data: bytes = None):
+    """Read the text of a data file, or of its already read bytes; HTML is stripped to text, PDFs are read with
+    pypdf, docx/pptx/xlsx are read from their XML, and everything else is read as UTF-8 text."""
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".docx":
+        return read_office_xml(data, "word/document.xml", "http://schemas.openxmlformats.org/wordprocessingml/2006/main")
+    if extension == ".pptx":
+        return read_office_xml(data, "ppt/slides/slide", "http://schemas.openxmlformats.org/drawingml/2006/main")
+    if extension == ".xlsx":
+        return read_xlsx(data)
+    if extension == ".pdf":
+        try:
+            import pypdf
+        except ImportError:
+            raise Exception("Reading PDF files requires the pypdf package: pip install pypdf")
+        reader = pypdf.PdfReader(io.BytesIO(data))
+        return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+
+    text = data.decode("utf-8", errors="replace")
+    if extension in (".html", ".htm"):
+        text = html_to_text(text)
+    return text
+
+def split_text(text: str, chunk_size: int, chunk_overlap: int, count_tokens):
+    """Split text into chunks of at most chunk_size tokens, on paragraph, then line, then word boundaries.
+    Consecutive chunks share up to chunk_overlap tokens of trailing pieces."""
+    pieces = []
+    for paragraph in text.split("\n\n"):
+        paragraph = paragraph.strip()
+        if paragraph == "":
+            continue
+        tokens = count_tokens(paragraph)
+        if tokens <= chunk_size:
+            pieces.append((paragraph, tokens))
+            continue
+        for line in paragraph.split("\n"):
+            line = line.strip()
+            tokens = count_tokens(line)
+            if tokens <= chunk_size:
+                pieces.append((line, tokens))
+                continue
+            words, word_tokens = [], 0
+            for word in line.split():
+                tokens = count_tokens(word + " ")
+                if words and word_tokens + tokens > chunk_size:
+                    pieces.append((" ".join(words), word_tokens))
+                    words, word_tokens = [], 0
+                words.append(word)
+                word_tokens += tokens
+            if words:
+                pieces.append((" ".join(words), word_tokens))
+
+    chunks = []
+    current, current_tokens = [], 0
+    for piece, tokens in pieces:
+        if current and current_tokens + tokens > chunk_size:
+            chunks.append("\n\n".join(p for p, _ in current))
+            overlap, overlap_tokens = [], 0
+            for p, t in reversed(current):
+                if overlap_tokens + t > chunk_overlap or overlap_tokens + t + tokens > chunk_size:
+                    break
+                overlap.insert(0, (p, t))
+                overlap_tokens += t
+            current, current_tokens = overlap, overlap_tokens
+        current.append((piece, tokens))
+        current_tokens += tokens
+    if current:
+        chunks.append("\n\n".join(p for p, _ in current))
+    return chunks
+
+def get_chunk_id(relative_path: str, index: int, content: str):
+    """Chunk IDs are stable for unchanged files, so a re-run can tell which stored chunks belong to which file."""
+    return hashlib.sha256(f"{relative_path}\n{index}\n{content}".encode("utf-8")).hexdigest()
+
+def chunk_file(data_files_path: str, relative_path: str, chunk_size: int, chunk_overlap: int, external_source_url: str = None):
+    """Read, hash and chunk one data file; returns (sha256, bytes read, chunks). Runs in the parse worker processes."""
+    path = os.path.join(data_files_path, relative_path)
+    with open(path, "rb") as f:
+        data = f.read()
+    text = read_document(path, data)
+    count_tokens = get_token_counter()
+    url = external_source_url.rstrip("/") + "/" + relative_path if external_source_url else None
+    title = os.path.splitext(os.path.basename(relative_path))[0]
+    return hashlib.sha256(data).hexdigest(), len(data), [{
+        "id": get_chunk_id(relative_path, i, content),
+        "content": content,
+        "filepath": relative_path,
+        "title": title,
+        "url": url,
+    } for i, content in enumerate(split_text(text, chunk_size, chunk_overlap, count_tokens))]
+
+def iter_chunked_files(data_files_path: str, changed: list, chunk_size: int, chunk_overlap: int, external_source_url: str = None, workers: int = 1, window: int = None):
+    """Yield (relative_path, entry, sha256, bytes read, chunks) for each changed file, in order.
+
+    With more than one worker, files are read and chunked on a process pool, at most `window` files (default
+    4 per worker) ahead of the consumer; the consumer embedding a batch holds back the pool rather than letting
+    chunks pile up, which keeps memory bounded whatever the corpus size."""
+    if workers <= 1:
+        for relative_path, entry in changed:
+            yield (relative_path, entry) + chunk_file(data_files_path, relative_path, chunk_size, chunk_overlap, external_source_url)
+        return
+
+    window = window or workers * 4
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        files = iter(changed)
+        pending = collections.deque()
+        for relative_path, entry in itertools.islice(files, window):
+            pending.append((relative_path, entry, executor.submit(chunk_file, data_files_path, relative_path, chunk_size, chunk_overlap, external_source_url)))
+        while pending:
+            relative_path, entry, future = pending.popleft()
+            for next_path, next_entry in itertools.islice(files, 1):
+                pending.append((next_path, next_entry, executor.submit(chunk_file, data_files_path, next_path, chunk_size, chunk_overlap, external_source_url)))
+            yield (relative_path, entry) + future.result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+class IndexManifest:
+    """Per-file content hashes and chunk IDs of what is in the vector store, persisted as JSON alongside the index.
+
+    The manifest is only valid for the config (chunking and embedding model) it was written with; a different
+    config, or reset, starts from an empty manifest, which rebuilds everything."""
+
+    def __init__(self, path: str, config: dict, reset: bool = False):
+        self.path = path
+        self.config = config
+        self.dimension = None
+        self.files = {}
+        self.stale = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if not reset and manifest.get("version") == MANIFEST_VERSION and manifest.get("config") == config:
+                self.files = manifest["files"]
+                self.stale = manifest.get("stale", {})
+                self.dimension = manifest.get("dimension")
+            else:
+                # Chunks written before must still be deleted from the store unless they're written again
+                self.stale = dict(manifest.get("stale", {}), **manifest.get("files", {}))
+
+    def plan(self, data_files_path: str, relative_paths):
+        """Compare the data files against the manifest; returns (changed, removed, skipped).
+        changed holds (relative_path, entry) pairs with the new size and mtime of files to (re)index.
+        Files whose size and mtime match the manifest aren't re-hashed."""
+        changed, skipped = [], []
+        seen = set()
+        for relative_path in relative_paths:
+            seen.add(relative_path)
+            stat = os.stat(os.path.join(data_files_path, relative_path))
+            entry = { "size": stat.st_size, "mtime_ns": stat.st_mtime_ns }
+            previous = self.files.get(relative_path)
+            if previous is not None and previous["size"] == entry["size"] and previous["mtime_ns"] == entry["mtime_ns"]:
+                skipped.append(relative_path)
+                continue
+            if previous is None:
+                # New files are hashed when they're read for chunking
+                changed.append((relative_path, entry))
+                continue
+            entry["sha256"] = hash_file(os.path.join(data_files_path, relative_path))
+            if previous["sha256"] == entry["sha256"]:
+                # Touched but not changed; remember the new mtime so it isn't hashed again
+                previous.update(entry)
+                skipped.append(relative_path)
+                continue
+            changed.append((relative_path, entry))
+        removed = [relative_path for relative_path in self.files if relative_path not in seen]
+        return changed, removed, skipped
+
+    def chunk_ids(self, relative_path: str):
+        entry = self.files.get(relative_path) or self.stale.get(relative_path)
+        return entry["chunks"] if entry is not None else []
+
+    def set(self, relative_path: str, entry: dict, chunk_ids: list):
+        self.stale.pop(relative_path, None)
+        self.files[relative_path] = dict(entry, chunks=chunk_ids)
+
+    def remove(self, relative_path: str):
+        self.stale.pop(relative_path, None)
+        self.files.pop(relative_path, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({ "version": MANIFEST_VERSION, "config": self.config, "dimension": self.dimension, "files": self.files, "stale": self.stale }))
+        os.replace(temp_path, self.path)
+
+def get_throttling_retry_after(e):
+    """Return the Retry-After delay in seconds (0 if none was given) if e is a throttling error, otherwise None."""
+
+    response = getattr(e, "response", None)
+    status = getattr(e, "status_code", None) or getattr(e, "code", None) or getattr(response, "status_code", None)
+    if status != 429 and type(e).__name__ != "RateLimitError":
+        return None
+
+    headers = getattr(e, "headers", None) or getattr(response, "headers", None) or {}
+    retry_after = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return max(0.0, float(retry_after))
+    except (TypeError, ValueError):
+        return 0.0
+
+def pack_batches(token_counts: list, max_tokens: int, max_inputs: int):
+    """Pack texts into as few requests as possible of at most max_tokens tokens and max_inputs texts each
+    (first-fit decreasing); returns lists of text indexes. A text over max_tokens gets a request of its own."""
+    batches, batch_tokens = [], []
+    for i in sorted(range(len(token_counts)), key=lambda i: -token_counts[i]):
+        tokens = token_counts[i]
+        for b, batch in enumerate(batches):
+            if batch_tokens[b] + tokens <= max_tokens and len(batch) < max_inputs:
+                batch.append(i)
+                batch_tokens[b] += tokens
+                break
+        else:
+            batches.append([i])
+            batch_tokens.append(tokens)
+    return batches
+
+class TokenRateLimiter:
+    """Per-minute token budget over a sliding 60 second window, so no minute ever sees more than the budget."""
+
+    # A second longer than the service's minute, so sends stamped slightly later on arrival don't count twice
+    WINDOW = 61
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.sent = collections.deque()
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.sent and self.sent[0][0] <= now - self.WINDOW:
+                    self.used -= self.sent.popleft()[1]
+                if self.used + tokens <= self.capacity:
+                    self.sent.append((now, tokens))
+                    self.used += tokens
+                    return
+                # Wait until enough of the oldest sends leave the window
+                freed, wait = self.used + tokens - self.capacity, 0
+                for sent_at, sent_tokens in self.sent:
+                    freed -= sent_tokens
+                    wait = sent_at + self.WINDOW - now
+                    if freed <= 0:
+                        break
+            time.sleep(max(wait, 0.01))
+
+class AzureOpenAIEmbedder:
+    """Embeds texts with an Azure OpenAI embedding deployment.
+
+    Texts are packed into requests by token count, and up to `concurrency` requests are in flight at once, within
+    `tokens_per_minute` when given. Throttled requests are retried after their Retry-After (or an exponential
+    backoff), and hold back every other request until then. Without an endpoint, the environment set from the
+    project's default connection is used."""
+
+    API_VERSION = "2024-02-01"
+
+    def __init__(self, deployment: str, endpoint: str = None, key: str = None, batch_tokens: int = 8000, batch_size: int = 2048, concurrency: int = 4, tokens_per_minute: int = None, max_retries: int = 8):
+        from openai import AzureOpenAI
+        # Retries are done here, so throttling pauses every request rather than just the throttled one
+        if endpoint is None:
+            self.client = AzureOpenAI(max_retries=0)
+        else:
+            self.client = AzureOpenAI(azure_endpoint=endpoint, api_key=key or "none", api_version=self.API_VERSION, max_retries=0)
+        self.deployment = deployment
+        self.batch_tokens = batch_tokens
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.count_tokens = get_token_counter()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.limiter = TokenRateLimiter(tokens_per_minute) if tokens_per_minute else None
+        self.lock = threading.Lock()
+        self.paused_until = 0
+        self.requests = 0
+        self.retries = 0
+        self.tokens = 0
+        self.texts = 0
+        self.seconds = 0
+
+    def embed(self, texts: list):
+        start = time.perf_counter()
+        token_counts = [self.count_tokens(text) for text in texts]
+        batches = pack_batches(token_counts, self.batch_tokens, self.batch_size)
+        futures = [self.executor.submit(self.embed_batch, [texts[i] for i in batch], sum(token_counts[i] for i in batch)) for batch in batches]
+        vectors = [None] * len(texts)
+        for batch, future in zip(batches, futures):
+            for i, vector in zip(batch, future.result()):
+                vectors[i] = vector
+        self.seconds += time.perf_counter() - start
+        self.texts += len(texts)
+        return vectors
+
+    def embed_batch(self, texts: list, tokens: int):
+        for attempt in range(self.max_retries + 1):
+            delay = self.paused_until - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if self.limiter is not None:
+                self.limiter.acquire(tokens)
+            try:
+                response = self.client.embeddings.create(input=texts, model=self.deployment)
+            except Exception as e:
+                retry_after = get_throttling_retry_after(e)
+                if retry_after is None or attempt == self.max_retries:
+                    raise
+                with self.lock:
+                    self.retries += 1
+                    delay = retry_after if retry_after > 0 else min(60.0, 0.5 * 2 ** attempt)
+                    self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                continue
+            with self.lock:
+                self.requests += 1
+                self.tokens += tokens
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def close(self):
+        self.executor.shutdown()
+
+    def summary(self):
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "tokens": self.tokens,
+            "texts_per_request": round(self.texts / self.requests, 2) if self.requests > 0 else None,
+            "seconds": round(self.seconds, 3),
+            "chunks_per_sec": round(self.texts / self.seconds, 2) if self.seconds > 0 else None,
+        }
+
+def normalize_chunk_text(text: str):
+    import unicodedata
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+class EmbeddingCache:
+    """On-disk cache of embeddings, keyed on the embedding model and the normalized chunk text.
+
+    Each model gets its own directory holding a memory-mapped float32 matrix (vectors.f32) and a compact index
+    (index.bin) of a 16-byte key digest and last-use tick per matrix row. Once the cache reaches `max_size_mb`,
+    the least recently used tenth of the rows is evicted and their rows are reused."""
+
+    INDEX_DTYPE = [("key", "V16"), ("used", "<u8")]
+
+    def __init__(self, directory: str, model: str, max_size_mb: float = 1024, save_interval: float = 30):
+        import numpy as np
+        self.np = np
+        self.model = model
+        self.directory = os.path.join(directory, hashlib.sha256(model.encode("utf-8")).hexdigest()[:16])
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.save_interval = save_interval
+        self.last_save = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        self.dimension = None
+        self.index = np.zeros(0, dtype=self.INDEX_DTYPE)
+        self.vectors = None
+        self.slots = {}
+        self.free = []
+        self.tick = 0
+
+        meta_path = os.path.join(self.directory, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            index = np.fromfile(os.path.join(self.directory, "index.bin"), dtype=self.INDEX_DTYPE)
+            if meta.get("model") == model and len(index) == meta["rows"]:
+                self.dimension = meta["dimension"]
+                self.tick = meta["tick"]
+                self.index = index
+                self.vectors = np.memmap(os.path.join(self.directory, "vectors.f32"), dtype=np.float32, mode="r+", shape=(len(index), self.dimension))
+                empty = bytes(16)
+                keys = index["key"].tobytes()
+                for slot, key in enumerate(keys[i:i + 16] for i in range(0, len(keys), 16)):
+                    if key == empty:
+                        self.free.append(slot)
+                    else:
+                        self.slots[key] = slot
+
+    def key(self, text: str):
+        return hashlib.sha256((self.model + "\n" + normalize_chunk_text(text)).encode("utf-8")).digest()[:16]
+
+    def get_many(self, keys: list):
+        """Return the cached vector (a list of floats) or None for each key."""
+        vectors = []
+        for key in keys:
+            slot = self.slots.get(key)
+            if slot is None:
+                self.misses += 1
+                vectors.append(None)
+                continue
+            self.hits += 1
+            self.tick += 1
+            self.index["used"][slot] = self.tick
+            vectors.append(self.vectors[slot].tolist())
+        return vectors
+
+    def put_many(self, keys: list, vectors: list):
+        np = self.np
+        if not keys:
+            return
+        if self.dimension is None:
+            self.dimension = len(vectors[0])
+        max_rows = max(1, self.max_size // (self.dimension * 4 + self.index.itemsize))
+
+        keys_and_vectors = [(key, vector) for key, vector in zip(keys, vectors) if key not in self.slots]
+        needed = len(keys_and_vectors) - len(self.free)
+        if needed > 0 and len(self.index) + needed > max_rows:
+            self.evict(max(len(self.index) + needed - max_rows, max_rows // 10))
+        if len(keys_and_vectors) > len(self.free):
+            self.grow(min(max_rows, max(len(self.index) * 2, len(self.index) + len(keys_and_vectors) - len(self.free), 1024)))
+
+        for key, vector in keys_and_vectors[:len(self.free)]:
+            slot = self.free.pop()
+            self.tick += 1
+            self.slots[key] = slot
+            self.index[slot] = (key, self.tick)
+            self.vectors[slot] = vector
+
+        if time.monotonic() - self.last_save >= self.save_interval:
+            self.save()
+
+    def evict(self, count: int):
+        np = self.np
+        used = np.array([slot for slot in self.slots.values()], dtype=np.int64)
+        count = min(count, len(used))
+        if count == 0:
+            return
+        oldest = used[np.argpartition(self.index["used"][used], count - 1)[:count]]
+        for slot in oldest.tolist():
+            del self.slots[self.index["key"][slot].tobytes()]
+            self.index[slot] = (bytes(16), 0)
+            self.free.append(slot)
+        self.evicted += count
+        # Persist the freed rows before they're reused, so the index on disk never points a key at another text's vector
+        self.save()
+
+    def grow(self, rows: int):
+        np = self.np
+        if rows <= len(self.index):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        vectors_path = os.path.join(self.directory, "vectors.f32")
+        if self.vectors is not None:
+            self.vectors.flush()
+            del self.vectors
+        with open(vectors_path, "ab") as f:
+            f.truncate(rows * self.dimension * 4)
+        self.free.extend(range(rows - 1, len(self.index) - 1, -1))
+        self.index = np.concatenate([self.index, np.zeros(rows - len(self.index), dtype=self.INDEX_DTYPE)])
+        self.vectors = np.memmap(vectors_path, dtype=np.float32, mode="r+", shape=(rows, self.dimension))
+
+    def save(self):
+        """Flush the vectors and rewrite the index; vectors for new keys are flushed before the index points at them."""
+        self.last_save = time.monotonic()
+        if self.vectors is None:
+            return
+        self.vectors.flush()
+        index_path = os.path.join(self.directory, "index.bin")
+        self.index.tofile(index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+        with open(os.path.join(self.directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({ "model": self.model, "dimension": self.dimension, "rows": len(self.index), "tick": self.tick }, f)
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        return {
+            "path": self.directory,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups > 0 else None,
+            "evicted": self.evicted,
+            "entries": len(self.slots),
+        }
+
+class CachedEmbedder:
+    """Embeds only the texts missing from the cache (each distinct text once) and caches the results."""
+
+    def __init__(self, embedder, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.cache = cache
+
+    def embed(self, texts: list):
+        keys = [self.cache.key(text) for text in texts]
+        vectors = self.cache.get_many(keys)
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(keys[i], i)
+        if missing:
+            embedded = self.embedder.embed([texts[i] for i in missing.values()])
+            self.cache.put_many(list(missing), embedded)
+            by_key = dict(zip(missing, embedded))
+            vectors = [vector if vector is not None else by_key[key] for key, vector in zip(keys, vectors)]
+        return vectors
+
+class AzureSearchStore:
+    """Writes chunks to an Azure AI Search index, creating it on first use, with the field names MLIndex expects for acs."""
+
+    FIELD_MAPPING = {
+        "content": "content",
+        "url": "url",
+        "filename": "filepath",
+        "title": "title",
+        "metadata": "meta_json_string",
+        "embedding": "contentVector",
+    }
+    API_VERSION = "2023-11-01"
+    SEMANTIC_CONFIGURATION_NAME = "azureml-default"
+
+    # (name, kind, attributes) of each index field, as build_index created them; kind is "simple", "searchable"
+    # or "vector", and the vector field also gets the embedding dimension
+    FIELDS = [
+        ("id", "simple", { "key": True }),
+        ("content", "searchable", {}),
+        ("filepath", "simple", { "filterable": True }),
+        ("title", "searchable", {}),
+        ("url", "simple", {}),
+        ("meta_json_string", "simple", {}),
+        ("contentVector", "vector", { "vector_search_profile_name": "default" }),
+    ]
+
+    def __init__(self, endpoint: str, credential, index_name: str, batch_size: int = 1000):
+        from azure.search.documents import SearchClient
+        from azure.search.documents.indexes import SearchIndexClient
+
+        self.endpoint = endpoint
+        self.index_name = index_name
+        self.batch_size = batch_size
+        self.index_client = SearchIndexClient(endpoint, credential)
+        self.search_client = SearchClient(endpoint, index_name, credential)
+        self.has_index = None
+
+    def ensure_index(self, dimension: int):
+        from azure.core.exceptions import ResourceNotFoundError
+        from azure.search.documents.indexes.models import (
+            HnswAlgorithmConfiguration, SearchableField, SearchField, SearchFieldDataType, SearchIndex, SemanticConfiguration,
+            SemanticField, SemanticPrioritizedFields, SemanticSearch, SimpleField, VectorSearch, VectorSearchProfile)
+
+        if self.has_index:
+            return
+        try:
+            self.index_client.get_index(self.index_name)
+        except ResourceNotFoundError:
+            print(f"Creating search index: {self.index_name}")
+            def create_field(name, kind, attributes):
+                if kind == "vector":
+                    return SearchField(name=name, type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+                        searchable=True, vector_search_dimensions=dimension, **attributes)
+                field_class = SearchableField if kind == "searchable" else SimpleField
+                return field_class(name=name, type=SearchFieldDataType.String, **attributes)
+
+            self.index_client.create_index(SearchIndex(
+                name=self.index_name,
+                fields=[create_field(*field) for field in self.FIELDS],
+                vector_search=VectorSearch(
+                    algorithms=[HnswAlgorithmConfiguration(name="default-hnsw")],
+                    profiles=[VectorSearchProfile(name="default", algorithm_configuration_name="default-hnsw")],
+                ),
+                semantic_search=SemanticSearch(configurations=[SemanticConfiguration(
+                    name=self.SEMANTIC_CONFIGURATION_NAME,
+                    prioritized_fields=SemanticPrioritizedFields(title_field=SemanticField(field_name="title"), content_fields=[SemanticField(field_name="content")]),
+                )]),
+            ))
+        self.has_index = True
+
+    def upsert(self, chunks: list, vectors: list):
+        if not chunks:
+            return
+        self.ensure_index(len(vectors[0]))
+        documents = [dict(chunk, contentVector=vector, meta_json_string=json.dumps({ "source": { "filename": chunk["filepath"], "title": chunk["title"], "url": chunk["url"] } }))
+            for chunk, vector in zip(chunks, vectors)]
+        for start in range(0, len(documents), self.batch_size):
+            self.search_client.merge_or_upload_documents(documents[start:start + self.batch_size])
+
+    def delete(self, ids: list):
+        for start in range(0, len(ids), self.batch_size):
+            self.search_client.delete_documents([{ "id": id } for id in ids[start:start + self.batch_size]])
+
+    def save(self):
+        # Documents are written by each call; nothing is buffered
+        pass
+
+class LocalVectorStore:
+    """Vector store in a local directory, for developing and load-testing retrieval without a search service.
+
+    Vectors live in a memory-mapped float32 matrix (vectors.f32) and chunk metadata in SQLite (chunks.db), keyed on
+    chunk ID with the matrix row of its vector. Rows of deleted chunks are reused. Search is an exact dot product
+    over the live rows, or, once build_ivf has run, an inverted-file (IVF) search of the nprobe nearest lists.
+    Rows upserted after build_ivf are assigned to their nearest existing centroid."""
+
+    SEARCH_BLOCK_ROWS = 65536
+
+    def __init__(self, directory: str):
+        import numpy as np
+        import sqlite3
+        self.np = np
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self.dimension = None
+        self.vectors = None
+        self.live = np.zeros(0, dtype=bool)
+        self.ivf = None
+        meta_path = os.path.join(directory, "store.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dimension = meta["dimension"]
+            self.vectors = np.memmap(os.path.join(directory, "vectors.f32"), dtype=np.float32, mode="r+", shape=(meta["rows"], self.dimension))
+            self.live = np.zeros(meta["rows"], dtype=bool)
+            if meta.get("ivf_lists"):
+                self.ivf = {
+                    "centroids": np.fromfile(os.path.join(directory, "ivf_centroids.f32"), dtype=np.float32).reshape(meta["ivf_lists"], self.dimension),
+                    "assignment": np.fromfile(os.path.join(directory, "ivf_assignment.i32"), dtype=np.int32),
+                }
+
+        self.db = sqlite3.connect(os.path.join(directory, "chunks.db"))
+        self.db.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, row INTEGER, filepath TEXT, title TEXT, url TEXT, content TEXT)")
+        rows = np.array([row for row, in self.db.execute("SELECT row FROM chunks")], dtype=np.int64)
+        self.live[rows] = True
+        self.free = sorted(set(range(len(self.live))) - set(rows.tolist()), reverse=True)
+
+    def grow(self, rows: int):
+        np = self.np
+        path = os.path.join(self.directory, "vectors.f32")
+        if self.vectors is not None:
+            self.vectors.flush()
+            del self.vectors
+        with open(path, "ab") as f:
+            f.truncate(rows * self.dimension * 4)
+        self.free.extend(range(rows - 1, len(self.live) - 1, -1))
+        if self.ivf is not None:
+            self.ivf["assignment"] = np.concatenate([self.ivf["assignment"], np.full(rows - len(self.live), -1, dtype=np.int32)])
+        self.live = np.concatenate([self.live, np.zeros(rows - len(self.live), dtype=bool)])
+        self.vectors = np.memmap(path, dtype=np.float32, mode="r+", shape=(rows, self.dimension))
+
+    def upsert(self, chunks: list, vectors: list):
+        np = self.np
+        if not chunks:
+            return
+        if self.dimension is None:
+            self.dimension = len(vectors[0])
+        existing = {}
+        for start in range(0, len(chunks), 500):
+            ids = [chunk["id"] for chunk in chunks[start:start + 500]]
+            existing.update(self.db.execute(f"SELECT id, row FROM chunks WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall())
+        needed = sum(1 for chunk in chunks if chunk["id"] not in existing) - len(self.free)
+        if needed > 0:
+            self.grow(max(len(self.live) * 2, len(self.live) + needed, 1024))
+
+        records = []
+        for chunk, vector in zip(chunks, vectors):
+            row = existing.get(chunk["id"])
+            if row is None:
+                row = existing[chunk["id"]] = self.free.pop()
+            self.vectors[row] = vector
+            self.live[row] = True
+            records.append((chunk["id"], row, chunk.get("filepath"), chunk.get("title"), chunk.get("url"), chunk["content"]))
+        self.db.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?)", records)
+
+        if self.ivf is not None:
+            # New and changed rows move to their nearest centroid, so IVF search keeps finding them
+            rows = np.array([record[1] for record in records], dtype=np.int64)
+            self.assign_ivf(rows, np.asarray(vectors, dtype=np.float32))
+
+    def delete(self, ids: list):
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            rows = [row for row, in self.db.execute(f"SELECT row FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch)]
+            self.db.execute(f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch)
+            self.live[rows] = False
+            self.free.extend(rows)
+            if self.ivf is not None:
+                self.ivf["assignment"][rows] = -1
+                self.ivf["changed"] = True
+
+    def save(self):
+        self.db.commit()
+        if self.vectors is None:
+            return
+        self.vectors.flush()
+        if self.ivf is not None and self.ivf.get("changed"):
+            self.ivf["assignment"].tofile(os.path.join(self.directory, "ivf_assignment.i32"))
+            self.ivf["changed"] = False
+        with open(os.path.join(self.directory, "store.json"), "w", encoding="utf-8") as f:
+            json.dump({ "dimension": self.dimension, "rows": len(self.live), "ivf_lists": len(self.ivf["centroids"]) if self.ivf is not None else None }, f)
+
+    def close(self):
+        self.save()
+        self.db.close()
+
+    def count(self):
+        return int(self.live.sum())
+
+    def build_ivf(self, lists: int, iterations: int = 10, sample_per_list: int = 64, seed: int = 0):
+        """Cluster the live vectors into `lists` lists with spherical k-means on a sample, then assign every live row."""
+        np = self.np
+        live_rows = np.flatnonzero(self.live)
+        lists = min(lists, len(live_rows))
+        if lists == 0:
+            self.ivf = None
+            return
+        rng = np.random.default_rng(seed)
+        sample = self.vectors[np.sort(rng.choice(live_rows, min(len(live_rows), lists * sample_per_list), replace=False))]
+        sample = sample / np.maximum(np.linalg.norm(sample, axis=1, keepdims=True), 1e-12)
+        centroids = sample[rng.choice(len(sample), lists, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = np.bincount(assignment, minlength=lists) == 0
+            # Lists that lost every point restart from a random sample point
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        centroids = centroids.astype(np.float32)
+
+        self.ivf = { "centroids": centroids, "assignment": np.full(len(self.live), -1, dtype=np.int32) }
+        for start in range(0, len(live_rows), self.SEARCH_BLOCK_ROWS):
+            rows = live_rows[start:start + self.SEARCH_BLOCK_ROWS]
+            self.assign_ivf(rows, self.vectors[rows])
+        centroids.tofile(os.path.join(self.directory, "ivf_centroids.f32"))
+        self.save()
+
+    def assign_ivf(self, rows, vectors):
+        self.ivf["assignment"][rows] = self.np.argmax(vectors @ self.ivf["centroids"].T, axis=1)
+        self.ivf["changed"] = True
+        self.ivf.pop("lists", None)
+
+    def get_ivf_lists(self):
+        """Return (rows, offsets): the live rows grouped by list, and where each list starts; rebuilt after mutations."""
+        np = self.np
+        if "lists" not in self.ivf:
+            assignment = self.ivf["assignment"]
+            rows = np.flatnonzero(assignment >= 0)
+            rows = rows[np.argsort(assignment[rows], kind="stable")]
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment[rows], minlength=len(self.ivf["centroids"])))]).astype(np.int64)
+            self.ivf["lists"] = (rows, offsets)
+        return self.ivf["lists"]
+
+    def search(self, vector, top: int = 5, nprobe: int = None):
+        """Return (row, score) pairs of the `top` highest dot products; with an IVF index and nprobe, only the nprobe
+        lists whose centroids score highest are scanned."""
+        np = self.np
+        if self.vectors is None:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        if nprobe is not None and self.ivf is not None:
+            probes = np.argsort(-(self.ivf["centroids"] @ query))[:nprobe]
+            list_rows, offsets = self.get_ivf_lists()
+            rows = np.concatenate([list_rows[offsets[l]:offsets[l + 1]] for l in probes])
+            rows = np.sort(rows[self.live[rows]])
+            scores = self.vectors[rows] @ query
+        else:
+            rows = np.flatnonzero(self.live)
+            scores = np.concatenate([self.vectors[start:start + self.SEARCH_BLOCK_ROWS] @ query
+                for start in range(0, len(self.live), self.SEARCH_BLOCK_ROWS)])[rows] if len(rows) else np.zeros(0, dtype=np.float32)
+        if len(rows) > top:
+            best = np.argpartition(-scores, top - 1)[:top]
+        else:
+            best = np.arange(len(rows))
+        best = best[np.argsort(-scores[best])]
+        return [(int(rows[i]), float(scores[i])) for i in best]
+
+    def get_chunks(self, rows: list):
+        by_row = {}
+        for start in range(0, len(rows), 500):
+            batch = rows[start:start + 500]
+            for id, row, filepath, title, url, content in self.db.execute(f"SELECT * FROM chunks WHERE row IN ({','.join('?' * len(batch))})", batch):
+                by_row[row] = { "id": id, "filepath": filepath, "title": title, "url": url, "content": content }
+        return [by_row[row] for row in rows]
+
+def query_local_index(store: LocalVectorStore, embedder, query: str, top: int = 5, nprobe: int = None):
+    start = time.perf_counter()
+    vector = embedder.embed([query])[0]
+    embedded = time.perf_counter()
+    hits = store.search(vector, top, nprobe)
+    searched = time.perf_counter()
+    chunks = store.get_chunks([row for row, _ in hits])
+    return {
+        "query": query,
+        "search": "ivf" if nprobe is not None and store.ivf is not None else "exact",
+        "embedding_ms": round((embedded - start) * 1000, 3),
+        "search_ms": round((searched - embedded) * 1000, 3),
+        "results": [dict(chunk, score=round(score, 6)) for chunk, (_, score) in zip(chunks, hits)],
+    }
+
+def benchmark_local_index(store: LocalVectorStore, queries: int = 200, top: int = 10, nprobe: int = 8, noise: float = 0.05, seed: int = 0):
+    """Measure exact and IVF search latency, and IVF recall@top against exact search, using stored vectors plus
+    gaussian noise as queries, so no embedding endpoint is needed."""
+    np = store.np
+    rng = np.random.default_rng(seed)
+    live_rows = np.flatnonzero(store.live)
+    if len(live_rows) == 0:
+        raise Exception("The local index is empty; nothing to benchmark")
+    sample = store.vectors[np.sort(rng.choice(live_rows, min(queries, len(live_rows)), replace=False))]
+    scale = noise * np.linalg.norm(sample, axis=1, keepdims=True) / np.sqrt(store.dimension)
+    sample = (sample + rng.normal(size=sample.shape) * scale).astype(np.float32)
+
+    def percentiles(latencies):
+        latencies = np.array(latencies) * 1000
+        return { "p50": round(float(np.percentile(latencies, 50)), 3), "p95": round(float(np.percentile(latencies, 95)), 3), "p99": round(float(np.percentile(latencies, 99)), 3) }
+
+    exact_latencies, exact_results = [], []
+    for query in sample:
+        start = time.perf_counter()
+        exact_results.append({ row for row, _ in store.search(query, top) })
+        exact_latencies.append(time.perf_counter() - start)
+    result = { "rows": len(live_rows), "dimension": store.dimension, "queries": len(sample), "top": top, "exact_latency_ms": percentiles(exact_latencies) }
+
+    if store.ivf is not None:
+        ivf_latencies, recalls = [], []
+        for query, expected in zip(sample, exact_results):
+            start = time.perf_counter()
+            found = { row for row, _ in store.search(query, top, nprobe) }
+            ivf_latencies.append(time.perf_counter() - start)
+            recalls.append(len(found & expected) / len(expected))
+        result.update({ "ivf_lists": len(store.ivf["centroids"]), "nprobe": nprobe, "ivf_latency_ms": percentiles(ivf_latencies), f"recall_at_{top}": round(float(np.mean(recalls)), 4) })
+    return result
+
+def update_index(
+    data_files_path: str,
+    data_files_glob_pattern: str,
+    manifest: IndexManifest,
+    embedder,
+    store,
+    chunk_size: int,
+    chunk_overlap: int,
+    external_source_url: str = None,
+    batch_chunks: int = 1024,
+    save_interval: float = 30,
+    parse_workers: int = 1):
+    """Bring the vector store up to date with the data files: chunk and embed only added or changed files, and
+    delete the chunks of changed and removed files that are no longer produced. Returns counts of what was done.
+
+    Files are read and chunked on `parse_workers` processes while the chunks already produced are embedded."""
+    start = time.perf_counter()
+    relative_paths = iter_data_files(data_files_path, data_files_glob_pattern, [os.path.dirname(os.path.abspath(manifest.path))])
+    changed, removed, skipped = manifest.plan(data_files_path, relative_paths)
+
+    stats = {
+        "files": len(changed) + len(skipped),
+        "files_added": sum(1 for relative_path, _ in changed if not manifest.chunk_ids(relative_path)),
+        "files_changed": sum(1 for relative_path, _ in changed if manifest.chunk_ids(relative_path)),
+        "files_removed": len(removed),
+        "files_skipped": len(skipped),
+        "chunks_embedded": 0,
+        "chunks_deleted": 0,
+        "chunks_skipped": sum(len(manifest.chunk_ids(relative_path)) for relative_path in skipped),
+    }
+    print(f"Files: {stats['files']} ({stats['files_added']} added, {stats['files_changed']} changed, {stats['files_removed']} removed, {stats['files_skipped']} unchanged)")
+
+    last_save = time.monotonic()
+
+    def flush(pending):
+        nonlocal last_save
+        chunks = [chunk for _, _, file_chunks in pending for chunk in file_chunks]
+        if chunks:
+            vectors = embedder.embed([chunk["content"] for chunk in chunks])
+            store.upsert(chunks, vectors)
+            manifest.dimension = len(vectors[0])
+            stats["chunks_embedded"] += len(chunks)
+        for relative_path, entry, file_chunks in pending:
+            chunk_ids = [chunk["id"] for chunk in file_chunks]
+            stale = sorted(set(manifest.chunk_ids(relative_path)) - set(chunk_ids))
+            store.delete(stale)
+            stats["chunks_deleted"] += len(stale)
+            manifest.set(relative_path, entry, chunk_ids)
+            # The CLI shows these lines from stderr as per-file progress
+            print(f"Processed source: {relative_path}", file=sys.stderr)
+        if time.monotonic() - last_save >= save_interval:
+            # The store is saved first, so the manifest never lists chunks the store could lose
+            store.save()
+            manifest.save()
+            last_save = time.monotonic()
+
+    parse_start = time.perf_counter()
+    parse_bytes, parse_wait = 0, 0
+    pending, pending_chunks = [], 0
+    chunked_files = iter_chunked_files(data_files_path, changed, chunk_size, chunk_overlap, external_source_url, parse_workers)
+    while True:
+        wait_start = time.perf_counter()
+        chunked_file = next(chunked_files, None)
+        parse_wait += time.perf_counter() - wait_start
+        if chunked_file is None:
+            break
+        relative_path, entry, sha256, size, file_chunks = chunked_file
+        parse_bytes += size
+        pending.append((relative_path, dict(entry, sha256=sha256), file_chunks))
+        pending_chunks += len(file_chunks)
+        if pending_chunks >= batch_chunks:
+            flush(pending)
+            pending, pending_chunks = [], 0
+    parse_sec = time.perf_counter() - parse_start
+    flush(pending)
+    stats["parse"] = {
+        "workers": parse_workers,
+        "mb": round(parse_bytes / 1024 / 1024, 3),
+        "sec": round(parse_sec, 3),
+        "mb_per_sec": round(parse_bytes / 1024 / 1024 / parse_sec, 2) if parse_sec > 0 else None,
+        # Time the pipeline waited on parsing rather than on embedding
+        "wait_sec": round(parse_wait, 3),
+    }
+
+    for relative_path in removed + list(manifest.stale):
+        ids = manifest.chunk_ids(relative_path)
+        store.delete(ids)
+        stats["chunks_deleted"] += len(ids)
+        manifest.remove(relative_path)
+    store.save()
+    manifest.save()
+
+    elapsed = time.perf_counter() - start
+    stats["elapsed_sec"] = round(elapsed, 3)
+    stats["chunks_per_sec"] = round(stats["chunks_embedded"] / elapsed, 2) if elapsed > 0 else None
+    print(f"Chunks: {stats['chunks_embedded']} embedded, {stats['chunks_deleted']} deleted, {stats['chunks_skipped']} skipped")
+    print(f"Parsed: {stats['parse']['mb']} MB at {stats['parse']['mb_per_sec']} MB/s on {parse_workers} worker(s), {stats['parse']['wait_sec']}s waiting on parsing")
+    print(f"Throughput: {stats['chunks_per_sec']} chunks/sec ({stats['elapsed_sec']}s)")
+    return stats
+
+def write_ml_index(index_dir: str, index_name: str, openai_connection, search_connection, embedding_model_deployment: str, embedding_model_name: str, dimension: int):
+    """Write the MLIndex file describing the acs index and its embeddings model; JSON is valid YAML, so no yaml dependency is needed."""
+    ml_index = {
+        "embeddings": {
+            "kind": "open_ai",
+            "api_type": "azure",
+            "api_base": openai_connection.target,
+            "api_version": getattr(openai_connection, "api_version", None),
+            "connection_type": "workspace_connection",
+            "connection": { "id": openai_connection.id },
+            "deployment": embedding_model_deployment,
+            "model": embedding_model_name,
+            "dimension": dimension,
+            "schema_version": "2",
+        },
+        "index": {
+            "kind": "acs",
+            "engine": "azure-sdk",
+            "index": index_name,
+            "endpoint": search_connection.target,
+            "api_version": AzureSearchStore.API_VERSION,
+            "connection_type": "workspace_connection",
+            "connection": { "id": search_connection.id },
+            "field_mapping": AzureSearchStore.FIELD_MAPPING,
+            "semantic_configuration_name": AzureSearchStore.SEMANTIC_CONFIGURATION_NAME,
+        },
+    }
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, "MLIndex"), "w", encoding="utf-8") as f:
+        json.dump(ml_index, f, indent=2)
+
+def get_ai_client(subscription_id: str, resource_group_name: str, project_name: str):
+    from azure.identity import DefaultAzureCredential
+    from azure.ai.resources.client import AIClient
+
+    return AIClient(
+        credential=DefaultAzureCredential(),
+        subscription_id=subscription_id,
+        resource_group_name=resource_group_name,
+        project_name=project_name,
+        user_agent="ai-cli 0.0.1"
+    )
+
+def get_search_credential(search_connection):
+    """Return the search connection's API key credential, or, for connections using Microsoft Entra ID (AAD), a token credential."""
+    key = getattr(search_connection.credentials, "key", None)
+    if key:
+        from azure.core.credentials import AzureKeyCredential
+        return AzureKeyCredential(key)
+
+    from azure.identity import DefaultAzureCredential
+    return DefaultAzureCredential()
+
+def get_index_dir(index_dir: str, index_name: str):
+    return index_dir if index_dir is not None else os.path.join(".ai", "index", index_name)
+
+def open_local_index(index_dir: str):
+    if not os.path.exists(os.path.join(index_dir, "store.json")):
+        raise Exception(f"No local index found in {index_dir}; build one with --vector-store local")
+    return LocalVectorStore(index_dir)
+
+def search_index_update(
+    subscription_id : str,
+    resource_group_name : str,
+    project_name : str,
+    index_name : str,
+    embedding_model_deployment : str,
+    embedding_model_name : str,
+    data_files : str,
+    external_source_url : str,
+    index_dir : str = None,
+    chunk_size : int = 1024,
+    chunk_overlap : int = 0,
+    full : bool = False,
+    embedding_cache : str = None,
+    embedding_cache_max_size : float = 1024,
+    vector_store : str = "azure_cognitive_search",
+    ivf_lists : int = None,
+    embedding_options : dict = None,
+    parse_workers : int = 1):
+
+    embedding_options = embedding_options or {}
+    if embedding_options.get("endpoint") is None:
+        client = get_ai_client(subscription_id, resource_group_name, project_name)
+        openaiConnection = client.get_default_aoai_connection()
+        # This sets environment variables in openai 1.x fashion, which the embedder's AzureOpenAI client picks up.
+        openaiConnection._set_current_environment_new()
+
+    data_files_path, data_files_glob_pattern = split_data_files(data_files)
     print(f"Data files path: {data_files_path}")
     print(f"Data files glob pattern: {data_files_glob_pattern}")
 
-    from azure.ai.resources.operations._index_data_source import LocalSource, ACSOutputConfig
-    from azure.ai.generative.index import build_index
-
-    index = build_index(
-        output_index_name=index_name,
-        vector_store="azure_cognitive_search",
-        embeddings_model = f"azure_open_ai://deployment/{embedding_model_deployment}/model/{embedding_model_name}",
-        data_source_url=external_source_url,
-        index_input_config=LocalSource(input_data=f"{data_files_path}"),
-        input_glob=f"{data_files_glob_pattern}",
-        acs_config=ACSOutputConfig(
-            acs_index_name=index_name,
-        ),
-    )
+    index_dir = get_index_dir(index_dir, index_name)
+    print(f"Index directory: {index_dir}")
 
-    return client.indexes.create_or_update(index)
+    config = {
+        "vector_store": vector_store,
+        "index_name": index_name,
+        "embedding_model": f"azure_open_ai://deployment/{embedding_model_deployment}/model/{embedding_model_name}",
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "external_source_url": external_source_url,
+    }
+    manifest = IndexManifest(os.path.join(index_dir, "manifest.json"), config, reset=full)
+
+    endpoint_embedder = AzureOpenAIEmbedder(embedding_model_deployment, **embedding_options)
+    embedder = endpoint_embedder
+    cache = None
+    if embedding_cache is not None:
+        cache = EmbeddingCache(embedding_cache, config["embedding_model"], embedding_cache_max_size)
+        embedder = CachedEmbedder(endpoint_embedder, cache)
+    if vector_store == "local":
+        store = LocalVectorStore(index_dir)
+    else:
+        searchConnection = client.connections.get("AzureAISearch")
+        store = AzureSearchStore(searchConnection.target, get_search_credential(searchConnection), index_name)
+    try:
+        stats = update_index(data_files_path, data_files_glob_pattern, manifest, embedder, store, chunk_size, chunk_overlap, external_source_url, parse_workers=parse_workers)
+        if vector_store == "local" and ivf_lists is not None:
+            start = time.perf_counter()
+            store.build_ivf(ivf_lists)
+            print(f"IVF index: {ivf_lists} lists over {store.count()} chunks in {time.perf_counter() - start:.2f}s")
+    finally:
+        endpoint_embedder.close()
+        if cache is not None:
+            cache.save()
+        if vector_store == "local":
+            store.close()
+    stats["embedding"] = endpoint_embedder.summary()
+    print(f"Embedding: {stats['embedding']['requests']} requests, {stats['embedding']['retries']} throttled retries, {stats['embedding']['chunks_per_sec']} chunks/sec")
+    if cache is not None:
+        stats["embedding_cache"] = cache.summary()
+        print(f"Embedding cache: {cache.hits} hits, {cache.misses} misses, {cache.evicted} evicted")
+
+    if vector_store == "local":
+        # A local index is for offline development; there's nothing to register with the project
+        return { "name": index_name, "path": index_dir, "vector_store": "local", "chunks": store.count(), "ivf_lists": ivf_lists }, stats
+
+    from azure.ai.resources.entities import Index
+
+    # Only the MLIndex is uploaded with the asset; the manifest of indexed files stays private to this machine
+    ml_index_dir = os.path.join(index_dir, "mlindex")
+    write_ml_index(ml_index_dir, index_name, openaiConnection, searchConnection, embedding_model_deployment, embedding_model_name, manifest.dimension)
+
+    index = Index(
+        name=index_name,
+        path=ml_index_dir,
+        properties={
+            "azureml.mlIndexAssetKind": "acs",
+            "azureml.mlIndexAsset": "true",
+            "azureml.mlIndexAssetSource": "Local Data",
+        },
+    )
+    return client.indexes.create_or_update(index), stats
 
 def main():
     """Parse command line arguments and build MLIndex."""
     parser = argparse.ArgumentParser(description="Build MLIndex")
-    parser.add_argument("--subscription", required=True, help="Azure subscription ID")
+    parser.add_argument("--subscription", required=False, help="Azure subscription ID (required unless --embedding-endpoint is given with a local vector store).")
     parser.add_argument("--group", required=False, help="Azure resource group name")
-    parser.add_argument("--project-name", required=True, help="Azure AI project project name.")
+    parser.add_argument("--project-name", required=False, help="Azure AI project project name (required with --subscription).")
     parser.add_argument("--index-name", required=True, help="Name of the index to create.")
     parser.add_argument("--embedding-model-deployment", required=True, help="Name of the embedding model deployment.")
     parser.add_argument("--embedding-model-name", required=True, help="Name of the embedding model.")
-    parser.add_argument("--data-files", required=True, help="Path to the data files.")
+    parser.add_argument("--data-files", required=False, help="Path to the data files (required unless --query or --benchmark-queries is given).")
     parser.add_argument("--external-source-url", required=False, help="URL to the external data source.")
+    parser.add_argument("--index-dir", required=False, help="Directory holding the manifest of indexed files, and the MLIndex in its mlindex subdirectory (default: .ai/index/<index-name>).")
+    parser.add_argument("--chunk-size", type=int, default=1024, help="Maximum tokens per chunk.")
+    parser.add_argument("--chunk-overlap", type=int, default=0, help="Tokens shared between consecutive chunks of a file.")
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and re-chunk and re-embed every file.")
+    parser.add_argument("--embedding-cache", default=os.path.join(".ai", "cache", "embeddings"), help="Directory of the embedding cache shared by all index builds.")
+    parser.add_argument("--no-embedding-cache", action="store_true", help="Embed every chunk, without reading or writing the embedding cache.")
+    parser.add_argument("--embedding-cache-max-size", type=float, default=1024, help="Maximum size of the embedding cache per model in MB; least recently used entries are evicted past it.")
+    parser.add_argument("--embedding-endpoint", required=False, help="Azure OpenAI compatible endpoint to embed with instead of the project's default connection (e.g. a local fake server); requires --vector-store local.")
+    parser.add_argument("--embedding-key", required=False, help="API key for --embedding-endpoint.")
+    parser.add_argument("--embedding-batch-tokens", type=int, default=8000, help="Maximum tokens packed into one embedding request.")
+    parser.add_argument("--embedding-batch-size", type=int, default=2048, help="Maximum chunks packed into one embedding request.")
+    parser.add_argument("--embedding-concurrency", type=int, default=4, help="Maximum embedding requests in flight at once.")
+    parser.add_argument("--embedding-tpm", type=int, required=False, help="Tokens per minute to stay within across all embedding requests.")
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count() or 1, help="Processes that read and chunk data files while chunks are embedded (default: one per CPU).")
+    parser.add_argument("--vector-store", choices=["azure_cognitive_search", "local"], default="azure_cognitive_search", help="Where to store the chunks: an Azure AI Search index, or memory-mapped files in --index-dir.")
+    parser.add_argument("--ivf-lists", type=int, required=False, help="With --vector-store local, also build an IVF approximate index with this many lists.")
+    parser.add_argument("--query", required=False, help="Search the local index for this text instead of updating it.")
+    parser.add_argument("--top", type=int, default=5, help="Number of chunks --query returns, or the k of recall@k for --benchmark-queries.")
+    parser.add_argument("--nprobe", type=int, required=False, help="Search the IVF index, scanning this many lists (default: exact search for --query, 8 for --benchmark-queries).")
+    parser.add_argument("--benchmark-queries", type=int, required=False, help="Benchmark the local index with this many queries: exact and IVF latency, and IVF recall against exact search.")
 
     args = parser.parse_args()
+    if args.chunk_size <= 0:
+        parser.error("--chunk-size must be positive")
+    if args.chunk_overlap < 0 or args.chunk_overlap >= args.chunk_size:
+        parser.error("--chunk-overlap must be at least 0 and less than --chunk-size")
+    if args.query is not None and args.benchmark_queries is not None:
+        parser.error("--query and --benchmark-queries cannot be used together")
+    if args.query is None and args.benchmark_queries is None and args.data_files is None:
+        parser.error("--data-files is required to update the index")
+    if args.ivf_lists is not None and (args.ivf_lists <= 0 or args.vector_store != "local"):
+        parser.error("--ivf-lists must be positive and requires --vector-store local")
+    if args.embedding_endpoint is not None and args.vector_store != "local" and args.query is None:
+        parser.error("--embedding-endpoint requires --vector-store local")
+    if args.embedding_endpoint is None and args.benchmark_queries is None and (args.subscription is None or args.project_name is None):
+        parser.error("--subscription and --project-name are required unless --embedding-endpoint is given")
+    if min(args.embedding_batch_tokens, args.embedding_batch_size, args.embedding_concurrency, args.parse_workers) <= 0 or (args.embedding_tpm is not None and args.embedding_tpm <= 0):
+        parser.error("--embedding-batch-tokens, --embedding-batch-size, --embedding-concurrency, --embedding-tpm and --parse-workers must be positive")
+
+    embedding_options = {
+        "endpoint": args.embedding_endpoint,
+        "key": args.embedding_key,
+        "batch_tokens": args.embedding_batch_tokens,
+        "batch_size": args.embedding_batch_size,
+        "concurrency": args.embedding_concurrency,
+        "tokens_per_minute": args.embedding_tpm,
+    }
+
+    if args.benchmark_queries is not None:
+        store = open_local_index(get_index_dir(args.index_dir, args.index_name))
+        result = benchmark_local_index(store, args.benchmark_queries, args.top, args.nprobe if args.nprobe is not None else 8)
+        store.close()
+        print("---")
+        print(json.dumps(result, indent=2))
+        return
+
+    if args.query is not None:
+        store = open_local_index(get_index_dir(args.index_dir, args.index_name))
+        if args.embedding_endpoint is None:
+            get_ai_client(args.subscription, args.group, args.project_name).get_default_aoai_connection()._set_current_environment_new()
+        embedder = AzureOpenAIEmbedder(args.embedding_model_deployment, **embedding_options)
+        result = query_local_index(store, embedder, args.query, args.top, args.nprobe)
+        embedder.close()
+        store.close()
+        print("---")
+        print(json.dumps(result, indent=2))
+        return
 
     subscription_id = args.subscription
     resource_group_name = args.group
@@ -124,9 +1363,12 @@ def main():
     embedding_model_name = args.embedding_model_name
     data_files = args.data_files
     external_source_url = args.external_source_url
-    
-    index = search_index_update(subscription_id, resource_group_name, project_name, index_name, embedding_model_deployment, embedding_model_name, data_files, external_source_url)
-    formatted = json.dumps({"index": index}, indent=2, cls=IndexEncoder)
+
+    index, stats = search_index_update(subscription_id, resource_group_name, project_name, index_name, embedding_model_deployment, embedding_model_name, data_files, external_source_url,
+        args.index_dir, args.chunk_size, args.chunk_overlap, args.full,
+        None if args.no_embedding_cache else args.embedding_cache, args.embedding_cache_max_size,
+        args.vector_store, args.ivf_lists, embedding_options, args.parse_workers)
+    formatted = json.dumps({"index": index, "update": stats}, indent=2, cls=IndexEncoder)
 
     print("---")
     print(formatted)
@@ -141,4 +1383,3 @@ if __name__ == "__main__":
         print("EXCEPTION: " + str(sys.exc_info()[0]), file=sys.stderr)
         print("TRACEBACK: " + "".join(traceback.format_tb(sys.exc_info()[2])), file=sys.stderr)
         sys.exit(1)
-
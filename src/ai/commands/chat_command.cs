@@ -187,7 +187,7 @@ namespace Azure.AI.Details.Common.CLI
             var output = PythonRunner.RunEmbeddedPythonScript(_values, "function_call_run",
                 CliHelpers.BuildCliArgs(
                     "--function", function,
-                    "--data", dataFile),
+                    "--data", dataFile) + " --framed-events",
                 addToEnvironment: env);
             return output;
         }
@@ -9,6 +9,7 @@ using System.IO;
 using System.Linq;
 using System.Runtime.InteropServices;
 using System.Text;
+using System.Text.Json;
 using System.Threading.Tasks;
 
 namespace Azure.AI.Details.Common.CLI
@@ -182,9 +183,59 @@ namespace Azure.AI.Details.Common.CLI
                 values.AddThrowError(info[0], info[1], info.Skip(2).ToArray());
             }
 
-            return output != null
-                ? ParseOutputAndSkipLinesUntilStartsWith(output, "---").Trim('\r', '\n', ' ')
-                : string.Empty;
+            if (output == null) return string.Empty;
+
+            // Frames are only ever written to stdout, so there's no stderr text to step over
+            return TryParseFramedPayload(process.StdOutput ?? output, out var payload)
+                ? payload.Trim('\r', '\n', ' ')
+                : ParseOutputAndSkipLinesUntilStartsWith(output, "---").Trim('\r', '\n', ' ');
+        }
+
+        private static bool TryParseFramedPayload(string output, out string payload)
+        {
+            // Scripts run with --framed-events write "\x1e<length> <json>" frames. Read each frame's
+            // header and jump over its body, so neither the bodies nor any text between frames is
+            // split or scanned; only the payload frame's JSON is parsed
+            payload = string.Empty;
+            var found = false;
+
+            var position = output.IndexOf(FrameMarker);
+            while (position >= 0)
+            {
+                var next = position + 1;
+                var space = output.IndexOf(' ', next);
+                if (space > next && int.TryParse(output.AsSpan(next, space - next), out var length) && length <= output.Length - space - 1)
+                {
+                    var json = output.AsSpan(space + 1, length);
+                    if (json.StartsWith(PayloadFramePrefix) && TryGetPayloadText(json, out var text))
+                    {
+                        payload = text;
+                        found = true;
+                    }
+                    next = space + 1 + length;
+                }
+                position = output.IndexOf(FrameMarker, next);
+            }
+
+            return found;
+        }
+
+        private static bool TryGetPayloadText(ReadOnlySpan<char> json, out string text)
+        {
+            text = string.Empty;
+            try
+            {
+                using var document = JsonDocument.Parse(json.ToString());
+                var root = document.RootElement;
+                if (!root.TryGetProperty("type", out var type) || type.GetString() != "payload") return false;
+
+                text = root.TryGetProperty("text", out var value) ? value.GetString() ?? string.Empty : string.Empty;
+                return true;
+            }
+            catch (JsonException)
+            {
+                return false;
+            }
         }
 
         private static string ParseOutputAndSkipLinesUntilStartsWith(string output, string startsWith)
@@ -257,6 +308,8 @@ namespace Azure.AI.Details.Common.CLI
         }
 
         private static string? _pythonBinary;
+        private const char FrameMarker = '\u001e';
+        private const string PayloadFramePrefix = "{\"type\": \"payload\"";
     }
 
     internal class PythonScriptException : Exception
@@ -0,0 +1,72 @@
+"""Compare calls/sec of function_call.py run once per call against one long-lived --worker.
+
+    python tests/python/benchmarks/bench_function_call_worker.py --calls 50
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from conftest import expand_help_script
+
+MODULE = '''
+import {imports}
+
+def answer(question):
+    return "You asked: " + question
+'''
+
+
+def run_one_shot(script, directory, calls):
+    start = time.perf_counter()
+    for i in range(calls):
+        parameters = json.dumps({ "question": f"question {i}" })
+        subprocess.run([sys.executable, script, "--function", "bench_module:answer", "--parameters", parameters], cwd=directory, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def run_worker(script, directory, calls):
+    start = time.perf_counter()
+    worker = subprocess.Popen([sys.executable, script, "--worker"], cwd=directory, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    for i in range(calls):
+        request = { "id": i, "function": "bench_module:answer", "parameters": { "question": f"question {i}" } }
+        worker.stdin.write(json.dumps(request) + "\n")
+        worker.stdin.flush()
+        response = json.loads(worker.stdout.readline())
+        if not response["ok"]:
+            raise Exception("Worker call failed: " + response["error"])
+    worker.stdin.close()
+    worker.wait()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark one-shot function calls against worker mode")
+    parser.add_argument("--calls", type=int, default=50, help="Number of calls in each mode.")
+    parser.add_argument("--imports", default="json, asyncio, email.mime.text", help="Modules the target module imports, standing in for its cold start.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "bench_module.py"), "w") as f:
+            f.write(MODULE.format(imports=args.imports))
+
+        # Run the script the way the CLI does, with its includes expanded, from a file of its own
+        script = os.path.join(directory, "function_call.py")
+        with open(script, "w", encoding="utf-8") as f:
+            f.write(expand_help_script("function_call"))
+
+        one_shot = run_one_shot(script, directory, args.calls)
+        worker = run_worker(script, directory, args.calls)
+
+    print(f"one-shot: {args.calls / one_shot:8.1f} calls/sec ({one_shot:.2f}s for {args.calls} calls)")
+    print(f"worker:   {args.calls / worker:8.1f} calls/sec ({worker:.2f}s for {args.calls} calls)")
+    print(f"speedup:  {one_shot / worker:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Time the local evaluation engine on a synthetic run against scoring one row at a time.
+
+The row-at-a-time path computes the same metrics in a single process, embedding and comparing
+each answer and truth on its own instead of whole columns at once.
+
+    python tests/python/benchmarks/bench_local_evaluation.py --rows 100000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from conftest import load_help_script
+
+
+def create_run_results(rows, seed):
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(2000)]
+    results = []
+    for i in range(rows):
+        truth = rng.choices(vocabulary, k=rng.randint(5, 30))
+        answer = [word if rng.random() < 0.7 else rng.choice(vocabulary) for word in truth]
+        results.append({ "question": f"question {i}", "truth": " ".join(truth), "answer": " ".join(answer), "context": "" })
+    return results
+
+
+def evaluate_row_at_a_time(evaluate, run_results):
+    import numpy as np
+
+    scores = { metric: [] for metric in evaluate.LOCAL_METRICS }
+    for row in run_results:
+        answer, truth = evaluate.normalize_answer(row["answer"]), evaluate.normalize_answer(row["truth"])
+        answer_tokens, truth_tokens = answer.split(), truth.split()
+        scores["exact_match"].append(float(answer == truth))
+        scores["f1_score"].append(evaluate.token_f1(answer_tokens, truth_tokens))
+        scores["rouge_l"].append(evaluate.rouge_l(answer_tokens, truth_tokens))
+        scores["bleu"].append(evaluate.bleu(answer_tokens, truth_tokens))
+        a, t = evaluate.hashed_embeddings([answer])[0], evaluate.hashed_embeddings([truth])[0]
+        norms = np.linalg.norm(a) * np.linalg.norm(t)
+        scores["embedding_similarity"].append(float(a @ t / norms) if norms > 0 else float(not a.any() and not t.any()))
+    return { metric: sum(values) / len(values) for metric, values in scores.items() }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local evaluation engine")
+    parser.add_argument("--rows", type=int, default=100000, help="Number of synthetic rows to evaluate.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic rows.")
+    args = parser.parse_args()
+
+    evaluate = load_help_script("function_call_evaluate")
+    run_results = create_run_results(args.rows, args.seed)
+
+    start = time.perf_counter()
+    row_at_a_time = evaluate_row_at_a_time(evaluate, run_results)
+    row_at_a_time_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine = evaluate.run_local_evaluate_part(run_results, "benchmark").metrics_summary
+    engine_sec = time.perf_counter() - start
+
+    print(f"rows:           {args.rows} ({os.cpu_count()} CPUs)")
+    print(f"row at a time:  {args.rows / row_at_a_time_sec:10.0f} rows/sec ({row_at_a_time_sec:.2f}s)")
+    print(f"local engine:   {args.rows / engine_sec:10.0f} rows/sec ({engine_sec:.2f}s)")
+    for metric in evaluate.LOCAL_METRICS:
+        print(f"  {metric:22} {engine[metric]:.4f} (row at a time: {row_at_a_time[metric]:.4f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Compare peak RSS of function_call_run.py streaming JSONL results against loading the whole dataset.
+
+The full-load path reads the dataset with readlines(), echoes each answer, collects every result
+and prints them with one json.dumps, the way bulk runs worked before results were streamed.
+
+    python tests/python/benchmarks/bench_streaming_run.py --rows 200000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from conftest import expand_help_script
+
+MODULE = '''
+def answer(question):
+    return question[:64]
+'''
+
+FULL_LOAD = '''
+import json, sys
+from bench_module import answer
+with open(sys.argv[1], "r", encoding="utf-8") as f:
+    dataset = [json.loads(line) for line in f.readlines()]
+result = []
+for d in dataset:
+    text = answer(d["question"])
+    print("===it's a string===", flush=True)
+    print(text, flush=True)
+    result.append({ "question": d["question"], "truth": d["truth"], "answer": text, "context": "" })
+print("---")
+print(json.dumps(result, indent=2))
+'''
+
+
+def write_dataset(path, rows, row_size):
+    filler = ("lorem ipsum dolor sit amet " * (row_size // 27 + 1))[:row_size]
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(rows):
+            f.write(json.dumps({ "question": f"{i} {filler}", "truth": str(i) }) + "\n")
+
+
+def run(command, directory):
+    """Run command to completion, returning (seconds, peak RSS in MB) of that process alone."""
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise Exception(f"Command failed with exit code {process.returncode}: {' '.join(command)}")
+
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return time.perf_counter() - start, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark streaming bulk runs against loading the whole dataset")
+    parser.add_argument("--rows", type=int, default=200000, help="Number of rows in the synthetic dataset.")
+    parser.add_argument("--row-size", type=int, default=512, help="Approximate size of each row's question in characters.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "bench_module.py"), "w") as f:
+            f.write(MODULE)
+
+        # Run the script the way the CLI does, with its includes expanded, from a file of its own
+        script = os.path.join(directory, "function_call_run.py")
+        with open(script, "w", encoding="utf-8") as f:
+            f.write(expand_help_script("function_call_run"))
+        data = os.path.join(directory, "data.jsonl")
+        write_dataset(data, args.rows, args.row_size)
+        size_mb = os.path.getsize(data) / (1024 * 1024)
+
+        full_load = run([sys.executable, "-c", FULL_LOAD, data], directory)
+        streaming = run([sys.executable, script, "--function", "bench_module:answer", "--data", data, "--output-format", "jsonl", "--output", os.path.join(directory, "results.jsonl")], directory)
+
+    print(f"dataset:   {args.rows} rows, {size_mb:.1f} MB")
+    print(f"full load: {full_load[1]:8.1f} MB peak RSS, {full_load[0]:.2f}s")
+    print(f"streaming: {streaming[1]:8.1f} MB peak RSS, {streaming[0]:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
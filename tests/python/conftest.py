@@ -0,0 +1,66 @@
+import os
+import sys
+import types
+
+import pytest
+
+HELP_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "src", "ai", ".x", "help")
+
+
+def expand_help_includes(text):
+    """Expand help text the way the CLI does (FileHelpers.ExpandHelpIncludes): lines starting with "#" or ";"
+    are dropped, and a line "@<file>" is replaced by that help file, expanded the same way, when it exists."""
+    lines = []
+    for line in text.split("\n"):
+        if line.startswith(("#", ";")):
+            continue
+        path = os.path.join(HELP_DIR, line[1:].strip()) if line.startswith("@") else None
+        if path is not None and os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                lines.append(expand_help_includes(f.read()))
+        else:
+            lines.append(line.rstrip("\r"))
+    return "\n".join(lines).rstrip("\r\n ") + "\n"
+
+
+def expand_help_script(name):
+    """Return src/ai/.x/help/include.python.script.<name>.py as the CLI runs it, with its includes expanded."""
+    with open(os.path.join(HELP_DIR, f"include.python.script.{name}.py"), "r", encoding="utf-8") as f:
+        return expand_help_includes(f.read())
+
+
+def load_help_script(name):
+    """Import the expanded src/ai/.x/help/include.python.script.<name>.py once, as a module named after it."""
+    module_name = name.replace(".", "_")
+    if module_name not in sys.modules:
+        path = os.path.join(HELP_DIR, f"include.python.script.{name}.py")
+        module = types.ModuleType(module_name)
+        module.__file__ = path
+        sys.modules[module_name] = module
+        exec(compile(expand_help_script(name), path, "exec"), module.__dict__)
+    return sys.modules[module_name]
+
+
+@pytest.fixture
+def load_script():
+    return load_help_script
+
+
+@pytest.fixture
+def function_call():
+    return load_help_script("function_call")
+
+
+@pytest.fixture
+def function_call_run():
+    return load_help_script("function_call_run")
+
+
+@pytest.fixture
+def function_call_evaluate():
+    return load_help_script("function_call_evaluate")
+
+
+@pytest.fixture
+def ml_index_update():
+    return load_help_script("ml_index_update")
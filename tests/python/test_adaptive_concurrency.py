@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+FIELDS = ("messages", "stream", "session_state", "context", "question")
+
+
+class Throttled(Exception):
+    """Looks like an HTTP 429 from an SDK: a status code and a Retry-After header."""
+    status_code = 429
+    headers = { "retry-after": "0.01" }
+
+
+class FakeEndpoint:
+    """Answers up to `capacity` calls at once, and throttles any call beyond that."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.in_flight = 0
+        self.calls = 0
+
+    async def __call__(self, *args):
+        d = args[-1]
+        self.calls += 1
+        self.in_flight += 1
+        try:
+            if self.in_flight > self.capacity:
+                raise Throttled("Too Many Requests")
+            await asyncio.sleep(0.002)
+            return "answer " + d["question"]
+        finally:
+            self.in_flight -= 1
+
+
+def run(function_call_run, wrapper, rows, controller):
+    dataset = [(i, { "question": str(i) }) for i in range(rows)]
+
+    async def collect():
+        return [outcome async for batch in function_call_run.run_rows(wrapper, dataset, controller.max_limit, FIELDS, controller=controller) for outcome in batch]
+
+    return asyncio.run(collect())
+
+
+def test_limit_grows_until_throttled_then_halves(function_call_run):
+    controller = function_call_run.AdaptiveConcurrency(16, initial_limit=8)
+    for _ in range(8):
+        controller.on_success(0.1)
+    # About one more for every `limit` healthy completions
+    assert controller.limit == pytest.approx(9, abs=0.1)
+
+    limit = controller.limit
+    controller.on_throttled(0.5, 0)
+    assert controller.limit == limit / 2
+    assert controller.paused_until > 0
+
+    # Calls that were already in flight during the pause don't halve it again
+    controller.on_throttled(0.5, 0)
+    assert controller.limit == limit / 2
+    assert controller.throttled == 2
+
+
+def test_slow_responses_stop_growth(function_call_run):
+    controller = function_call_run.AdaptiveConcurrency(16, initial_limit=4)
+    controller.on_success(0.1)
+    limit = controller.limit
+    for _ in range(10):
+        controller.on_success(1.0)
+    assert controller.limit < limit + 1
+
+
+def test_throttled_rows_are_retried_and_the_limit_settles(function_call_run):
+    endpoint = FakeEndpoint(capacity=4)
+    controller = function_call_run.AdaptiveConcurrency(16, initial_limit=16, max_retries=20)
+    outcomes = run(function_call_run, endpoint, 100, controller)
+
+    assert [answer for _, answer, _ in outcomes] == [f"answer {i}" for i in range(100)]
+    assert not any("error" in metrics for _, _, metrics in outcomes)
+    assert controller.retries > 0
+    assert controller.retries == endpoint.calls - 100
+    assert controller.summary()["final_concurrency"] < 16
+
+
+def test_rows_fail_after_max_retries(function_call_run):
+    controller = function_call_run.AdaptiveConcurrency(2, max_retries=2)
+    outcomes = run(function_call_run, FakeEndpoint(capacity=0), 1, controller)
+
+    _, answer, metrics = outcomes[0]
+    assert answer is None
+    assert metrics["retries"] == 2
+    assert metrics["error"].startswith("Throttled")
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    path = tmp_path / "data.jsonl"
+    path.write_text("".join(json.dumps({ "question": f"q{i}", "truth": f"a q{i}" }) + "\n" for i in range(20)))
+    return str(path)
+
+
+def count_calls(script, monkeypatch):
+    calls = []
+
+    def answer(question):
+        calls.append(question)
+        return "a " + question
+
+    monkeypatch.setattr(script, "get_function", lambda module_path, function_name: answer)
+    return calls
+
+
+def test_run_resumes_a_shard_of_a_sample(function_call_run, monkeypatch, tmp_path, dataset):
+    calls = count_calls(function_call_run, monkeypatch)
+    checkpoint = str(tmp_path / "checkpoint.jsonl")
+
+    function_call_run.bulk_run("module", "answer", dataset, shard=(1, 2), sample=10, seed=3, checkpoint_path=checkpoint)
+    first = list(calls)
+    calls.clear()
+
+    # The whole sample again: the rows shard 1 ran come from the checkpoint, keyed on their dataset index
+    results = function_call_run.bulk_run("module", "answer", dataset, sample=10, seed=3, checkpoint_path=checkpoint, resume=True)
+    assert len(first) == len(calls) == 5
+    assert not set(first) & set(calls)
+    assert [result["answer"] for result in results] == ["a " + result["question"] for result in results]
+
+
+def test_evaluate_resumes_a_shard_of_a_sample(function_call_evaluate, monkeypatch, tmp_path, dataset):
+    calls = count_calls(function_call_evaluate, monkeypatch)
+    checkpoint = str(tmp_path / "checkpoint.jsonl")
+
+    def evaluate(**kwargs):
+        return function_call_evaluate.run_and_or_evaluate("s", "g", "p", "module:answer", dataset, "n", checkpoint_path=checkpoint, sample=10, seed=3, evaluator="local", **kwargs)
+
+    evaluate(shard=(1, 2))
+    first = list(calls)
+    calls.clear()
+
+    result = evaluate(resume=True)
+    assert len(first) == len(calls) == 5
+    assert not set(first) & set(calls)
+    assert result["rows"] == 10
+    assert result["metrics_summary"]["exact_match"] == 1.0
@@ -0,0 +1,108 @@
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("openai")
+
+
+class FakeEmbeddingsHandler(http.server.BaseHTTPRequestHandler):
+    """Azure OpenAI embeddings stand-in: throttles the first `throttle` requests, then embeds each
+    input as [length, request number], listing the items out of order the way the service may."""
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests.append(body["input"])
+            number = len(server.requests)
+            throttled = number <= server.throttle
+
+        if throttled:
+            self.send_json(429, { "error": { "code": "429", "message": "Rate limit is exceeded." } }, { "Retry-After": "0.05" })
+            return
+
+        data = [{ "object": "embedding", "index": i, "embedding": [float(len(text)), float(number)] } for i, text in enumerate(body["input"])]
+        self.send_json(200, { "object": "list", "data": data[::-1], "model": "fake", "usage": { "prompt_tokens": 1, "total_tokens": 1 } })
+
+    def send_json(self, status, payload, headers = {}):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_endpoint():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeEmbeddingsHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.throttle = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def create_embedder(ml_index_update, server, **kwargs):
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+    embedder = ml_index_update.AzureOpenAIEmbedder("embeddings", endpoint=endpoint, key="key", **kwargs)
+    embedder.count_tokens = lambda text: len(text)
+    return embedder
+
+
+def test_pack_batches(ml_index_update):
+    batches = ml_index_update.pack_batches([5, 3, 8, 2, 12], max_tokens=10, max_inputs=2)
+    assert sorted(sorted(batch) for batch in batches) == [[0, 1], [2, 3], [4]]
+    assert all(len(batch) <= 2 for batch in batches)
+
+
+def test_token_rate_limiter_waits_for_the_window(ml_index_update, monkeypatch):
+    limiter = ml_index_update.TokenRateLimiter(100)
+    monkeypatch.setattr(limiter, "WINDOW", 0.2)
+    start = time.monotonic()
+    limiter.acquire(60)
+    limiter.acquire(40)
+    assert time.monotonic() - start < 0.1
+    limiter.acquire(50)
+    assert time.monotonic() - start >= 0.2
+    assert limiter.used == 50
+
+
+def test_embedder_packs_texts_and_keeps_their_order(ml_index_update, fake_endpoint):
+    embedder = create_embedder(ml_index_update, fake_endpoint, batch_tokens=10, batch_size=16)
+    texts = ["aaaaaa", "bb", "cccc", "d", "eeeeeeeee"]
+    try:
+        vectors = embedder.embed(texts)
+    finally:
+        embedder.close()
+
+    assert [vector[0] for vector in vectors] == [float(len(text)) for text in texts]
+    # First-fit decreasing over 9, 6, 4, 2, 1 tokens: [9, 1], [6, 4], [2]
+    assert sorted(sum(len(text) for text in batch) for batch in fake_endpoint.requests) == [2, 10, 10]
+    assert embedder.summary()["requests"] == len(fake_endpoint.requests) == 3
+
+
+def test_embedder_retries_throttled_requests(ml_index_update, fake_endpoint):
+    fake_endpoint.throttle = 2
+    embedder = create_embedder(ml_index_update, fake_endpoint, concurrency=1, tokens_per_minute=1000)
+    try:
+        vectors = embedder.embed(["hello", "world!"])
+    finally:
+        embedder.close()
+
+    assert [vector[0] for vector in vectors] == [5.0, 6.0]
+    summary = embedder.summary()
+    assert summary["retries"] == 2
+    assert summary["requests"] == 1
+    assert len(fake_endpoint.requests) == 3
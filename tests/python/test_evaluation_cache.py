@@ -0,0 +1,38 @@
+ROWS = [{ "question": str(i), "answer": "a", "truth": "a" if i % 2 else "b" } for i in range(4)]
+
+
+def count_evaluations(function_call_evaluate, monkeypatch, artifacts):
+    calls = []
+
+    def evaluate(subscription_id, resource_group_name, project_name, rows, name):
+        calls.append(len(rows))
+        return function_call_evaluate.LocalEvaluationResult({}, artifacts(rows))
+
+    monkeypatch.setattr(function_call_evaluate, "run_evaluate_part", evaluate)
+    return calls
+
+
+def evaluate_part(function_call_evaluate, cache, rows):
+    return function_call_evaluate.evaluate_part("azure", "s", "g", "p", rows, "n", cache)
+
+
+def test_cached_rows_are_not_evaluated_again(function_call_evaluate, monkeypatch, tmp_path):
+    calls = count_evaluations(function_call_evaluate, monkeypatch, lambda rows: { "f1": [float(row["answer"] == row["truth"]) for row in rows] })
+    cache = function_call_evaluate.EvaluationCache(str(tmp_path / "cache.db"), { "evaluator": "azure" })
+
+    evaluate_part(function_call_evaluate, cache, ROWS[:2])
+    result = evaluate_part(function_call_evaluate, cache, ROWS)
+    assert calls == [2, 2]
+    assert result.artifacts == { "f1": [0.0, 1.0, 0.0, 1.0] }
+    assert cache.has_per_row_scores() is True
+
+
+def test_evaluator_without_per_row_scores_runs_once_per_part(function_call_evaluate, monkeypatch, tmp_path):
+    calls = count_evaluations(function_call_evaluate, monkeypatch, lambda rows: { "summary": "table.json" })
+    cache = function_call_evaluate.EvaluationCache(str(tmp_path / "cache.db"), { "evaluator": "azure" })
+
+    evaluate_part(function_call_evaluate, cache, ROWS[:2])
+    assert cache.has_per_row_scores() is False
+    result = evaluate_part(function_call_evaluate, cache, ROWS)
+    assert calls == [2, 4]
+    assert result.artifacts == { "summary": "table.json" }
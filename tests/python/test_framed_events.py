@@ -0,0 +1,35 @@
+import io
+import json
+
+
+def read_frames(text):
+    frames = []
+    position = text.find("\x1e")
+    while position >= 0:
+        space = text.index(" ", position)
+        length = int(text[position + 1:space])
+        frames.append(json.loads(text[space + 1:space + 1 + length]))
+        position = text.find("\x1e", space + 1 + length)
+    return frames
+
+
+def run_events(function_call_run, rows):
+    stream = io.StringIO()
+    events = function_call_run.FramedEventWriter(stream, progress_interval=0)
+    stats = function_call_run.RunStats()
+    results = [{ "question": str(i), "answer": str(i) } for i in range(3)]
+    assert list(function_call_run.iter_events(iter(results), events, stats, rows)) == results
+    events.write("printed\n")
+    events.event({ "type": "payload", "text": json.dumps(results) })
+    return read_frames(stream.getvalue())
+
+
+def test_row_frames_are_opt_in(function_call_run):
+    types = [frame["type"] for frame in run_events(function_call_run, rows=False)]
+    assert types == ["progress"] * 3 + ["log", "payload"]
+
+
+def test_row_frames(function_call_run):
+    frames = run_events(function_call_run, rows=True)
+    assert [frame["result"]["question"] for frame in frames if frame["type"] == "row"] == ["0", "1", "2"]
+    assert frames[-2] == { "type": "log", "text": "printed\n" }
@@ -0,0 +1,37 @@
+import pytest
+
+SCRIPTS = ["function_call_run", "function_call_evaluate"]
+ROW = { "question": "q0", "temperature": 1 }
+
+
+def call(script, fn, row = ROW):
+    style, adapter = script.create_call_adapter(fn)
+    args, kwargs = adapter("messages", "stream", "session_state", "context", "question", dict(row))
+    return style, fn(*args, **kwargs)
+
+
+@pytest.mark.parametrize("name", SCRIPTS)
+def test_question_with_var_keyword_gets_question(load_script, name):
+    script = load_script(name)
+
+    def f(question, **kwargs):
+        return "K:" + question
+    assert call(script, f) == ("fields", "K:q0")
+
+
+@pytest.mark.parametrize("name", SCRIPTS)
+def test_var_positional_gets_question(load_script, name):
+    script = load_script(name)
+
+    def f(*args):
+        return "S:" + "|".join(args)
+    assert call(script, f) == ("question", "S:q0")
+
+
+@pytest.mark.parametrize("name", SCRIPTS)
+def test_var_keyword_only_gets_messages(load_script, name):
+    script = load_script(name)
+
+    def f(**kwargs):
+        return kwargs["messages"][-1]["content"]
+    assert call(script, f) == ("messages", "q0")
@@ -0,0 +1,59 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+
+def chat_chunk(content, usage = None):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))], usage=usage)
+
+
+CHUNKS = [chat_chunk("Hel"), chat_chunk("lo"), chat_chunk(None, usage=SimpleNamespace(total_tokens=12))]
+
+
+class Stream:
+    """Stands in for openai.Stream, which is recognized by its type's name and module."""
+    __module__ = "openai._streaming"
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+
+class AsyncStream:
+    __module__ = "openai._streaming"
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def test_async_generator(function_call_run):
+    async def answer():
+        yield "a"
+        yield "b"
+    metrics = {}
+    run = function_call_run
+    assert run.is_async_answer(answer())
+    assert asyncio.run(run.get_async_answer(answer(), metrics, time.perf_counter())) == "a\nb"
+    assert "time_to_first_item_ms" in metrics
+
+
+def test_openai_stream(function_call_run):
+    metrics = {}
+    assert function_call_run.get_answer(Stream(CHUNKS), metrics, time.perf_counter()) == "Hello"
+    assert "time_to_first_item_ms" in metrics
+    assert metrics["total_tokens"] == 12
+
+
+def test_openai_async_stream(function_call_run):
+    metrics = {}
+    run = function_call_run
+    assert run.is_async_answer(AsyncStream(CHUNKS))
+    assert asyncio.run(run.get_async_answer(AsyncStream(CHUNKS), metrics, time.perf_counter())) == "Hello"
+    assert "time_to_first_item_ms" in metrics
+    assert metrics["total_tokens"] == 12
@@ -0,0 +1,11 @@
+import asyncio
+
+import pytest
+
+
+@pytest.mark.parametrize("request_json", [[1], "x", 3, None])
+def test_non_object_request_gets_error_response(function_call, request_json):
+    response = asyncio.run(function_call.worker_call(request_json))
+    assert response["id"] is None
+    assert response["ok"] is False
+    assert response["exception"] == "TypeError"
@@ -0,0 +1,34 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+
+def random_vectors(rng, count, dimension = 16):
+    vectors = rng.standard_normal((count, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def upsert(store, ids, vectors):
+    store.upsert([{ "id": id, "content": id } for id in ids], list(vectors))
+
+
+def test_ivf_search_finds_rows_upserted_after_build(ml_index_update, tmp_path):
+    store = ml_index_update.LocalVectorStore(str(tmp_path))
+    rng = np.random.default_rng(0)
+    upsert(store, [f"old{i}" for i in range(500)], random_vectors(rng, 500))
+    store.build_ivf(8)
+
+    # Delete some rows so their slots are reused, then add new rows and change existing ones
+    store.delete([f"old{i}" for i in range(100)])
+    added = random_vectors(rng, 200)
+    upsert(store, [f"new{i}" for i in range(200)], added)
+    changed = random_vectors(rng, 50)
+    upsert(store, [f"old{i}" for i in range(100, 150)], changed)
+    store.close()
+
+    store = ml_index_update.LocalVectorStore(str(tmp_path))
+    for vector in np.concatenate([added, changed]):
+        # Every list probed is the same as an exact search
+        assert store.search(vector, top=10, nprobe=8) == store.search(vector, top=10)
+        assert store.search(vector, top=1, nprobe=1)[0][1] == pytest.approx(1.0, abs=1e-5)
+    store.close()
@@ -0,0 +1,149 @@
+import io
+import zipfile
+
+import pytest
+
+W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+A = "http://schemas.openxmlformats.org/drawingml/2006/main"
+S = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+
+
+def office_file(parts):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as archive:
+        for name, xml in parts.items():
+            archive.writestr(name, xml)
+    return data.getvalue()
+
+
+def test_unsupported_files_are_skipped(ml_index_update, tmp_path, capsys):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "a.md").write_text("# a")
+    (tmp_path / "sub" / "b.txt").write_text("b")
+    (tmp_path / "sub" / "c.csv").write_text("x,y")
+    (tmp_path / "sub" / "img.png").write_bytes(b"\x89PNG\r\n\x1a\n")
+    (tmp_path / "sub" / "old.doc").write_bytes(b"\xd0\xcf\x11\xe0")
+    paths = list(ml_index_update.iter_data_files(str(tmp_path) + "/", "**/*"))
+    assert paths == ["a.md", "sub/b.txt", "sub/c.csv"]
+    output = capsys.readouterr().out
+    assert "Skipping unsupported file: sub/img.png" in output
+    assert "Skipping unsupported file: sub/old.doc" in output
+
+
+# Text formats build_index read are read as their text; only HTML markup is stripped
+TEXT_DOCUMENTS = [
+    ("notes.txt", "first line\n\nsecond paragraph\n", "first line\n\nsecond paragraph\n"),
+    ("README.md", "# Title\n\n* item \u00e9\n", "# Title\n\n* item \u00e9\n"),
+    ("script.py", "def f():\n    return 1\n", "def f():\n    return 1\n"),
+    ("table.csv", "name,price\nwidget,3\n", "name,price\nwidget,3\n"),
+    ("data.json", '{"name": "widget", "price": 3}', '{"name": "widget", "price": 3}'),
+    ("page.html", "<html><head><title>T</title><script>x()</script></head><body><p>One</p><p>Two</p></body></html>", "\n\nOne\n\n\n\nTwo\n\n"),
+]
+
+
+@pytest.mark.parametrize("name, text, expected", TEXT_DOCUMENTS)
+def test_read_text_documents(ml_index_update, name, text, expected):
+    assert ml_index_update.read_document(name, text.encode("utf-8")) == expected
+
+
+def test_chunk_file_splits_on_paragraphs(ml_index_update, tmp_path):
+    (tmp_path / "doc.md").write_text("para one\n\npara two\n")
+    _, size, chunks = ml_index_update.chunk_file(str(tmp_path) + "/", "doc.md", 3, 0, "https://example.com/docs/")
+    assert size == len("para one\n\npara two\n")
+    assert [chunk["content"] for chunk in chunks] == ["para one", "para two"]
+    assert chunks[0]["filepath"] == "doc.md"
+    assert chunks[0]["title"] == "doc"
+    assert chunks[0]["url"] == "https://example.com/docs/doc.md"
+
+
+def test_read_docx(ml_index_update):
+    data = office_file({ "word/document.xml": f'<w:document xmlns:w="{W}"><w:body>'
+        '<w:p><w:r><w:t>Hello </w:t></w:r><w:r><w:t>world</w:t></w:r></w:p><w:p/><w:p><w:r><w:t>Second</w:t></w:r></w:p>'
+        '</w:body></w:document>' })
+    assert ml_index_update.read_document("doc.docx", data) == "Hello world\n\nSecond"
+
+
+def test_read_pptx_in_slide_order(ml_index_update):
+    slide = lambda text: f'<p:sld xmlns:p="p" xmlns:a="{A}"><a:p><a:r><a:t>{text}</a:t></a:r></a:p></p:sld>'
+    data = office_file({ "ppt/slides/slide10.xml": slide("ten"), "ppt/slides/slide2.xml": slide("two"), "ppt/slides/_rels/slide2.xml.rels": "<r/>" })
+    assert ml_index_update.read_document("deck.pptx", data) == "two\n\nten"
+
+
+def test_read_xlsx(ml_index_update):
+    data = office_file({
+        "xl/sharedStrings.xml": f'<sst xmlns="{S}"><si><t>name</t></si><si><t>widget</t></si></sst>',
+        "xl/worksheets/sheet1.xml": f'<worksheet xmlns="{S}"><sheetData>'
+            '<row><c t="s"><v>0</v></c><c t="inlineStr"><is><t>price</t></is></c></row>'
+            '<row><c t="s"><v>1</v></c><c><v>3</v></c></row>'
+            '</sheetData></worksheet>',
+        "xl/worksheets/sheet2.xml": f'<worksheet xmlns="{S}"><sheetData><row><c><v>42</v></c></row></sheetData></worksheet>',
+    })
+    assert ml_index_update.read_document("book.xlsx", data) == "name\tprice\nwidget\t3\n\n42"
+
+
+# The MLIndex build_index wrote for an acs index, with the connections below
+BUILD_INDEX_ML_INDEX = {
+    "embeddings": {
+        "api_base": "https://contoso.openai.azure.com/",
+        "api_type": "azure",
+        "api_version": "2023-07-01-preview",
+        "connection": { "id": "/subscriptions/sub/resourceGroups/rg/providers/Microsoft.MachineLearningServices/workspaces/project/connections/Default_AzureOpenAI" },
+        "connection_type": "workspace_connection",
+        "deployment": "text-embedding-ada-002",
+        "dimension": 1536,
+        "kind": "open_ai",
+        "model": "text-embedding-ada-002",
+        "schema_version": "2",
+    },
+    "index": {
+        "api_version": "2023-11-01",
+        "connection": { "id": "/subscriptions/sub/resourceGroups/rg/providers/Microsoft.MachineLearningServices/workspaces/project/connections/AzureAISearch" },
+        "connection_type": "workspace_connection",
+        "endpoint": "https://contoso.search.windows.net/",
+        "engine": "azure-sdk",
+        "field_mapping": {
+            "content": "content",
+            "embedding": "contentVector",
+            "filename": "filepath",
+            "metadata": "meta_json_string",
+            "title": "title",
+            "url": "url",
+        },
+        "index": "product-info",
+        "kind": "acs",
+        "semantic_configuration_name": "azureml-default",
+    },
+}
+
+
+def test_ml_index_matches_build_index(ml_index_update, tmp_path):
+    import json
+    from types import SimpleNamespace
+
+    openai_connection = SimpleNamespace(target=BUILD_INDEX_ML_INDEX["embeddings"]["api_base"], api_version="2023-07-01-preview",
+        id=BUILD_INDEX_ML_INDEX["embeddings"]["connection"]["id"])
+    search_connection = SimpleNamespace(target=BUILD_INDEX_ML_INDEX["index"]["endpoint"], id=BUILD_INDEX_ML_INDEX["index"]["connection"]["id"])
+    ml_index_update.write_ml_index(str(tmp_path), "product-info", openai_connection, search_connection,
+        "text-embedding-ada-002", "text-embedding-ada-002", 1536)
+    with open(tmp_path / "MLIndex", encoding="utf-8") as f:
+        assert json.load(f) == BUILD_INDEX_ML_INDEX
+
+
+# The fields of the acs index build_index created, by kind
+BUILD_INDEX_FIELDS = {
+    "id": "simple",
+    "content": "searchable",
+    "title": "searchable",
+    "filepath": "simple",
+    "url": "simple",
+    "meta_json_string": "simple",
+    "contentVector": "vector",
+}
+
+
+def test_search_index_fields_match_build_index(ml_index_update):
+    store = ml_index_update.AzureSearchStore
+    assert { name: kind for name, kind, _ in store.FIELDS } == BUILD_INDEX_FIELDS
+    assert [name for name, _, attributes in store.FIELDS if attributes.get("key")] == ["id"]
+    # Every field the MLIndex maps must exist in the index
+    assert set(store.FIELD_MAPPING.values()) <= set(BUILD_INDEX_FIELDS)
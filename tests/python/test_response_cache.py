@@ -0,0 +1,33 @@
+FIELDS = ("messages", "stream", "session_state", "context", "question")
+
+
+def keys_for(run, fn, rows, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "target.py").write_text("def f(): pass\n")
+    cache = run.ResponseCache(str(tmp_path / "cache.db"), "target", "f")
+    try:
+        _, adapter = run.create_call_adapter(fn)
+        return [cache.key(*adapter(*FIELDS, row)) for row in rows]
+    finally:
+        cache.close()
+
+
+def test_key_covers_every_argument(function_call_run, tmp_path, monkeypatch):
+    def f(question, temperature = 0):
+        return question
+    first, second = keys_for(function_call_run, f, [{ "question": "q7", "temperature": 1 }, { "question": "q7", "temperature": 11 }], tmp_path, monkeypatch)
+    assert first != second
+
+
+def test_key_covers_stream_and_session_state(function_call_run, tmp_path, monkeypatch):
+    def f(messages, stream = False, session_state = None):
+        return messages
+    rows = [{ "question": "q" }, { "question": "q", "stream": True }, { "question": "q", "session_state": { "id": 1 } }]
+    assert len(set(keys_for(function_call_run, f, rows, tmp_path, monkeypatch))) == 3
+
+
+def test_key_ignores_fields_not_passed(function_call_run, tmp_path, monkeypatch):
+    def f(question):
+        return question
+    first, second = keys_for(function_call_run, f, [{ "question": "q", "truth": "a" }, { "question": "q", "truth": "b" }], tmp_path, monkeypatch)
+    assert first == second
@@ -0,0 +1,34 @@
+import pytest
+
+MODULE = '''
+def answer(question):
+    if question == "q1":
+        raise TypeError("inner bug")
+    return "a " + question
+'''
+
+DATASET = [{ "question": f"q{i}", "truth": "t" } for i in range(3)]
+
+
+@pytest.fixture
+def module_dir(tmp_path, monkeypatch):
+    (tmp_path / "run_results_module.py").write_text(MODULE)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    return tmp_path
+
+
+def test_results_keep_the_baseline_shape(function_call_run, module_dir):
+    results = function_call_run.bulk_run("run_results_module", "answer", DATASET)
+    assert results == [
+        { "question": "q0", "truth": "t", "answer": "a q0", "context": "" },
+        { "question": "q2", "truth": "t", "answer": "a q2", "context": "" },
+    ]
+
+
+def test_results_with_metrics_include_failed_rows(function_call_run, module_dir):
+    results = function_call_run.bulk_run("run_results_module", "answer", DATASET, include_metrics=True)
+    assert [result["answer"] for result in results] == ["a q0", None, "a q2"]
+    assert results[1]["error"] == "TypeError: inner bug"
+    assert "error" not in results[1]["metrics"]
+    assert "latency_ms" in results[0]["metrics"]
@@ -0,0 +1,31 @@
+import math
+
+
+def test_fully_sampled_single_row_stratum_adds_no_variance(function_call_evaluate):
+    per_row = [{ "f1": 0.5 }, { "f1": 0.7 }, { "f1": 0.9 }, { "f1": 1.0 }]
+    strata = ["a", "a", "a", "b"]
+    intervals = function_call_evaluate.estimate_confidence_intervals(per_row, strata, { "a": 100, "b": 1 }, 1.96)
+    assert math.isfinite(intervals["f1"]["width"])
+    assert intervals["f1"]["width"] > 0
+
+
+def test_partly_sampled_single_row_stratum_is_unbounded(function_call_evaluate):
+    per_row = [{ "f1": 0.5 }, { "f1": 0.7 }, { "f1": 1.0 }]
+    strata = ["a", "a", "b"]
+    intervals = function_call_evaluate.estimate_confidence_intervals(per_row, strata, { "a": 100, "b": 2 }, 1.96)
+    assert intervals["f1"]["width"] == math.inf
+
+
+def test_function_is_resolved_once_across_rounds(function_call_evaluate, monkeypatch):
+    resolved = []
+
+    def get_function(module_path, function_name):
+        resolved.append(function_name)
+        return lambda question: question
+
+    monkeypatch.setattr(function_call_evaluate, "get_function", get_function)
+    dataset = [{ "question": str(i % 3), "truth": "0" } for i in range(40)]
+    sampling = { "ci_width": 0.0, "batch_size": 10, "min_rows": 1 }
+    result = function_call_evaluate.run_and_or_evaluate("s", "g", "p", "fns:echo", dataset, "n", evaluator="local", sampling=sampling)
+    assert result["sampled_rows"] == 40
+    assert resolved == ["echo"]